@@ -0,0 +1,350 @@
+"""
+Player aliases and fuzzy name matching
+
+Names come from OCR, so one player shows up as "Nabi", "nabi" and "Nabí".
+player_aliases maps each alias to its canonical player, and the projections
+count the alias's games for that player. Merging an alias into a player (or
+undoing it) corrects only the games that name any of the players involved:
+their participants are re-pointed and their counters moved, in one
+transaction holding the tenant's write lock.
+
+When a game names a player nobody has seen, the trigram index of the
+tenant's canonical players looks for a match. With PLAYER_ALIAS_AUTO
+(default on), a name within PLAYER_ALIAS_AUTO_DISTANCE edits (default 0) of
+exactly one player after folding case, accents and spaces becomes that
+player's alias. Fuzzier matches are only suggested, see suggest_players().
+"""
+import json
+import os
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime
+
+from db_router import router
+from projections import (
+    PROJECTIONS,
+    REPLAY_CHUNK_SIZE,
+    canonical_game,
+    catch_up,
+    get_aliases,
+    lock_tenant_events,
+    player_names,
+)
+from storage import get_backend
+
+# Players compared by edit distance per lookup, out of those sharing the most trigrams
+CANDIDATES = 50
+
+# Trigram (Dice) similarity below which a name is not suggested
+MIN_SIMILARITY = 0.3
+
+
+def auto_enabled():
+    return os.getenv('PLAYER_ALIAS_AUTO', 'true').lower() in ('1', 'true', 'yes')
+
+
+def auto_distance():
+    return int(os.getenv('PLAYER_ALIAS_AUTO_DISTANCE', 0))
+
+
+def fold(name):
+    """Lowercase name without accents and with single spaces, for matching"""
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def trigrams(folded):
+    padded = f'  {folded} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 once it is certain to exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class NameIndex:
+    """Trigram index over the canonical player names of a tenant"""
+
+    def __init__(self, names):
+        self.names = sorted(names)
+        self._folded = [fold(name) for name in self.names]
+        self._trigram_counts = [len(trigrams(folded)) for folded in self._folded]
+        self._postings = {}  # trigram -> positions in names
+        for position, folded in enumerate(self._folded):
+            for trigram in trigrams(folded):
+                self._postings.setdefault(trigram, []).append(position)
+
+    def search(self, name, limit=5, max_distance=3):
+        """
+        Players closest to name, best first, as dicts with name, distance
+        (edits after folding) and similarity (share of trigrams in common)
+        """
+        folded = fold(name)
+        query = trigrams(folded)
+        shared = Counter()
+        for trigram in query:
+            shared.update(self._postings.get(trigram, ()))
+
+        matches = []
+        for position, count in shared.most_common(CANDIDATES):
+            similarity = 2 * count / (len(query) + self._trigram_counts[position])
+            if similarity < MIN_SIMILARITY:
+                continue
+            distance = edit_distance(folded, self._folded[position], max_distance)
+            if distance <= max_distance:
+                matches.append({'name': self.names[position], 'distance': distance,
+                                'similarity': round(similarity, 3)})
+        matches.sort(key=lambda match: (match['distance'], -match['similarity'], match['name']))
+        return matches[:limit]
+
+
+# Per process: tenant_id -> (fingerprint of players and aliases, NameIndex)
+_name_indexes = {}
+_name_indexes_lock = threading.Lock()
+
+
+def get_name_index(cursor, tenant_id):
+    """The tenant's NameIndex, rebuilt when players or aliases changed since it was built"""
+    cursor.execute('''
+        SELECT (SELECT COUNT(*) FROM players WHERE tenant_id = %s),
+               (SELECT MAX(id) FROM players WHERE tenant_id = %s),
+               (SELECT COUNT(*) FROM player_aliases WHERE tenant_id = %s),
+               (SELECT MAX(created_at) FROM player_aliases WHERE tenant_id = %s)
+    ''', (tenant_id,) * 4)
+    fingerprint = tuple(cursor.fetchone())
+    with _name_indexes_lock:
+        cached = _name_indexes.get(tenant_id)
+    if cached is not None and cached[0] == fingerprint:
+        return cached[1]
+
+    cursor.execute('''
+        SELECT name FROM players p
+        WHERE tenant_id = %s
+          AND NOT EXISTS (SELECT 1 FROM player_aliases a WHERE a.tenant_id = p.tenant_id AND a.alias = p.name)
+    ''', (tenant_id,))
+    index = NameIndex(row[0] for row in cursor.fetchall())
+    with _name_indexes_lock:
+        _name_indexes[tenant_id] = (fingerprint, index)
+    return index
+
+
+def alias_version(cursor, tenant_id):
+    """Counter of the tenant's alias changes, 0 before the first"""
+    cursor.execute('SELECT version FROM alias_versions WHERE tenant_id = %s', (tenant_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def bump_alias_version(cursor, tenant_id):
+    """Record a change of the tenant's aliases, within the transaction making it"""
+    cursor.execute('''
+        INSERT INTO alias_versions (tenant_id, version) VALUES (%s, 1)
+        ON CONFLICT (tenant_id) DO UPDATE SET version = alias_versions.version + 1
+    ''', (tenant_id,))
+
+
+def add_alias(cursor, tenant_id, alias, canonical, automatic):
+    cursor.execute('DELETE FROM player_aliases WHERE tenant_id = %s AND alias = %s', (tenant_id, alias))
+    cursor.execute('''
+        INSERT INTO player_aliases (tenant_id, alias, canonical, automatic, created_at)
+        VALUES (%s, %s, %s, %s, %s)
+    ''', (tenant_id, alias, canonical, automatic, datetime.now()))
+    bump_alias_version(cursor, tenant_id)
+
+
+def resolve_new_players(cursor, tenant_id, game_data):
+    """
+    Make names of game_data that are neither a player nor an alias an alias
+    of the one player they match (see the module docstring); the caller holds
+    the tenant's write lock. Returns {alias: player} of the aliases added.
+    """
+    if not auto_enabled():
+        return {}
+    names = player_names(game_data)
+    cursor.execute('SELECT name FROM players WHERE tenant_id = %s AND name = ANY(%s)', (tenant_id, sorted(names)))
+    unknown = names - {row[0] for row in cursor.fetchall()} - set(get_aliases(cursor, tenant_id, names))
+    if not unknown:
+        return {}
+
+    index = get_name_index(cursor, tenant_id)
+    added = {}
+    for name in sorted(unknown):
+        matches = index.search(name, limit=2, max_distance=auto_distance())
+        # Two players of the same game are two people, however alike their names
+        if len(matches) == 1 and matches[0]['name'] not in names:
+            add_alias(cursor, tenant_id, name, matches[0]['name'], True)
+            added[name] = matches[0]['name']
+    return added
+
+
+def correct_games(conn, tenant_id, old_aliases, new_aliases):
+    """
+    Move the projections of the games affected by a change of aliases from
+    old_aliases to new_aliases; returns {game_id: game data with the new
+    canonical names} of the games that changed
+    """
+    changed = {name for name in set(old_aliases) | set(new_aliases)
+               if old_aliases.get(name, name) != new_aliases.get(name, name)}
+    if not changed:
+        return {}
+
+    # Games naming any of these have participants under their old canonical names
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT DISTINCT gp.game_id
+        FROM game_participants gp
+        JOIN players p ON p.id = gp.player_id
+        WHERE gp.tenant_id = %s AND p.name = ANY(%s)
+    ''', (tenant_id, sorted({old_aliases.get(name, name) for name in changed})))
+    game_ids = sorted(row[0] for row in cursor.fetchall())
+
+    updated = {}
+    for start in range(0, len(game_ids), REPLAY_CHUNK_SIZE):
+        cursor.execute('SELECT id, raw_data FROM games WHERE tenant_id = %s AND id = ANY(%s)',
+                       (tenant_id, game_ids[start:start + REPLAY_CHUNK_SIZE]))
+        corrections = []
+        for game_id, raw_data in cursor.fetchall():
+            game_data = json.loads(raw_data)
+            if player_names(game_data) & changed:
+                before = canonical_game(game_data, old_aliases)
+                after = canonical_game(game_data, new_aliases)
+                corrections.append({'game_id': game_id, 'previous': before, 'data': after})
+                updated[game_id] = after
+        for projection in PROJECTIONS:
+            projection.apply(cursor, tenant_id, corrections)
+    return updated
+
+
+def shared_game(cursor, tenant_id, alias, source, target):
+    """
+    A game in which alias and target both played, or None; source is the
+    player alias currently counts for
+    """
+    cursor.execute('''
+        SELECT DISTINCT a.game_id
+        FROM game_participants a
+        JOIN game_participants b ON b.game_id = a.game_id AND b.tenant_id = a.tenant_id
+        WHERE a.tenant_id = %s
+          AND a.player_id = (SELECT id FROM players WHERE tenant_id = %s AND name = %s)
+          AND b.player_id = (SELECT id FROM players WHERE tenant_id = %s AND name = %s)
+        ORDER BY a.game_id
+    ''', (tenant_id, tenant_id, source, tenant_id, target))
+    game_ids = [row[0] for row in cursor.fetchall()]
+    if alias == source:
+        return game_ids[0] if game_ids else None
+
+    # alias is a name of another player: only the games recorded under that name count
+    for start in range(0, len(game_ids), REPLAY_CHUNK_SIZE):
+        cursor.execute('SELECT id, raw_data FROM games WHERE tenant_id = %s AND id = ANY(%s) ORDER BY id',
+                       (tenant_id, game_ids[start:start + REPLAY_CHUNK_SIZE]))
+        for game_id, raw_data in cursor.fetchall():
+            if alias in player_names(json.loads(raw_data)):
+                return game_id
+    return None
+
+
+def merge_players(tenant_id, alias, canonical):
+    """
+    Make alias (and its own aliases) an alias of canonical, or of the player
+    canonical is an alias of. Raises ValueError for an unknown player, a
+    merge into itself or two players who played in the same game. Returns
+    (canonical name, {game_id: corrected data}).
+    """
+    conn = get_backend().connect()
+    try:
+        cursor = conn.cursor()
+        lock_tenant_events(cursor, tenant_id)
+        # Corrections assume the projections include every event
+        catch_up(conn, tenant_id)
+
+        old_aliases = get_aliases(cursor, tenant_id)
+        target = old_aliases.get(canonical, canonical)
+        if target == alias:
+            raise ValueError(f"{alias} cannot be merged into itself")
+        cursor.execute('SELECT 1 FROM players WHERE tenant_id = %s AND name = %s', (tenant_id, target))
+        if cursor.fetchone() is None:
+            raise ValueError(f"Player {canonical} not found")
+        source = old_aliases.get(alias, alias)
+        if alias == source:
+            cursor.execute('SELECT 1 FROM players WHERE tenant_id = %s AND name = %s', (tenant_id, alias))
+            if cursor.fetchone() is None:
+                raise ValueError(f"Player {alias} not found")
+        if source != target:
+            game_id = shared_game(cursor, tenant_id, alias, source, target)
+            if game_id is not None:
+                raise ValueError(f"{alias} and {target} both played in game #{game_id}, so they are different players")
+
+        new_aliases = {name: target if player == alias else player for name, player in old_aliases.items()}
+        new_aliases[alias] = target
+        # Aliases first: consistency.py's swap relies on merges locking them before the counters
+        add_alias(cursor, tenant_id, alias, target, False)
+        cursor.execute('UPDATE player_aliases SET canonical = %s WHERE tenant_id = %s AND canonical = %s',
+                       (target, tenant_id, alias))
+        updated = correct_games(conn, tenant_id, old_aliases, new_aliases)
+        conn.commit()
+        router.mark_write(tenant_id, cursor)
+    finally:
+        conn.close()
+    return target, updated
+
+
+def unmerge_player(tenant_id, alias):
+    """
+    Make alias a player of its own again; raises ValueError if it is not an
+    alias. Returns {game_id: corrected data}.
+    """
+    conn = get_backend().connect()
+    try:
+        cursor = conn.cursor()
+        lock_tenant_events(cursor, tenant_id)
+        catch_up(conn, tenant_id)
+
+        old_aliases = get_aliases(cursor, tenant_id)
+        if alias not in old_aliases:
+            raise ValueError(f"{alias} is not an alias")
+        new_aliases = {name: player for name, player in old_aliases.items() if name != alias}
+        cursor.execute('DELETE FROM player_aliases WHERE tenant_id = %s AND alias = %s', (tenant_id, alias))
+        bump_alias_version(cursor, tenant_id)
+        updated = correct_games(conn, tenant_id, old_aliases, new_aliases)
+        conn.commit()
+        router.mark_write(tenant_id, cursor)
+    finally:
+        conn.close()
+    return updated
+
+
+def list_aliases(tenant_id):
+    conn = get_backend().connect()
+    try:
+        cursor = conn.cursor()
+        cursor.execute('''
+            SELECT alias, canonical, automatic, created_at FROM player_aliases
+            WHERE tenant_id = %s
+            ORDER BY canonical, alias
+        ''', (tenant_id,))
+        return [{'alias': alias, 'canonical': canonical, 'automatic': bool(automatic), 'created_at': created_at}
+                for alias, canonical, automatic, created_at in cursor.fetchall()]
+    finally:
+        conn.close()
+
+
+def suggest_players(tenant_id, name, limit=5, max_distance=3):
+    """Canonical players whose names are closest to name, see NameIndex.search"""
+    conn = get_backend().connect()
+    try:
+        return get_name_index(conn.cursor(), tenant_id).search(name, limit, max_distance)
+    finally:
+        conn.close()
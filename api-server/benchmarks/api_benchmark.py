@@ -0,0 +1,270 @@
+"""
+Benchmark harness for the API and database layer.
+
+Seeds the database at DATABASE_URL with synthetic games, then measures
+throughput and p50/p95/p99 latency for every API endpoint and for the
+save_game/update_game/delete_game write path.
+
+Usage:
+    python benchmarks/api_benchmark.py seed --games 5000 --players 200 --reset
+    python benchmarks/api_benchmark.py run --output before.json
+    python benchmarks/api_benchmark.py compare before.json after.json
+
+Use a throwaway database: --reset truncates every table.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+from synthetic import generate_games, to_request_body
+
+load_dotenv()
+
+# (name, method, path, body) for every read endpoint in main.py
+READ_ENDPOINTS = [
+    ('GET /', 'GET', '/', None),
+    ('GET /health', 'GET', '/health', None),
+    ('GET /api/stats/players', 'GET', '/api/stats/players', None),
+    ('GET /api/stats/players/by-role', 'GET', '/api/stats/players/by-role', None),
+    ('GET /api/stats/team-combinations', 'GET', '/api/stats/team-combinations?min_games=2', None),
+    ('GET /api/stats/team-combinations-with-roles', 'GET', '/api/stats/team-combinations-with-roles?min_games=2',
+     None),
+    ('GET /api/stats/total-games', 'GET', '/api/stats/total-games', None),
+    ('GET /api/games', 'GET', '/api/games', None),
+    ('GET /api/games/changes', 'GET', '/api/games/changes?since=0&limit=100', None),
+    ('POST /api/query', 'POST', '/api/query', {
+        'constraints': [{'player': 'Player00000', 'role': 'Spymaster'}, {'player': 'Player00001', 'role': 'Any'}],
+    }),
+]
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100.0 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+def summarize(latencies, wall_time):
+    """Summarize latencies (seconds) into the benchmark result format"""
+    latencies = sorted(latencies)
+    return {
+        'count': len(latencies),
+        'throughput_rps': round(len(latencies) / wall_time, 2) if wall_time else 0.0,
+        'mean_ms': round(1000 * sum(latencies) / len(latencies), 3) if latencies else 0.0,
+        'p50_ms': round(1000 * percentile(latencies, 50), 3),
+        'p95_ms': round(1000 * percentile(latencies, 95), 3),
+        'p99_ms': round(1000 * percentile(latencies, 99), 3),
+    }
+
+
+def measure(fn, args_list, concurrency):
+    """Call fn once per entry in args_list and collect per-call latencies"""
+    def timed(args):
+        start = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - start
+
+    wall_start = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            latencies = list(pool.map(timed, args_list))
+    else:
+        latencies = [timed(args) for args in args_list]
+    return summarize(latencies, time.perf_counter() - wall_start)
+
+
+def make_client(url):
+    """HTTP client against a running server, or the app in-process"""
+    if url:
+        import httpx
+        return httpx.Client(base_url=url, timeout=60.0)
+    # Every request comes from one client, which the rate limiter would throttle
+    os.environ.setdefault('RATE_LIMIT_ENABLED', 'false')
+    from fastapi.testclient import TestClient
+    from main import app
+    return TestClient(app)
+
+
+def reset_database():
+    from database import get_db_connection, init_database
+    from storage import get_backend
+    init_database()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    if get_backend().name == 'sqlite':
+        for table in ('game_participants', 'games', 'players', 'team_combinations', 'player_stats', 'game_events',
+                      'projection_checkpoints', 'player_aliases', 'alias_versions', 'sqlite_sequence'):
+            cursor.execute(f'DELETE FROM {table}')
+    else:
+        cursor.execute('TRUNCATE game_participants, games, players, team_combinations, player_stats, game_events, '
+                       'projection_checkpoints, player_aliases, alias_versions RESTART IDENTITY CASCADE')
+    conn.commit()
+    conn.close()
+
+
+def cmd_seed(args):
+    from database import init_database, save_game
+
+    if args.reset:
+        reset_database()
+    else:
+        init_database()
+
+    games = generate_games(args.games, args.players, args.min_team_size, args.max_team_size, args.seed)
+    start = time.perf_counter()
+    for i, game in enumerate(games, 1):
+        save_game(game)
+        if i % 1000 == 0:
+            print(f"Seeded {i}/{len(games)} games", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(f"Seeded {len(games)} games in {elapsed:.1f}s ({len(games) / elapsed:.1f} games/s)", file=sys.stderr)
+
+
+def cmd_run(args):
+    from database import save_game, update_game, delete_game
+
+    client = make_client(args.url)
+    results = {}
+
+    def request(method, path, body=None):
+        response = client.request(method, path, json=body)
+        response.raise_for_status()
+        return response
+
+    # Warm up every endpoint once so connection setup is not measured
+    for _, method, path, body in READ_ENDPOINTS:
+        request(method, path, body)
+
+    for name, method, path, body in READ_ENDPOINTS:
+        results[name] = measure(request, [(method, path, body)] * args.iterations, args.concurrency)
+        print(f"{name}: {results[name]}", file=sys.stderr)
+
+    # Write path through the API
+    games = generate_games(args.write_iterations, args.players, args.min_team_size, args.max_team_size,
+                           args.seed + 1)
+    created = []
+
+    def create(game):
+        created.append(request('POST', '/api/games', to_request_body(game)).json()['game_id'])
+
+    results['POST /api/games'] = measure(create, [(g,) for g in games], args.concurrency)
+    results['PUT /api/games/{id}'] = measure(
+        request, [('PUT', f'/api/games/{gid}', to_request_body(g)) for gid, g in zip(created, reversed(games))],
+        args.concurrency)
+    results['DELETE /api/games/{id}'] = measure(
+        request, [('DELETE', f'/api/games/{gid}') for gid in created], args.concurrency)
+
+    # Write path directly against database.py
+    db_ids = []
+    results['database.save_game'] = measure(lambda g: db_ids.append(save_game(g)), [(g,) for g in games],
+                                            args.concurrency)
+    results['database.update_game'] = measure(update_game, list(zip(db_ids, reversed(games))), args.concurrency)
+    results['database.delete_game'] = measure(delete_game, [(gid,) for gid in db_ids], args.concurrency)
+
+    for name in ('POST /api/games', 'PUT /api/games/{id}', 'DELETE /api/games/{id}',
+                 'database.save_game', 'database.update_game', 'database.delete_game'):
+        print(f"{name}: {results[name]}", file=sys.stderr)
+
+    report = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'target': args.url or 'in-process',
+            'iterations': args.iterations,
+            'write_iterations': args.write_iterations,
+            'concurrency': args.concurrency,
+            'players': args.players,
+            'min_team_size': args.min_team_size,
+            'max_team_size': args.max_team_size,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    write_report(report, args.output)
+
+
+def cmd_compare(args):
+    with open(args.baseline) as f:
+        baseline = json.load(f)['results']
+    with open(args.candidate) as f:
+        candidate = json.load(f)['results']
+
+    header = f"{'benchmark':48} {'metric':>14} {'baseline':>12} {'candidate':>12} {'change':>9}"
+    print(header)
+    print('-' * len(header))
+    for name in baseline:
+        if name not in candidate:
+            continue
+        for metric in ('throughput_rps', 'p50_ms', 'p95_ms', 'p99_ms'):
+            old, new = baseline[name][metric], candidate[name][metric]
+            change = f"{100.0 * (new - old) / old:+.1f}%" if old else 'n/a'
+            print(f"{name:48} {metric:>14} {old:>12} {new:>12} {change:>9}")
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return None
+
+
+def write_report(report, output):
+    text = json.dumps(report, indent=2)
+    if output:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def add_data_arguments(parser):
+    parser.add_argument('--players', type=int, default=50, help='Player pool size')
+    parser.add_argument('--min-team-size', type=int, default=2)
+    parser.add_argument('--max-team-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Codenames API benchmark harness')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    seed = subparsers.add_parser('seed', help='Seed DATABASE_URL with synthetic games')
+    seed.add_argument('--games', type=int, default=1000, help='History length')
+    seed.add_argument('--reset', action='store_true', help='Truncate all tables first')
+    add_data_arguments(seed)
+    seed.set_defaults(func=cmd_seed)
+
+    run = subparsers.add_parser('run', help='Measure every endpoint and the write path')
+    run.add_argument('--url', help='Benchmark a running server instead of the app in-process')
+    run.add_argument('--iterations', type=int, default=50, help='Requests per read endpoint')
+    run.add_argument('--write-iterations', type=int, default=50, help='Games created/updated/deleted')
+    run.add_argument('--concurrency', type=int, default=1)
+    run.add_argument('--output', help='Write the JSON report here instead of stdout')
+    add_data_arguments(run)
+    run.set_defaults(func=cmd_run)
+
+    compare = subparsers.add_parser('compare', help='Compare two JSON reports')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.set_defaults(func=cmd_compare)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
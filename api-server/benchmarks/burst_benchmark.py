@@ -0,0 +1,123 @@
+"""
+Dashboard latency during a bot burst.
+
+Against a running server, a "bot" client hammers POST /api/games and the
+full GET /api/games export from several threads while a "dashboard" client
+loads the stats pages. The report has the dashboard's latency percentiles
+and the status codes the bot got. Run it once against a server with
+RATE_LIMIT_ENABLED=false and once with the limits on to see what they buy.
+
+The two clients are told apart by X-Forwarded-For, so start the server with
+RATE_LIMIT_CLIENT_HEADER=X-Forwarded-For.
+
+Usage:
+    python benchmarks/burst_benchmark.py --url http://localhost:8000 --duration 20 --output limited.json
+
+Games are created in the tenant given by --bot-tenant, which is wiped first.
+"""
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from api_benchmark import summarize, write_report
+from concurrency_stress import reset_tenant
+from synthetic import generate_game, generate_player_pool, to_request_body
+
+DASHBOARD_PATHS = [
+    '/api/stats/players',
+    '/api/stats/players/by-role',
+    '/api/stats/team-combinations?min_games=2',
+    '/api/stats/team-combinations-with-roles?min_games=2',
+    '/api/stats/total-games',
+]
+
+
+def bot(args, stop, statuses, lock, worker_index):
+    rng = random.Random(args.seed + worker_index)
+    players = generate_player_pool(args.players)
+    headers = {'X-Forwarded-For': '10.0.0.2', 'X-Tenant-ID': args.bot_tenant}
+    export_headers = {'X-Forwarded-For': '10.0.0.2', 'X-Tenant-ID': args.tenant}
+    with httpx.Client(base_url=args.url, timeout=60.0) as client:
+        while not stop.is_set():
+            if rng.random() < args.export_share:
+                response = client.get('/api/games', headers=export_headers)
+            else:
+                response = client.post('/api/games', json=to_request_body(generate_game(rng, players)),
+                                       headers=headers)
+            with lock:
+                statuses[response.status_code] += 1
+
+
+def dashboard(args, stop):
+    latencies, failures = [], 0
+    headers = {'X-Forwarded-For': '10.0.0.1', 'X-Tenant-ID': args.tenant}
+    with httpx.Client(base_url=args.url, timeout=60.0) as client:
+        while not stop.is_set():
+            for path in DASHBOARD_PATHS:
+                start = time.perf_counter()
+                response = client.get(path, headers=headers)
+                latencies.append(time.perf_counter() - start)
+                failures += response.status_code != 200
+            time.sleep(args.think_time)
+    return latencies, failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Dashboard latency while a bot bursts writes and exports')
+    parser.add_argument('--url', required=True, help='Running server')
+    parser.add_argument('--tenant', default='default', help='Tenant the dashboard reads and the bot exports')
+    parser.add_argument('--bot-tenant', default='burst-test', help='Throwaway tenant the bot writes to')
+    parser.add_argument('--bot-workers', type=int, default=8)
+    parser.add_argument('--export-share', type=float, default=0.2, help='Share of bot requests that export')
+    parser.add_argument('--players', type=int, default=12)
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds')
+    parser.add_argument('--think-time', type=float, default=0.2, help='Dashboard pause between page loads')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    reset_tenant(args.bot_tenant)
+    stop = threading.Event()
+    statuses, lock = Counter(), threading.Lock()
+    with ThreadPoolExecutor(max_workers=args.bot_workers + 1) as pool:
+        board = pool.submit(dashboard, args, stop)
+        for worker_index in range(args.bot_workers):
+            pool.submit(bot, args, stop, statuses, lock, worker_index)
+        time.sleep(args.duration)
+        stop.set()
+        latencies, failures = board.result()
+
+    dashboard_summary = summarize(latencies, args.duration)
+    print(f"Dashboard: p50 {dashboard_summary['p50_ms']} ms, p99 {dashboard_summary['p99_ms']} ms, "
+          f"{failures} failed; bot: {dict(statuses)}", file=sys.stderr)
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'target': args.url,
+            'bot_workers': args.bot_workers,
+            'export_share': args.export_share,
+            'duration_s': args.duration,
+        },
+        'results': {
+            'dashboard': dict(dashboard_summary, failures=failures),
+            'bot_statuses': {str(status): count for status, count in sorted(statuses.items())},
+        },
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,237 @@
+"""
+Concurrency stress test for editing games.
+
+Seeds a few games into a throwaway tenant, then has many threads edit them in
+parallel: some edits are conditional on the version they read (If-Match),
+the rest are unconditional. Afterwards it rebuilds the team combination
+counters, player stats and participants from the stored raw_data and checks
+that the incrementally maintained tables match, and that every game's
+version went up once per successful edit. Exits with status 1 on any
+mismatch.
+
+Edits call database.update_game directly, or PUT /api/games/{id} on a
+running server with --url.
+
+Usage:
+    python benchmarks/concurrency_stress.py --games 4 --workers 16 --edits 2000
+    python benchmarks/concurrency_stress.py --url http://localhost:8000
+
+Everything in the tenant given by --tenant is deleted first.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from api_benchmark import write_report
+from database import (
+    GameVersionConflict,
+    get_db_connection,
+    init_database,
+    save_game,
+    update_game,
+)
+from projections import get_all_combinations
+from synthetic import generate_game, generate_player_pool, to_request_body
+
+
+def reset_tenant(tenant_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    for table in ('game_participants', 'idempotency_keys', 'games', 'players', 'team_combinations',
+                  'player_stats', 'game_events', 'projection_checkpoints', 'player_aliases'):
+        cursor.execute(f'DELETE FROM {table} WHERE tenant_id = %s', (tenant_id,))
+    conn.commit()
+    conn.close()
+
+
+def read_game(game_id, tenant_id):
+    """Current version of a game, read from the primary"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT version FROM games WHERE id = %s AND tenant_id = %s', (game_id, tenant_id))
+    version = cursor.fetchone()[0]
+    conn.close()
+    return version
+
+
+def database_editor(tenant_id):
+    def edit(game_id, game, expected_version):
+        try:
+            update_game(game_id, game, tenant_id, expected_version)
+            return True
+        except GameVersionConflict:
+            return False
+    return edit
+
+
+def http_editor(url, tenant_id):
+    import httpx
+    local = threading.local()
+
+    def edit(game_id, game, expected_version):
+        if not hasattr(local, 'client'):
+            local.client = httpx.Client(base_url=url, timeout=60.0)
+        headers = {'X-Tenant-ID': tenant_id}
+        if expected_version is not None:
+            headers['If-Match'] = f'"{expected_version}"'
+        response = local.client.put(f'/api/games/{game_id}', json=to_request_body(game), headers=headers)
+        if response.status_code == 409:
+            return False
+        response.raise_for_status()
+        return True
+    return edit
+
+
+def check_counters(tenant_id):
+    """Compare the stored derived rows with a full rebuild from raw_data; return a list of differences"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT id, raw_data FROM games WHERE tenant_id = %s', (tenant_id,))
+    games = [(game_id, json.loads(raw_data)) for game_id, raw_data in cursor.fetchall()]
+
+    expected_combos = Counter()
+    expected_participants = Counter()
+    expected_player_stats = Counter()
+    for game_id, game in games:
+        for team_color in ('blue', 'red'):
+            team_data = game[f'{team_color}_team']
+            won = game['winner'].lower() == team_color
+            for role, key in (('Operative', 'operatives'), ('Spymaster', 'spymasters')):
+                for name in team_data[key]:
+                    expected_participants[(game_id, name, team_color.capitalize(), role, won)] += 1
+                    expected_player_stats[(name, role, 'wins' if won else 'losses')] += 1
+            for combo in get_all_combinations(team_data['operatives'] + team_data['spymasters']):
+                expected_combos[(combo, 'wins' if won else 'losses')] += 1
+
+    cursor.execute('SELECT player_names, wins, losses FROM team_combinations WHERE tenant_id = %s', (tenant_id,))
+    stored_combos = Counter()
+    for names, wins, losses in cursor.fetchall():
+        if wins:
+            stored_combos[(names, 'wins')] = wins
+        if losses:
+            stored_combos[(names, 'losses')] = losses
+
+    cursor.execute('''
+                   SELECT gp.game_id, p.name, gp.team, gp.role, gp.won
+                   FROM game_participants gp
+                   JOIN players p ON gp.player_id = p.id
+                   WHERE gp.tenant_id = %s
+                   ''', (tenant_id,))
+    stored_participants = Counter(tuple(row) for row in cursor.fetchall())
+
+    cursor.execute('SELECT name, role, wins, losses FROM player_stats WHERE tenant_id = %s', (tenant_id,))
+    stored_player_stats = Counter()
+    for name, role, wins, losses in cursor.fetchall():
+        if wins:
+            stored_player_stats[(name, role, 'wins')] = wins
+        if losses:
+            stored_player_stats[(name, role, 'losses')] = losses
+    conn.close()
+
+    differences = []
+    for key in sorted(set(expected_combos) | set(stored_combos)):
+        if expected_combos[key] != stored_combos[key]:
+            differences.append(f"team_combinations {key[0]} {key[1]}: "
+                               f"stored {stored_combos[key]}, rebuilt {expected_combos[key]}")
+    for key in sorted(set(expected_participants) | set(stored_participants), key=str):
+        if expected_participants[key] != stored_participants[key]:
+            differences.append(f"game_participants {key}: "
+                               f"stored {stored_participants[key]}, rebuilt {expected_participants[key]}")
+    for key in sorted(set(expected_player_stats) | set(stored_player_stats)):
+        if expected_player_stats[key] != stored_player_stats[key]:
+            differences.append(f"player_stats {key[0]} {key[1]} {key[2]}: "
+                               f"stored {stored_player_stats[key]}, rebuilt {expected_player_stats[key]}")
+    return differences
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent game edit stress test')
+    parser.add_argument('--url', help='Edit through a running server instead of calling update_game')
+    parser.add_argument('--tenant', default='stress-test', help='Throwaway tenant the games are created in')
+    parser.add_argument('--games', type=int, default=4, help='Games being edited (fewer means more contention)')
+    parser.add_argument('--players', type=int, default=12, help='Player pool size')
+    parser.add_argument('--workers', type=int, default=16)
+    parser.add_argument('--edits', type=int, default=2000, help='Edit attempts in total')
+    parser.add_argument('--conditional', type=float, default=0.5,
+                        help='Share of edits sent with If-Match on the version read just before')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    init_database()
+    reset_tenant(args.tenant)
+
+    players = generate_player_pool(args.players)
+    rng = random.Random(args.seed)
+    game_ids = [save_game(generate_game(rng, players), args.tenant) for _ in range(args.games)]
+
+    edit = http_editor(args.url, args.tenant) if args.url else database_editor(args.tenant)
+    applied = Counter()
+    conflicts = Counter()
+    lock = threading.Lock()
+
+    def worker(worker_index):
+        worker_rng = random.Random(args.seed * 1000 + worker_index)
+        for _ in range(args.edits // args.workers):
+            game_id = worker_rng.choice(game_ids)
+            game = generate_game(worker_rng, players)
+            expected_version = read_game(game_id, args.tenant) if worker_rng.random() < args.conditional else None
+            ok = edit(game_id, game, expected_version)
+            with lock:
+                (applied if ok else conflicts)[game_id] += 1
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.workers) as pool:
+        list(pool.map(worker, range(args.workers)))
+    elapsed = time.perf_counter() - start
+
+    differences = check_counters(args.tenant)
+    for game_id in game_ids:
+        version = read_game(game_id, args.tenant)
+        if version != 1 + applied[game_id]:
+            differences.append(f"game #{game_id}: version {version}, expected {1 + applied[game_id]}")
+
+    total = sum(applied.values()) + sum(conflicts.values())
+    print(f"{total} edits in {elapsed:.1f}s ({total / elapsed:.0f}/s): {sum(applied.values())} applied, "
+          f"{sum(conflicts.values())} rejected with a version conflict", file=sys.stderr)
+    for difference in differences[:20]:
+        print(f"MISMATCH {difference}", file=sys.stderr)
+    print("Counters match a full rebuild" if not differences else f"{len(differences)} mismatches",
+          file=sys.stderr)
+
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'target': args.url or 'update_game',
+            'games': args.games,
+            'players': args.players,
+            'workers': args.workers,
+            'conditional': args.conditional,
+            'seed': args.seed,
+        },
+        'results': {
+            'edits': total,
+            'applied': sum(applied.values()),
+            'conflicts': sum(conflicts.values()),
+            'edits_per_sec': round(total / elapsed, 1),
+            'mismatches': len(differences),
+        },
+    }, args.output)
+    sys.exit(1 if differences else 0)
+
+
+if __name__ == '__main__':
+    main()
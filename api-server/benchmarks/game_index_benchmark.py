@@ -0,0 +1,135 @@
+"""
+Benchmark for the in-memory bitmap game index.
+
+Builds the index from synthetic games (no database needed), then measures
+p50/p95/p99 latency of typical ad-hoc queries, the cost of the rebuild a merge
+or unmerge triggers, and query latency while that rebuild runs in a background
+thread, as it does in the server. The JSON report uses the same
+format as api_benchmark.py, so two runs can be compared with
+`api_benchmark.py compare`.
+
+Usage:
+    python benchmarks/game_index_benchmark.py --games 1000000 --players 500 --output index.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from api_benchmark import measure, summarize, write_report
+from game_index import GameIndex
+from synthetic import generate_player_pool, iter_games
+
+BASE_DATE = datetime(2024, 1, 1)
+
+
+def game_rows(args):
+    for game_id, game in enumerate(iter_games(args.games, args.players, args.min_team_size,
+                                              args.max_team_size, args.seed), 1):
+        yield game_id, BASE_DATE + timedelta(minutes=game_id), game
+
+
+def raw_rows(args):
+    """game_rows() as the database returns them, with the game data in JSON"""
+    return [(game_id, date, json.dumps(game)) for game_id, date, game in game_rows(args)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Bitmap game index benchmark')
+    parser.add_argument('--games', type=int, default=1000000)
+    parser.add_argument('--players', type=int, default=500, help='Player pool size')
+    parser.add_argument('--min-team-size', type=int, default=2)
+    parser.add_argument('--max-team-size', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=1000, help='Queries per query shape')
+    parser.add_argument('--aliases', type=int, default=50, help='Aliases applied by the rebuild')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    index = GameIndex()
+    start = time.perf_counter()
+    index.build(game_rows(args))
+    build_seconds = time.perf_counter() - start
+    print(f"Built index for {len(index)} games in {build_seconds:.1f}s, "
+          f"{index.memory_bytes() / 1e6:.1f} MB", file=sys.stderr)
+
+    rng = random.Random(args.seed)
+    players = generate_player_pool(args.players)
+    middle = BASE_DATE + timedelta(minutes=args.games // 2)
+
+    def constraints(count, role='Any', team=None):
+        picked = rng.sample(players, count)
+        return [{'player': name, 'role': role, **({'team': team} if team else {})} for name in picked]
+
+    query_shapes = {
+        'one player': lambda: (constraints(1), {}),
+        'spymaster + operative': lambda: (
+            [constraints(1, 'Spymaster')[0], constraints(1, 'Operative')[0]], {}),
+        'two players same team': lambda: (constraints(2, team='Blue'), {}),
+        'three players': lambda: (constraints(3), {}),
+        'one player + winner + date range': lambda: (
+            constraints(1), {'winner': 'Red', 'date_from': middle}),
+        'one player, page 10': lambda: (constraints(1), {'page': 10}),
+    }
+
+    results = {}
+    for name, make_query in query_shapes.items():
+        queries = [make_query() for _ in range(args.iterations)]
+        results[f'game_index.query: {name}'] = measure(
+            lambda query_constraints, kwargs: index.query(query_constraints, **kwargs), queries, 1)
+        print(f"{name}: {results[f'game_index.query: {name}']}", file=sys.stderr)
+
+    # A merge or unmerge rebuilds the tenant's index from raw_data under the new
+    # aliases; the database fetch comes on top of this
+    rows = raw_rows(args)
+    rebuilt = GameIndex()
+    rebuilt.aliases = {players[i]: players[i + 1] for i in range(0, min(2 * args.aliases, args.players - 1), 2)}
+    start = time.perf_counter()
+    rebuilt.build_from_raw(rows)
+    rebuild_seconds = time.perf_counter() - start
+    print(f"Rebuilt index with {len(rebuilt.aliases)} aliases in {rebuild_seconds:.1f}s", file=sys.stderr)
+    del rebuilt
+
+    # The old index keeps answering while the new one is built in a thread
+    rebuilding = threading.Thread(target=GameIndex().build_from_raw, args=(rows,))
+    latencies = []
+    wall_start = time.perf_counter()
+    rebuilding.start()
+    while rebuilding.is_alive():
+        query_constraints, kwargs = query_shapes['one player']()
+        start = time.perf_counter()
+        index.query(query_constraints, **kwargs)
+        latencies.append(time.perf_counter() - start)
+    rebuilding.join()
+    if latencies:
+        results['game_index.query during rebuild: one player'] = summarize(latencies,
+                                                                         time.perf_counter() - wall_start)
+        print(f"one player during rebuild: {results['game_index.query during rebuild: one player']}",
+              file=sys.stderr)
+
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'games': args.games,
+            'players': args.players,
+            'min_team_size': args.min_team_size,
+            'max_team_size': args.max_team_size,
+            'seed': args.seed,
+            'iterations': args.iterations,
+            'aliases': args.aliases,
+            'build_seconds': round(build_seconds, 2),
+            'rebuild_seconds': round(rebuild_seconds, 2),
+            'index_bytes': index.memory_bytes(),
+        },
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,184 @@
+"""
+Custom query benchmark: latency of one filter change on the query page.
+
+Every time a filter changes, CustomQuery.vue sends POST /api/query for the
+first page of matches and then fetches that page's games with
+GET /api/games?ids=. This replays sessions of a user building up and
+editing filters (add a player, pick a role, add another, drop one, turn the
+page) against a tenant of synthetic games, and reports the latency of each
+step and of the whole round trip. The round trip is compared with a 16 ms
+budget, so the server side of a filter change leaves time for the browser
+within a 60 fps frame; frame times themselves are measured in the browser by
+frontend/cypress/e2e/custom-query-performance.cy.ts. Timing starts once the
+tenant's leaderboard snapshot has been refreshed.
+
+The tenant (--tenant, default query-bench) is wiped and seeded in bulk
+first: games and their created events are inserted directly and the
+projections catch up from the event log. With --url, restart the server
+after seeding, as the wipe bypasses the log its game index follows, or pass
+--skip-seed.
+
+Usage:
+    python benchmarks/query_benchmark.py --games 50000 --players 200 --output query.json
+    python benchmarks/query_benchmark.py --url http://localhost:8000 --skip-seed
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from api_benchmark import add_data_arguments, make_client, summarize, write_report
+from concurrency_stress import reset_tenant
+from synthetic import generate_player_pool, iter_games
+
+# Server round trip per filter change, about one 60 fps frame
+BUDGET_MS = 16
+
+# Games per page, as in CustomQuery.vue
+PAGE_SIZE = 25
+
+
+def seed_tenant(args):
+    from database import get_db_connection, init_database
+    from projections import catch_up, lock_tenant_events
+
+    init_database()
+    reset_tenant(args.tenant)
+    start = time.perf_counter()
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    lock_tenant_events(cursor, args.tenant)
+    first_date = datetime.now() - timedelta(minutes=args.games)
+    games = iter_games(args.games, args.players, args.min_team_size, args.max_team_size, args.seed)
+    for i, game in enumerate(games):
+        date = first_date + timedelta(minutes=i)
+        raw_data = json.dumps(game)
+        cursor.execute('''
+            INSERT INTO games (tenant_id, date, winner, raw_data) VALUES (%s, %s, %s, %s) RETURNING id
+        ''', (args.tenant, date, game['winner'], raw_data))
+        game_id = cursor.fetchone()[0]
+        cursor.execute('''
+            INSERT INTO game_events (tenant_id, game_id, type, version, data, created_at)
+            VALUES (%s, %s, 'created', 1, %s, %s)
+        ''', (args.tenant, game_id, raw_data, date))
+    catch_up(conn, args.tenant)
+    conn.commit()
+    conn.close()
+    print(f"Seeded {args.games} games in {time.perf_counter() - start:.1f}s", file=sys.stderr)
+
+
+def wait_for_snapshots(client, headers, timeout=300):
+    """Wait out the snapshot refresh that seeding and startup trigger, so it doesn't skew the numbers"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        response = client.get('/api/stats/team-combinations-with-roles', headers=headers)
+        response.raise_for_status()
+        if response.headers.get('X-Snapshot-Stale', 'false') == 'false':
+            return
+        time.sleep(1)
+    print("Warning: snapshots still refreshing, results may be skewed", file=sys.stderr)
+
+
+def filter_session(rng, players):
+    """Filter states a user goes through while building a query, with the page shown"""
+    first, second, third = rng.sample(players, 3)
+    role = rng.choice(['Operative', 'Spymaster'])
+    return [
+        ([(first, 'Any')], 1),
+        ([(first, role)], 1),
+        ([(first, role), (second, 'Any')], 1),
+        ([(first, role), (second, 'Any'), (third, 'Any')], 1),
+        ([(first, role), (third, 'Any')], 1),
+        ([(first, role)], 1),
+        ([(first, role)], 2),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency of a filter change on the custom query page')
+    parser.add_argument('--url', help='Benchmark a running server instead of the app in-process')
+    parser.add_argument('--tenant', default='query-bench', help='Throwaway tenant the games are seeded in')
+    parser.add_argument('--games', type=int, default=50000, help='History length')
+    parser.add_argument('--sessions', type=int, default=100, help='Filter sessions of 7 changes each')
+    parser.add_argument('--skip-seed', action='store_true', help='Reuse the games already in the tenant')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    add_data_arguments(parser)
+    parser.set_defaults(players=200)
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed_tenant(args)
+
+    client = make_client(args.url)
+    if not args.url:
+        client.__enter__()  # runs startup, which loads the game index
+    headers = {'X-Tenant-ID': args.tenant}
+    rng = random.Random(args.seed)
+    players = generate_player_pool(args.players)
+
+    def change_filters(filters, page):
+        started = time.perf_counter()
+        response = client.post('/api/query', headers=headers, json={
+            'constraints': [{'player': player, 'role': role} for player, role in filters],
+            'page': page,
+            'page_size': PAGE_SIZE,
+        })
+        response.raise_for_status()
+        queried = time.perf_counter()
+        game_ids = response.json()['game_ids']
+        if game_ids:
+            client.get('/api/games', headers=headers, params={
+                'ids': ','.join(map(str, game_ids)), 'format': 'columnar',
+            }).raise_for_status()
+        finished = time.perf_counter()
+        return queried - started, finished - queried, finished - started
+
+    wait_for_snapshots(client, headers)
+    change_filters(*filter_session(rng, players)[0])  # warm up connections
+    steps = {'POST /api/query': [], 'GET /api/games?ids=': [], 'filter change': []}
+    wall_start = time.perf_counter()
+    for _ in range(args.sessions):
+        for filters, page in filter_session(rng, players):
+            for name, seconds in zip(steps, change_filters(filters, page)):
+                steps[name].append(seconds)
+    wall_time = time.perf_counter() - wall_start
+
+    results = {name: summarize(latencies, wall_time) for name, latencies in steps.items()}
+    changes = steps['filter change']
+    within_budget = sum(seconds * 1000 <= BUDGET_MS for seconds in changes) / len(changes)
+    results['filter change']['within_budget_pct'] = round(100 * within_budget, 1)
+    results['filter change']['p95_within_budget'] = results['filter change']['p95_ms'] <= BUDGET_MS
+    for name, summary in results.items():
+        print(f"{name}: {summary}", file=sys.stderr)
+    if not args.url:
+        client.__exit__(None, None, None)
+
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'target': args.url or 'in-process',
+            'tenant': args.tenant,
+            'games': args.games,
+            'players': args.players,
+            'min_team_size': args.min_team_size,
+            'max_team_size': args.max_team_size,
+            'sessions': args.sessions,
+            'page_size': PAGE_SIZE,
+            'budget_ms': BUDGET_MS,
+            'seed': args.seed,
+        },
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""
+Benchmark for response serialization of the stats leaderboards.
+
+Serializes synthetic leaderboard rows (no database needed) the way the routes
+used to, building one Pydantic model per row and letting FastAPI validate and
+encode them against response_model, and with the RowEncoder/orjson path they
+use now. Reports latency and rows/sec for both, in the api_benchmark.py JSON
+format.
+
+Usage:
+    python benchmarks/serialization_benchmark.py --players 5000 --output serialization.json
+"""
+import argparse
+import json
+import os
+import random
+import sys
+from datetime import datetime
+from decimal import Decimal
+from typing import List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from pydantic import TypeAdapter
+
+from api_benchmark import measure, write_report
+from fast_json import RowEncoder
+from main import PlayerStat, PlayerRoleStat, TeamCombinationStat
+from synthetic import generate_player_pool
+
+
+def player_rows(rng, players):
+    for name in players:
+        total = rng.randint(1, 500)
+        wins = rng.randint(0, total)
+        yield name, total, wins, total - wins, Decimal(f'{100.0 * wins / total:.1f}')
+
+
+def player_role_rows(rng, players):
+    for role in ('Operative', 'Spymaster'):
+        for name in players:
+            total = rng.randint(1, 500)
+            wins = rng.randint(0, total)
+            yield name, role, total, wins, Decimal(f'{100.0 * wins / total:.1f}')
+
+
+def team_combination_rows(rng, players):
+    for _ in players:
+        names = ','.join(sorted(rng.sample(players, rng.randint(2, 4))))
+        total = rng.randint(2, 100)
+        wins = rng.randint(0, total)
+        yield names, wins, total - wins, total, Decimal(f'{100.0 * wins / total:.1f}')
+
+
+def pydantic_path(model):
+    """What the routes did before: a model per row, then FastAPI's response_model serialization"""
+    adapter = TypeAdapter(List[model])
+    fields = tuple(model.model_fields)
+
+    def serialize(rows):
+        content = [model(**dict(zip(fields, row))) for row in rows]
+        validated = adapter.validate_python(content, from_attributes=True)
+        return json.dumps(adapter.dump_python(validated, mode='json'), ensure_ascii=False,
+                          allow_nan=False, separators=(',', ':')).encode('utf-8')
+    return serialize
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Leaderboard serialization benchmark')
+    parser.add_argument('--players', type=int, default=5000, help='Leaderboard size')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    players = generate_player_pool(args.players)
+    leaderboards = {
+        'players': (PlayerStat, list(player_rows(rng, players))),
+        'players by role': (PlayerRoleStat, list(player_role_rows(rng, players))),
+        'team combinations': (TeamCombinationStat, list(team_combination_rows(rng, players))),
+    }
+
+    results = {}
+    for name, (model, rows) in leaderboards.items():
+        encoder = RowEncoder(model)
+        # Both paths must produce the same document
+        assert json.loads(pydantic_path(model)(rows)) == json.loads(encoder.encode(rows))
+
+        for path, serialize in (('pydantic', pydantic_path(model)), ('orjson', encoder.encode)):
+            result = measure(serialize, [(rows,)] * args.iterations, 1)
+            result['rows_per_sec'] = round(len(rows) / (result['mean_ms'] / 1000))
+            results[f'{path}: {name}'] = result
+            print(f"{path:8} {name:18} {len(rows):7} rows  {result['mean_ms']:8.2f} ms  "
+                  f"{result['rows_per_sec']:>10} rows/s", file=sys.stderr)
+
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'players': args.players,
+            'iterations': args.iterations,
+            'seed': args.seed,
+        },
+        'results': results,
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
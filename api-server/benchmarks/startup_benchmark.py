@@ -0,0 +1,116 @@
+"""
+Startup time benchmark for the API server.
+
+Starts uvicorn with the app several times against DATABASE_URL and measures
+how long each start takes until the liveness probe answers and until the
+readiness probe reports ready, i.e. how soon an autoscaled replica can take
+traffic. The server's own environment (.env) applies, so set e.g.
+EXECUTION_MODE and GAME_INDEX_ENABLED as in production.
+
+Usage:
+    python benchmarks/startup_benchmark.py --runs 5 --output startup.json
+    python benchmarks/startup_benchmark.py --ready-path /health  # servers without the readiness probe
+"""
+import argparse
+import os
+import socket
+import subprocess
+import sys
+import time
+from datetime import datetime
+
+import httpx
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+from api_benchmark import write_report
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for(client, path, started, timeout):
+    """Poll path until it returns 200; seconds since started, or None on timeout"""
+    while time.perf_counter() - started < timeout:
+        try:
+            if client.get(path).status_code == 200:
+                return time.perf_counter() - started
+        except httpx.TransportError:
+            pass
+        time.sleep(0.02)
+    return None
+
+
+def measure_start(args):
+    """Start one server and return (seconds until live, seconds until ready)"""
+    port = free_port()
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', 'main:app', '--host', '127.0.0.1', '--port', str(port),
+         '--log-level', 'warning'],
+        cwd=SERVER_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        with httpx.Client(base_url=f'http://127.0.0.1:{port}', timeout=5.0) as client:
+            live = wait_for(client, args.live_path, started, args.timeout)
+            ready = wait_for(client, args.ready_path, started, args.timeout)
+    finally:
+        server.terminate()
+        server.wait()
+    return live, ready
+
+
+def summarize(values):
+    values = sorted(v for v in values if v is not None)
+    if not values:
+        return None
+    return {
+        'min_s': round(values[0], 3),
+        'p50_s': round(values[len(values) // 2], 3),
+        'max_s': round(values[-1], 3),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure API server time to live and time to ready')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--live-path', default='/health/live')
+    parser.add_argument('--ready-path', default='/health/ready')
+    parser.add_argument('--timeout', type=float, default=120.0, help='Seconds to wait for each probe')
+    parser.add_argument('--output', help='Write the JSON report here instead of stdout')
+    args = parser.parse_args()
+
+    lives, readies = [], []
+    for run in range(args.runs):
+        live, ready = measure_start(args)
+        lives.append(live)
+        readies.append(ready)
+        print(f"Run {run + 1}: live after {live if live is None else round(live, 3)}s, "
+              f"ready after {ready if ready is None else round(ready, 3)}s", file=sys.stderr)
+
+    write_report({
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'runs': args.runs,
+            'live_path': args.live_path,
+            'ready_path': args.ready_path,
+            'execution_mode': os.getenv('EXECUTION_MODE', 'inline'),
+        },
+        'results': {
+            'time_to_live': summarize(lives),
+            'time_to_ready': summarize(readies),
+            'failed_runs': sum(1 for ready in readies if ready is None),
+        },
+    }, args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import random
+
+
+def generate_player_pool(size):
+    """Generate distinct synthetic player names"""
+    return [f"Player{i:05d}" for i in range(size)]
+
+
+def generate_game(rng, players, min_team_size=2, max_team_size=4):
+    """Generate one game dict in the format expected by database.save_game"""
+    team_size = rng.randint(min_team_size, max_team_size)
+    picked = rng.sample(players, team_size * 2)
+
+    teams = {}
+    for team_color, members in (('blue', picked[:team_size]), ('red', picked[team_size:])):
+        teams[f'{team_color}_team'] = {
+            'spymasters': members[:1],
+            'operatives': members[1:],
+            'count': 0,
+        }
+
+    winner = rng.choice(['Blue', 'Red'])
+    loser_key = 'red_team' if winner == 'Blue' else 'blue_team'
+    game = dict(teams)
+    game['winner'] = winner
+
+    # Roughly one in ten games ends on the assassin
+    if rng.random() < 0.1:
+        game['won_because_of_assassin'] = winner.lower()
+    else:
+        game[loser_key]['count'] = rng.randint(1, 8)
+
+    return game
+
+
+def iter_games(num_games, player_pool_size=50, min_team_size=2, max_team_size=4, seed=42):
+    """Lazily generate a reproducible sequence of synthetic games"""
+    if player_pool_size < max_team_size * 2:
+        raise ValueError("player_pool_size must be at least twice max_team_size")
+    rng = random.Random(seed)
+    players = generate_player_pool(player_pool_size)
+    for _ in range(num_games):
+        yield generate_game(rng, players, min_team_size, max_team_size)
+
+
+def generate_games(num_games, player_pool_size=50, min_team_size=2, max_team_size=4, seed=42):
+    """Generate a reproducible list of synthetic games"""
+    return list(iter_games(num_games, player_pool_size, min_team_size, max_team_size, seed))
+
+
+def to_request_body(game):
+    """Strip the server-computed winner so the game can be POSTed to the API"""
+    return {k: v for k, v in game.items() if k != 'winner'}
@@ -0,0 +1,126 @@
+import gzip
+import zlib
+
+from starlette.datastructures import Headers, MutableHeaders
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always offered
+    brotli = None
+
+
+def negotiate_encoding(accept_encoding):
+    """Pick "br" or "gzip" from an Accept-Encoding header, or None to send the body as is"""
+    weights = {}
+    for part in accept_encoding.split(','):
+        coding, _, params = part.partition(';')
+        weight = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                weight = float(params[2:])
+            except ValueError:
+                weight = 0.0
+        weights[coding.strip().lower()] = weight
+
+    best, best_weight = None, 0.0
+    for coding in (('br',) if brotli else ()) + ('gzip',):
+        weight = weights.get(coding, weights.get('*', 0.0))
+        if weight > best_weight:
+            best, best_weight = coding, weight
+    return best
+
+
+class CompressionMiddleware:
+    """
+    Compresses responses with brotli or gzip, whichever the client prefers.
+
+    Bodies smaller than minimum_size are sent as is, since compressing them
+    costs more than it saves. Streaming responses are compressed chunk by
+    chunk.
+    """
+
+    def __init__(self, app, minimum_size=1024, gzip_level=6, brotli_quality=5):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.gzip_level = gzip_level
+        self.brotli_quality = brotli_quality
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+
+        coding = negotiate_encoding(Headers(scope=scope).get('accept-encoding', ''))
+        if coding is None:
+            await self.app(scope, receive, send)
+            return
+
+        await self.app(scope, receive, CompressingSender(self, coding, send).send)
+
+
+class CompressingSender:
+    """ASGI send() wrapper for one response"""
+
+    def __init__(self, middleware, coding, send):
+        self.middleware = middleware
+        self.coding = coding
+        self._send = send
+        self.start_message = None
+        self.passthrough = False
+        self.compressor = None
+
+    def compress(self, body):
+        if self.coding == 'br':
+            return brotli.compress(body, quality=self.middleware.brotli_quality)
+        return gzip.compress(body, compresslevel=self.middleware.gzip_level)
+
+    def compress_chunk(self, body, last):
+        if self.compressor is None:
+            if self.coding == 'br':
+                self.compressor = brotli.Compressor(quality=self.middleware.brotli_quality)
+            else:
+                self.compressor = zlib.compressobj(self.middleware.gzip_level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+        if self.coding == 'br':
+            data = self.compressor.process(body)
+            return data + self.compressor.finish() if last else data + self.compressor.flush()
+        data = self.compressor.compress(body)
+        return data + self.compressor.flush() if last else data + self.compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            # Hold the headers until the first body chunk shows whether to compress
+            self.start_message = message
+            return
+
+        if message['type'] != 'http.response.body' or self.passthrough:
+            await self._send(message)
+            return
+
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+
+        if self.start_message is not None:
+            start, self.start_message = self.start_message, None
+            headers = MutableHeaders(raw=start['headers'])
+            if 'content-encoding' in headers or (not more_body and len(body) < self.middleware.minimum_size):
+                self.passthrough = True
+                await self._send(start)
+                await self._send(message)
+                return
+
+            headers['Content-Encoding'] = self.coding
+            headers.add_vary_header('Accept-Encoding')
+            if not more_body:
+                body = self.compress(body)
+                headers['Content-Length'] = str(len(body))
+                await self._send(start)
+                await self._send({'type': 'http.response.body', 'body': body})
+                return
+
+            del headers['Content-Length']
+            await self._send(start)
+
+        await self._send({'type': 'http.response.body', 'body': self.compress_chunk(body, not more_body),
+                          'more_body': more_body})
@@ -0,0 +1,422 @@
+"""
+Consistency checker and online rebuild of the derived stats tables
+
+team_combinations, player_stats and game_participants are maintained
+incrementally by every write; games.raw_data, read through the tenant's
+player aliases, is the source of truth. check streams the games
+in chunks from one consistent snapshot, recomputes the derived rows in
+memory one tenant at a time, and diffs them against the stored tables.
+repair also rebuilds team_combinations into a shadow table and swaps it in
+atomically, rewrites the participants of games that differ, and replays
+player_stats of the tenants where it differs, while the API keeps serving.
+
+Usage:
+    python consistency.py check [--tenant TENANT]
+    python consistency.py repair
+"""
+import argparse
+import itertools
+import json
+import resource
+import sys
+import time
+from collections import Counter
+
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+
+from database import get_db_connection, init_database, refresh_team_role_snapshot
+from db_router import router
+from projections import (
+    PlayerStatsProjection,
+    canonical_game,
+    game_participants,
+    get_aliases,
+    insert_participants,
+    lock_tenant_events,
+    player_names,
+    player_stat_changes,
+    replay,
+    team_combination_changes,
+)
+from storage import get_backend
+
+# Rows fetched per round trip while streaming games and stored rows
+CHUNK_SIZE = 5000
+
+# Differences listed per tenant in the report, on top of the counts
+SAMPLE_SIZE = 10
+
+# Key columns of the counter tables the scan rebuilds
+COUNTER_KEYS = {
+    'team_combinations': ('player_names',),
+    'player_stats': ('name', 'role'),
+}
+
+# Changes with any insert, update or delete of a game (new IDs are always larger
+# than deleted ones, and versions only go up) and with any change of aliases
+FINGERPRINT_QUERY = '''
+    SELECT COUNT(*), COALESCE(SUM(id), 0), COALESCE(SUM(version), 0),
+           (SELECT md5(string_agg(tenant_id || ':' || alias || ':' || canonical, ',' ORDER BY tenant_id, alias))
+            FROM player_aliases)
+    FROM games
+'''
+
+
+def peak_memory_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def stream(conn, name, query, params=()):
+    """Server-side cursor fetching CHUNK_SIZE rows at a time"""
+    cursor = conn.cursor(name=name)
+    cursor.itersize = CHUNK_SIZE
+    cursor.execute(query, params)
+    return cursor
+
+
+def snapshot_connection():
+    """Read-only connection whose queries all see the same snapshot"""
+    conn = get_db_connection()
+    conn.set_session(isolation_level='REPEATABLE READ', readonly=True)
+    return conn
+
+
+def list_tenants(conn, tenant_id=None):
+    if tenant_id is not None:
+        return [tenant_id]
+    cursor = conn.cursor()
+    cursor.execute('''
+                   SELECT tenant_id FROM games
+                   UNION SELECT tenant_id FROM team_combinations
+                   UNION SELECT tenant_id FROM game_participants
+                   UNION SELECT tenant_id FROM player_stats
+                   ORDER BY tenant_id
+                   ''')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def diff_participants(conn, tenant_id, games, aliases):
+    """
+    Merge the tenant's games (sorted by id), under the canonical names given
+    by aliases, with its stored participants (sorted by game_id)
+
+    Returns the number of games, the rebuilt counters ({table: {key:
+    [wins, losses]}} for COUNTER_KEYS) and the IDs of games whose
+    participants differ, including games that only have stored participants.
+    """
+    game_count = 0
+    counters = {'team_combinations': {}, 'player_stats': {}}
+    bad_games = []
+    stored = stream(conn, 'stored_participants', '''
+        SELECT gp.game_id, p.name, gp.team, gp.role, gp.won
+        FROM game_participants gp
+        LEFT JOIN players p ON gp.player_id = p.id
+        WHERE gp.tenant_id = %s
+        ORDER BY gp.game_id
+    ''', (tenant_id,))
+    stored_games = itertools.groupby(stored, key=lambda row: row[0])
+    stored_id, stored_rows = next(stored_games, (None, None))
+
+    for game_id, raw_data in games:
+        game_count += 1
+        game_data = canonical_game(json.loads(raw_data), aliases)
+        team_combination_changes(game_data, 1, counters['team_combinations'])
+        player_stat_changes(game_data, 1, counters['player_stats'])
+
+        while stored_id is not None and stored_id < game_id:
+            bad_games.append(stored_id)  # participants of a game that no longer exists
+            stored_id, stored_rows = next(stored_games, (None, None))
+
+        expected = Counter(game_participants(game_data))
+        if stored_id == game_id:
+            actual = Counter(row[1:] for row in stored_rows)
+            stored_id, stored_rows = next(stored_games, (None, None))
+        else:
+            actual = Counter()
+        if actual != expected:
+            bad_games.append(game_id)
+
+    while stored_id is not None:
+        bad_games.append(stored_id)
+        stored_id, stored_rows = next(stored_games, (None, None))
+    stored.close()
+    return game_count, counters, bad_games
+
+
+def diff_counters(conn, tenant_id, counters, table='team_combinations'):
+    """
+    Compare rebuilt counters with the stored rows of a counter table (see
+    COUNTER_KEYS) of a tenant; consumes counters to avoid holding a second
+    copy of the keys
+    """
+    key_columns = COUNTER_KEYS[table]
+    missing, wrong, extra, samples = 0, 0, 0, []
+    stored = stream(conn, f'stored_{table}', f'''
+        SELECT {', '.join(key_columns)}, wins, losses FROM {table} WHERE tenant_id = %s
+    ''', (tenant_id,))
+    for row in stored:
+        key = row[0] if len(key_columns) == 1 else tuple(row[:-2])
+        wins, losses = row[-2:]
+        expected = counters.pop(key, None)
+        if [wins or 0, losses or 0] != (expected or [0, 0]):
+            if expected is None:
+                extra += 1
+            else:
+                wrong += 1
+            if len(samples) < SAMPLE_SIZE:
+                samples.append({'key': key, 'stored': [wins, losses], 'rebuilt': expected or [0, 0]})
+    stored.close()
+
+    for key, expected in counters.items():
+        if expected != [0, 0]:
+            missing += 1
+            if len(samples) < SAMPLE_SIZE:
+                samples.append({'key': key, 'stored': None, 'rebuilt': expected})
+    return {'missing': missing, 'wrong': wrong, 'extra': extra, 'samples': samples}
+
+
+def scan(conn, tenants, on_tenant):
+    """
+    Rebuild and diff each tenant in turn, calling
+    on_tenant(tenant_id, combination counters, bad_games) before the diff
+    consumes its counters, so memory holds one tenant at a time
+    """
+    reports = {}
+    games_scanned = 0
+    for tenant_id in tenants:
+        games = stream(conn, 'games', 'SELECT id, raw_data FROM games WHERE tenant_id = %s ORDER BY id',
+                       (tenant_id,))
+        aliases = get_aliases(conn.cursor(), tenant_id)
+        game_count, counters, bad_games = diff_participants(conn, tenant_id, games, aliases)
+        games.close()
+        games_scanned += game_count
+
+        combinations = sum(1 for change in counters['team_combinations'].values() if change != [0, 0])
+        on_tenant(tenant_id, counters['team_combinations'], bad_games)
+        report = diff_counters(conn, tenant_id, counters['team_combinations'])
+        report.update(games=game_count, combinations=combinations,
+                      participant_mismatches=len(bad_games), games_with_bad_participants=bad_games[:SAMPLE_SIZE],
+                      player_stats=diff_counters(conn, tenant_id, counters['player_stats'], 'player_stats'))
+        reports[tenant_id] = report
+        del counters
+    return reports, games_scanned
+
+
+def counters_differ(report):
+    return bool(report['missing'] or report['wrong'] or report['extra'])
+
+
+def is_consistent(report):
+    return not (counters_differ(report) or counters_differ(report['player_stats'])
+                or report['participant_mismatches'])
+
+
+def check(tenant_id=None):
+    """Diff the derived tables against raw_data without changing anything"""
+    conn = snapshot_connection()
+    try:
+        reports, games_scanned = scan(conn, list_tenants(conn, tenant_id), lambda *args: None)
+    finally:
+        conn.close()
+    return reports, games_scanned
+
+
+def create_shadow_table(cursor):
+    cursor.execute('''
+                   CREATE TABLE team_combinations_shadow
+                   (
+                       id SERIAL PRIMARY KEY,
+                       tenant_id TEXT NOT NULL DEFAULT 'default',
+                       player_names TEXT NOT NULL,
+                       wins INTEGER DEFAULT 0,
+                       losses INTEGER DEFAULT 0
+                   )
+                   ''')
+
+
+def swap_shadow_table(conn, fingerprint):
+    """
+    Replace team_combinations with the shadow table in one transaction
+
+    Locking games and player_aliases first waits for in-flight writes and
+    holds off new ones (every write locks its games row, and every merge
+    writes its aliases, before touching team_combinations);
+    reads go on until the brief ACCESS EXCLUSIVE lock for the rename. Writes
+    made since the rebuild's snapshot changed the live counters by exact
+    increments, so the difference between the live table and its copy from
+    the snapshot (team_combinations_baseline) is added to the shadow table
+    first. Returns how long writes were held off, in milliseconds.
+    """
+    started = time.perf_counter()
+    cursor = conn.cursor()
+    cursor.execute('LOCK TABLE games, player_aliases IN EXCLUSIVE MODE')
+    cursor.execute(FINGERPRINT_QUERY)
+    if cursor.fetchone() != fingerprint:
+        cursor.execute('''
+                       INSERT INTO team_combinations_shadow (tenant_id, player_names, wins, losses)
+                       SELECT tenant_id, player_names, SUM(wins), SUM(losses)
+                       FROM (
+                           SELECT tenant_id, player_names, wins, losses FROM team_combinations
+                           UNION ALL
+                           SELECT tenant_id, player_names, -wins, -losses FROM team_combinations_baseline
+                       ) changes
+                       GROUP BY tenant_id, player_names
+                       HAVING SUM(wins) <> 0 OR SUM(losses) <> 0
+                       ON CONFLICT (tenant_id, player_names) DO UPDATE
+                           SET wins   = team_combinations_shadow.wins + EXCLUDED.wins,
+                               losses = team_combinations_shadow.losses + EXCLUDED.losses
+                       ''')
+
+    cursor.execute('LOCK TABLE team_combinations IN ACCESS EXCLUSIVE MODE')
+    cursor.execute('ALTER TABLE team_combinations RENAME TO team_combinations_old')
+    cursor.execute('ALTER TABLE team_combinations_shadow RENAME TO team_combinations')
+    cursor.execute('DROP TABLE team_combinations_old')
+    cursor.execute('DROP TABLE team_combinations_baseline')
+    cursor.execute('ALTER INDEX team_combinations_shadow_tenant_names RENAME TO idx_team_combinations_tenant_names')
+    cursor.execute('ALTER TABLE team_combinations RENAME CONSTRAINT team_combinations_shadow_pkey '
+                   'TO team_combinations_pkey')
+    cursor.execute('ALTER SEQUENCE team_combinations_shadow_id_seq RENAME TO team_combinations_id_seq')
+    conn.commit()
+    return round((time.perf_counter() - started) * 1000, 1)
+
+
+def repair_participants(game_id, tenant_id):
+    """
+    Rewrite a game's participants from its raw_data, or drop them if the game is gone
+
+    Participants depend on the game and on the tenant's aliases, so this takes
+    the tenant's event lock like edits, merges and unmerges do; neither can
+    land between reading the game and rewriting its participants.
+    """
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        lock_tenant_events(cursor, tenant_id)
+        cursor.execute('SELECT raw_data FROM games WHERE id = %s AND tenant_id = %s', (game_id, tenant_id))
+        row = cursor.fetchone()
+        cursor.execute('DELETE FROM game_participants WHERE game_id = %s AND tenant_id = %s', (game_id, tenant_id))
+        if row is not None:
+            game_data = json.loads(row[0])
+            aliases = get_aliases(cursor, tenant_id, player_names(game_data))
+            insert_participants(cursor, tenant_id, [(game_id, canonical_game(game_data, aliases))])
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def repair():
+    """
+    Rebuild team_combinations for every tenant and swap it in, then fix the
+    participants of games that differ and replay player_stats of the tenants
+    where it differs, each under the tenant's event lock
+
+    Returns the reports of the scan the table was rebuilt from, the number
+    of games scanned and how long writes were held off for the swap.
+    """
+    writer = get_db_connection()
+    snapshot = get_db_connection()
+    try:
+        shadow = writer.cursor()
+        shadow.execute('DROP TABLE IF EXISTS team_combinations_shadow, team_combinations_baseline')
+        create_shadow_table(shadow)
+        writer.commit()
+
+        # Everything the rebuild reads comes from the snapshot taken by the baseline copy
+        snapshot.set_session(isolation_level='REPEATABLE READ')
+        cursor = snapshot.cursor()
+        cursor.execute('''
+                       CREATE TABLE team_combinations_baseline AS
+                       SELECT tenant_id, player_names, wins, losses FROM team_combinations
+                       ''')
+        cursor.execute(FINGERPRINT_QUERY)
+        fingerprint = cursor.fetchone()
+        bad_participants = []
+
+        def write_tenant(tenant_id, counters, bad_games):
+            execute_values(shadow, '''
+                INSERT INTO team_combinations_shadow (tenant_id, player_names, wins, losses) VALUES %s
+            ''', ((tenant_id, player_names, wins, losses)
+                  for player_names, (wins, losses) in counters.items() if wins or losses), page_size=CHUNK_SIZE)
+            bad_participants.extend((tenant_id, game_id) for game_id in bad_games)
+
+        reports, games_scanned = scan(snapshot, list_tenants(snapshot), write_tenant)
+        # Commits the baseline and ends the snapshot, whose table locks would block the swap
+        snapshot.commit()
+
+        shadow.execute('''
+                       CREATE UNIQUE INDEX team_combinations_shadow_tenant_names
+                           ON team_combinations_shadow (tenant_id, player_names)
+                       ''')
+        writer.commit()
+        swap_ms = swap_shadow_table(writer, fingerprint)
+    finally:
+        snapshot.close()
+        writer.close()
+
+    repaired_tenants = set()
+    for tenant_id, game_id in bad_participants:
+        repair_participants(game_id, tenant_id)
+        repaired_tenants.add(tenant_id)
+    for tenant_id, report in reports.items():
+        if counters_differ(report['player_stats']):
+            replay(tenant_id, [PlayerStatsProjection()], rebuild=True)
+            repaired_tenants.add(tenant_id)
+    for tenant_id in repaired_tenants:
+        router.mark_write(tenant_id)
+        refresh_team_role_snapshot(tenant_id)
+
+    return reports, games_scanned, swap_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check or rebuild the derived stats tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    check_parser = subparsers.add_parser('check', help='Report differences from a rebuild, exit 1 if any')
+    check_parser.add_argument('--tenant', help='Only check this tenant')
+    subparsers.add_parser('repair', help='Rebuild team_combinations, participants and player_stats online')
+    args = parser.parse_args()
+
+    load_dotenv()
+    if get_backend().name != 'postgres':
+        parser.error('consistency checks need Postgres (snapshot isolation and server-side cursors)')
+    init_database()
+
+    start = time.perf_counter()
+    swap_ms = None
+    if args.command == 'check':
+        reports, games_scanned = check(args.tenant)
+    else:
+        reports, games_scanned, swap_ms = repair()
+    elapsed = time.perf_counter() - start
+
+    consistent = all(is_consistent(report) for report in reports.values())
+    for tenant_id, report in reports.items():
+        print(f"{tenant_id}: {report['games']} games, {report['combinations']} combinations, "
+              f"{report['missing']} missing / {report['wrong']} wrong / {report['extra']} extra counters, "
+              f"{report['participant_mismatches']} games with wrong participants, "
+              f"{'wrong' if counters_differ(report['player_stats']) else 'correct'} player stats", file=sys.stderr)
+    action = 'Checked' if args.command == 'check' else 'Rebuilt'
+    print(f"{action} {games_scanned} games in {elapsed:.1f}s "
+          f"({games_scanned / elapsed if elapsed else 0:.0f} games/s), peak memory {peak_memory_mb()} MB",
+          file=sys.stderr)
+    if swap_ms is not None:
+        print(f"Swapped in the rebuilt team_combinations, holding off writes for {swap_ms} ms", file=sys.stderr)
+
+    # For repair, the reports and "consistent" describe the tables before the repair
+    print(json.dumps({
+        'command': args.command,
+        'consistent': consistent,
+        'games': games_scanned,
+        'seconds': round(elapsed, 2),
+        'peak_memory_mb': peak_memory_mb(),
+        'writes_paused_ms': swap_ms,
+        'tenants': reports,
+    }, indent=2))
+    if args.command == 'check' and not consistent:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
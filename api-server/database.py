@@ -1,98 +1,179 @@
+import bisect
+import hashlib
 import psycopg2
 from psycopg2.extras import RealDictCursor
-from datetime import datetime
+from datetime import datetime, timedelta
+from decimal import Decimal, ROUND_HALF_UP
 import json
 import os
+import sqlite3
 
-def get_db_connection():
-    """Get database connection from environment variable"""
-    database_url = os.getenv('DATABASE_URL')
-    if not database_url:
-        raise ValueError("DATABASE_URL not set in environment")
-    return psycopg2.connect(database_url)
-
-def get_or_create_player(name, cursor=None):
-    """Get player ID, create if doesn't exist"""
-    close_conn = False
-    if cursor is None:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        close_conn = True
+from aliases import resolve_new_players
+from db_router import router
+from projections import lock_tenant_events, record_game_event, start_game_log
+from storage import get_backend
 
-    cursor.execute('SELECT id FROM players WHERE name = %s', (name,))
-    result = cursor.fetchone()
+# Tenant used for requests that do not name one, and for rows created before tenants existed
+DEFAULT_TENANT = 'default'
 
-    if result:
-        player_id = result[0]
-    else:
-        cursor.execute('INSERT INTO players (name) VALUES (%s) RETURNING id', (name,))
-        player_id = cursor.fetchone()[0]
-        if close_conn:
-            conn.commit()
 
-    if close_conn:
-        conn.close()
-    return player_id
+class DuplicateGameRequest(Exception):
+    """The idempotency key was already used for this game, which was saved as game_id and is now at version"""
+
+    def __init__(self, game_id, version=None):
+        super().__init__(f"Game #{game_id} was already recorded with this idempotency key")
+        self.game_id = game_id
+        self.version = version
+
+
+class IdempotencyKeyConflict(Exception):
+    """The idempotency key was already used for a different game"""
+
+
+class GameVersionConflict(Exception):
+    """The game changed since the client read it; current_version is its version now"""
+
+    def __init__(self, game_id, current_version):
+        super().__init__(f"Game #{game_id} was modified by another request (current version {current_version})")
+        self.game_id = game_id
+        self.current_version = current_version
+
 
-def get_player_stats():
+def get_db_connection():
+    """Get a connection to the primary database from environment variable"""
+    return get_backend().connect()
+
+def get_read_connection(tenant_id=DEFAULT_TENANT):
+    """Get a connection for read-only queries: a healthy replica, else the primary"""
+    replica_url = router.read_url(tenant_id)
+    if replica_url:
+        try:
+            conn = psycopg2.connect(replica_url, connect_timeout=2)
+        except psycopg2.OperationalError as e:
+            print(f"Warning: Replica connection failed, reading from the primary: {e}")
+            router.mark_unhealthy(replica_url)
+        else:
+            # The client's consistency token may be ahead of the replica
+            if router.caught_up(conn):
+                return conn
+            conn.close()
+    return get_db_connection()
+
+def get_player_stats(tenant_id=DEFAULT_TENANT):
     """Get overall stats for all players"""
-    conn = get_db_connection()
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor()
 
     cursor.execute('''
         SELECT 
-            p.name,
-            COUNT(*) as total_games,
-            SUM(CASE WHEN gp.won = TRUE THEN 1 ELSE 0 END) as wins,
-            SUM(CASE WHEN gp.won = FALSE THEN 1 ELSE 0 END) as losses,
-            ROUND(100.0 * SUM(CASE WHEN gp.won = TRUE THEN 1 ELSE 0 END) / COUNT(*), 1) as win_rate
-        FROM players p
-        JOIN game_participants gp ON p.id = gp.player_id
-        GROUP BY p.name
+            name,
+            SUM(wins + losses) as total_games,
+            SUM(wins) as wins,
+            SUM(losses) as losses,
+            ROUND(100.0 * SUM(wins) / SUM(wins + losses), 1) as win_rate
+        FROM player_stats
+        WHERE tenant_id = %s
+        GROUP BY name
+        HAVING SUM(wins + losses) > 0
         ORDER BY win_rate DESC, wins DESC
-    ''')
+    ''', (tenant_id,))
 
     results = cursor.fetchall()
     conn.close()
     return results
 
-def get_player_stats_by_role():
+def get_player_stats_by_role(tenant_id=DEFAULT_TENANT):
     """Get stats broken down by role (Operative vs Spymaster)"""
-    conn = get_db_connection()
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor()
 
     cursor.execute('''
         SELECT 
-            p.name,
-            gp.role,
-            COUNT(*) as total_games,
-            SUM(CASE WHEN gp.won = TRUE THEN 1 ELSE 0 END) as wins,
-            ROUND(100.0 * SUM(CASE WHEN gp.won = TRUE THEN 1 ELSE 0 END) / COUNT(*), 1) as win_rate
-        FROM players p
-        JOIN game_participants gp ON p.id = gp.player_id
-        GROUP BY p.name, gp.role
-        ORDER BY gp.role, win_rate DESC
-    ''')
+            name,
+            role,
+            wins + losses as total_games,
+            wins,
+            ROUND(100.0 * wins / (wins + losses), 1) as win_rate
+        FROM player_stats
+        WHERE tenant_id = %s AND wins + losses > 0
+        ORDER BY role, win_rate DESC
+    ''', (tenant_id,))
 
     results = cursor.fetchall()
     conn.close()
     return results
 
-def get_total_games():
+def get_total_games(tenant_id=DEFAULT_TENANT):
     """Get total number of games"""
-    conn = get_db_connection()
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor()
-    cursor.execute('SELECT COUNT(*) FROM games')
+    cursor.execute('SELECT COUNT(*) FROM games WHERE tenant_id = %s', (tenant_id,))
     result = cursor.fetchone()[0]
     conn.close()
     return result
 
 
+# Bump whenever init_database changes the schema, so existing databases are migrated on the next start
+SCHEMA_VERSION = 4
+
+# Postgres advisory lock held while migrating, so servers starting together migrate once
+SCHEMA_LOCK_ID = 1129270867
+
+
+def get_schema_version(conn):
+    """Schema version recorded by init_database, 0 for a database it never finished setting up"""
+    cursor = conn.cursor()
+    try:
+        cursor.execute('SELECT version FROM schema_version')
+    except (psycopg2.ProgrammingError, sqlite3.OperationalError):
+        conn.rollback()
+        return 0
+    result = cursor.fetchone()
+    return result[0] if result else 0
+
+
 def init_database():
-    """Create tables if they don't exist"""
+    """
+    Create or migrate the tables unless the schema is already at SCHEMA_VERSION
+
+    An up-to-date database costs a single query, plus refreshing SQLite's
+    planner statistics. Returns True if the schema was changed.
+    """
+    backend = get_backend()
     conn = get_db_connection()
-    cursor = conn.cursor()
+    try:
+        if get_schema_version(conn) >= SCHEMA_VERSION:
+            conn.close()
+            if backend.name == 'sqlite':
+                backend.optimize()
+            return False
 
+        cursor = conn.cursor()
+        if backend.name == 'sqlite':
+            backend.create_schema()
+        else:
+            # Another server may be migrating; wait for it and re-check
+            cursor.execute('SELECT pg_advisory_xact_lock(%s)', (SCHEMA_LOCK_ID,))
+            cursor.execute('CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)')
+            if get_schema_version(conn) >= SCHEMA_VERSION:
+                conn.commit()
+                return False
+            migrate_postgres_schema(cursor)
+        start_game_log(conn)
+
+        cursor.execute('DELETE FROM schema_version')
+        cursor.execute('INSERT INTO schema_version (version) VALUES (%s)', (SCHEMA_VERSION,))
+        conn.commit()
+    finally:
+        conn.close()
+    if backend.name == 'sqlite':
+        backend.optimize()
+    print(f"Database schema migrated to version {SCHEMA_VERSION}")
+    return True
+
+
+def migrate_postgres_schema(cursor):
+    """Create the Postgres tables and bring existing ones up to date; every statement is idempotent"""
     # Games table
     cursor.execute('''
                    CREATE TABLE IF NOT EXISTS games
@@ -124,9 +205,14 @@ def init_database():
                        SERIAL
                        PRIMARY
                        KEY,
+                       tenant_id
+                       TEXT
+                       NOT
+                       NULL
+                       DEFAULT
+                       'default',
                        name
                        TEXT
-                       UNIQUE
                        NOT
                        NULL
                    )
@@ -186,6 +272,12 @@ def init_database():
                        SERIAL
                        PRIMARY
                        KEY,
+                       tenant_id
+                       TEXT
+                       NOT
+                       NULL
+                       DEFAULT
+                       'default',
                        player_names
                        TEXT
                        NOT
@@ -197,224 +289,309 @@ def init_database():
                        losses
                        INTEGER
                        DEFAULT
-                       0,
-                       UNIQUE
-                   (
-                       player_names
+                       0
                    )
-                       )
                    ''')
 
-    conn.commit()
-    conn.close()
+    # Tenant dimension: each community only ever reads its own rows. Columns are
+    # added to existing tables, and rows created before tenants existed belong to
+    # the default tenant.
+    for table in ('games', 'players', 'game_participants', 'team_combinations'):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN IF NOT EXISTS tenant_id TEXT NOT NULL DEFAULT '{DEFAULT_TENANT}'")
+
+    # Bumped on every edit, for optimistic concurrency (If-Match on PUT/DELETE)
+    cursor.execute('ALTER TABLE games ADD COLUMN IF NOT EXISTS version INTEGER NOT NULL DEFAULT 1')
 
+    # Names are unique per tenant rather than globally
+    cursor.execute('ALTER TABLE players DROP CONSTRAINT IF EXISTS players_name_key')
+    cursor.execute('ALTER TABLE team_combinations DROP CONSTRAINT IF EXISTS team_combinations_player_names_key')
+    cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_players_tenant_name ON players (tenant_id, name)')
+    cursor.execute('''
+                   CREATE UNIQUE INDEX IF NOT EXISTS idx_team_combinations_tenant_names
+                       ON team_combinations (tenant_id, player_names)
+                   ''')
 
-def get_all_combinations(players):
-    """Generate all possible combinations of players (2+)"""
-    from itertools import combinations
+    # Tenant-leading indexes for the stats queries, participant indexes for query_games
+    cursor.execute('DROP INDEX IF EXISTS idx_games_date')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_games_tenant_date ON games (tenant_id, date DESC)')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_game_participants_tenant_player
+                       ON game_participants (tenant_id, player_id)
+                   ''')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_game_participants_player
+                       ON game_participants (player_id, role, team, game_id)
+                   ''')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_game_participants_game
+                       ON game_participants (game_id)
+                   ''')
 
-    # Sort players to ensure consistent ordering
-    players = sorted(players)
+    # Idempotency keys of recent POST /api/games requests, expired after IDEMPOTENCY_KEY_TTL_HOURS
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS idempotency_keys
+                   (
+                       tenant_id TEXT NOT NULL,
+                       key TEXT NOT NULL,
+                       request_hash TEXT NOT NULL,
+                       game_id INTEGER,
+                       created_at TIMESTAMP NOT NULL,
+                       PRIMARY KEY (tenant_id, key)
+                   )
+                   ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_idempotency_keys_game ON idempotency_keys (game_id)')
 
-    combos = []
-    # Generate combinations of size 2 to len(players)
-    for r in range(2, len(players) + 1):
-        for combo in combinations(players, r):
-            combos.append(','.join(sorted(combo)))
+    # Snapshots of expensive leaderboards, recomputed in the background after writes
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS team_role_snapshots
+                   (
+                       id SERIAL PRIMARY KEY,
+                       tenant_id TEXT NOT NULL,
+                       spymasters TEXT[] NOT NULL,
+                       operatives TEXT[] NOT NULL,
+                       wins INTEGER NOT NULL,
+                       losses INTEGER NOT NULL,
+                       total_games INTEGER NOT NULL,
+                       win_rate NUMERIC NOT NULL
+                   )
+                   ''')
+    cursor.execute('''
+                   CREATE INDEX IF NOT EXISTS idx_team_role_snapshots_rank
+                       ON team_role_snapshots (tenant_id, win_rate DESC, total_games DESC)
+                   ''')
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS snapshot_refreshes
+                   (
+                       tenant_id TEXT NOT NULL,
+                       snapshot TEXT NOT NULL,
+                       computed_at TIMESTAMP NOT NULL,
+                       duration_ms INTEGER NOT NULL,
+                       PRIMARY KEY (tenant_id, snapshot)
+                   )
+                   ''')
 
-    return combos
+    # Append-only log of every change to a game, and the progress of the tables projected from it
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS game_events
+                   (
+                       id BIGSERIAL PRIMARY KEY,
+                       tenant_id TEXT NOT NULL,
+                       game_id INTEGER NOT NULL,
+                       type TEXT NOT NULL,
+                       version INTEGER NOT NULL,
+                       data TEXT,
+                       previous_data TEXT,
+                       created_at TIMESTAMP NOT NULL
+                   )
+                   ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_events_tenant ON game_events (tenant_id, id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_game_events_game ON game_events (game_id, id)')
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS projection_checkpoints
+                   (
+                       tenant_id TEXT NOT NULL,
+                       projection TEXT NOT NULL,
+                       event_id BIGINT NOT NULL,
+                       PRIMARY KEY (tenant_id, projection)
+                   )
+                   ''')
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS player_stats
+                   (
+                       tenant_id TEXT NOT NULL,
+                       name TEXT NOT NULL,
+                       role TEXT NOT NULL,
+                       wins INTEGER NOT NULL DEFAULT 0,
+                       losses INTEGER NOT NULL DEFAULT 0,
+                       PRIMARY KEY (tenant_id, name, role)
+                   )
+                   ''')
 
+    # Alternative spellings of players, counted as their canonical player
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS player_aliases
+                   (
+                       tenant_id TEXT NOT NULL,
+                       alias TEXT NOT NULL,
+                       canonical TEXT NOT NULL,
+                       automatic BOOLEAN NOT NULL,
+                       created_at TIMESTAMP NOT NULL,
+                       PRIMARY KEY (tenant_id, alias)
+                   )
+                   ''')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_player_aliases_canonical ON player_aliases (tenant_id, canonical)')
 
-def update_team_combinations(player_names, won, cursor=None):
-    """Update win/loss for all combinations of these players"""
-    close_conn = False
-    if cursor is None:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        close_conn = True
+    # Bumped on every change of a tenant's aliases, so caches can tell cheaply that they changed
+    cursor.execute('''
+                   CREATE TABLE IF NOT EXISTS alias_versions
+                   (
+                       tenant_id TEXT PRIMARY KEY,
+                       version BIGINT NOT NULL
+                   )
+                   ''')
 
-    combos = get_all_combinations(player_names)
 
-    for combo_str in combos:
-        # Get or create combination
-        cursor.execute('''
-                       INSERT INTO team_combinations (player_names, wins, losses)
-                       VALUES (%s, 0, 0) ON CONFLICT (player_names) DO NOTHING
-                       ''', (combo_str,))
-
-        # Update wins or losses
-        if won:
-            cursor.execute('''
-                           UPDATE team_combinations
-                           SET wins = wins + 1
-                           WHERE player_names = %s
-                           ''', (combo_str,))
-        else:
-            cursor.execute('''
-                           UPDATE team_combinations
-                           SET losses = losses + 1
-                           WHERE player_names = %s
-                           ''', (combo_str,))
+def claim_idempotency_key(cursor, key, game_data, tenant_id):
+    """
+    Record key for this request, or raise if it was used within IDEMPOTENCY_KEY_TTL_HOURS
 
-    if close_conn:
-        conn.commit()
-        conn.close()
+    Concurrent requests with the same key are serialized by the primary key:
+    the second INSERT waits for the first transaction and then conflicts.
+    """
+    request_hash = hashlib.sha256(json.dumps(game_data, sort_keys=True).encode('utf-8')).hexdigest()
+    ttl_hours = float(os.getenv('IDEMPOTENCY_KEY_TTL_HOURS', 24))
+    now = datetime.now()
 
+    cursor.execute('DELETE FROM idempotency_keys WHERE created_at < %s', (now - timedelta(hours=ttl_hours),))
+    cursor.execute('''
+                   INSERT INTO idempotency_keys (tenant_id, key, request_hash, created_at)
+                   VALUES (%s, %s, %s, %s)
+                   ON CONFLICT (tenant_id, key) DO NOTHING
+                   RETURNING key
+                   ''', (tenant_id, key, request_hash, now))
+    if cursor.fetchone():
+        return
 
-def save_game(game_data):
-    """Save a game to the database"""
+    cursor.execute('''
+                   SELECT k.request_hash, k.game_id, g.version
+                   FROM idempotency_keys k
+                   LEFT JOIN games g ON g.id = k.game_id
+                   WHERE k.tenant_id = %s AND k.key = %s
+                   ''', (tenant_id, key))
+    existing_hash, game_id, version = cursor.fetchone()
+    if existing_hash != request_hash:
+        raise IdempotencyKeyConflict("Idempotency-Key was already used for a different game")
+    raise DuplicateGameRequest(game_id, version)
+
+
+def save_game(game_data, tenant_id=DEFAULT_TENANT, idempotency_key=None):
+    """
+    Save a game to the database
+
+    With an idempotency_key, a repeated request raises DuplicateGameRequest
+    with the ID of the game saved the first time instead of saving it again.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    lock_tenant_events(cursor, tenant_id)
+
+    if idempotency_key is not None:
+        try:
+            claim_idempotency_key(cursor, idempotency_key, game_data, tenant_id)
+        except Exception:
+            conn.rollback()
+            conn.close()
+            raise
 
     # Insert game
     cursor.execute('''
-                   INSERT INTO games (date, winner, raw_data)
-                   VALUES (%s, %s, %s) RETURNING id
-                   ''', (datetime.now(), game_data['winner'], json.dumps(game_data)))
+                   INSERT INTO games (tenant_id, date, winner, raw_data)
+                   VALUES (%s, %s, %s, %s) RETURNING id
+                   ''', (tenant_id, datetime.now(), game_data['winner'], json.dumps(game_data)))
 
     game_id = cursor.fetchone()[0]
+    if idempotency_key is not None:
+        cursor.execute('UPDATE idempotency_keys SET game_id = %s WHERE tenant_id = %s AND key = %s',
+                       (game_id, tenant_id, idempotency_key))
 
-    # Insert participants and track team combinations
-    for team_color in ['blue', 'red']:
-        team_data = game_data[f'{team_color}_team']
-        won = (game_data['winner'].lower() == team_color)
-
-        # Collect all player names for this team
-        all_team_players = team_data['operatives'] + team_data['spymasters']
-
-        # Operatives
-        for player_name in team_data['operatives']:
-            player_id = get_or_create_player(player_name, cursor)
-            cursor.execute('''
-                           INSERT INTO game_participants (game_id, player_id, team, role, won)
-                           VALUES (%s, %s, %s, %s, %s)
-                           ''', (game_id, player_id, team_color.capitalize(), 'Operative', won))
-
-        # Spymasters
-        for player_name in team_data['spymasters']:
-            player_id = get_or_create_player(player_name, cursor)
-            cursor.execute('''
-                           INSERT INTO game_participants (game_id, player_id, team, role, won)
-                           VALUES (%s, %s, %s, %s, %s)
-                           ''', (game_id, player_id, team_color.capitalize(), 'Spymaster', won))
-
-        # Update team combinations for this team
-        if all_team_players:
-            update_team_combinations(all_team_players, won, cursor)
+    # Log the game, which adds its participants and stats
+    resolve_new_players(cursor, tenant_id, game_data)
+    record_game_event(cursor, tenant_id, game_id, 'created', 1, game_data)
 
     conn.commit()
+    router.mark_write(tenant_id, cursor)
     conn.close()
     return game_id
 
 
-def update_game(game_id, game_data):
-    """Update an existing game with new data"""
+def lock_game(conn, game_id, tenant_id, expected_version=None):
+    """
+    Lock a game row for the rest of the transaction and return (raw_data, version)
+
+    Concurrent edits of the same game wait here, so each one reverses the
+    stats of the version it replaces. Raises ValueError if the game does not
+    exist and GameVersionConflict if it is not at expected_version; the
+    connection is closed in both cases.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT raw_data, version FROM games WHERE id = %s AND tenant_id = %s FOR UPDATE',
+                   (game_id, tenant_id))
+    result = cursor.fetchone()
+
+    if not result:
+        conn.close()
+        raise ValueError(f"Game {game_id} not found")
+
+    raw_data, version = result
+    if expected_version is not None and version != expected_version:
+        conn.close()
+        raise GameVersionConflict(game_id, version)
+
+    return json.loads(raw_data), version
+
+
+def update_game(game_id, game_data, tenant_id=DEFAULT_TENANT, expected_version=None):
+    """
+    Update an existing game with new data and return its new version
+
+    With expected_version, raises GameVersionConflict instead if the game was
+    changed since the client read that version.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    lock_tenant_events(cursor, tenant_id)
 
-    # Get old game data to reverse team combination stats
-    cursor.execute('SELECT raw_data FROM games WHERE id = %s', (game_id,))
-    old_data = json.loads(cursor.fetchone()[0])
-
-    # Reverse old team combinations
-    for team_color in ['blue', 'red']:
-        old_team_data = old_data[f'{team_color}_team']
-        old_won = (old_data['winner'].lower() == team_color)
-        all_old_players = old_team_data['operatives'] + old_team_data['spymasters']
-
-        if all_old_players:
-            combos = get_all_combinations(all_old_players)
-            for combo_str in combos:
-                if old_won:
-                    cursor.execute('UPDATE team_combinations SET wins = wins - 1 WHERE player_names = %s', (combo_str,))
-                else:
-                    cursor.execute('UPDATE team_combinations SET losses = losses - 1 WHERE player_names = %s',
-                                   (combo_str,))
+    # Get old game data, the event moves the stats from it to the new data
+    old_data, version = lock_game(conn, game_id, tenant_id, expected_version)
 
     # Update game
     cursor.execute('''
                    UPDATE games
                    SET winner   = %s,
-                       raw_data = %s
+                       raw_data = %s,
+                       version  = version + 1
                    WHERE id = %s
                    ''', (game_data['winner'], json.dumps(game_data), game_id))
 
-    # Delete old participants
-    cursor.execute('DELETE FROM game_participants WHERE game_id = %s', (game_id,))
-
-    # Insert new participants and update team combinations
-    for team_color in ['blue', 'red']:
-        team_data = game_data[f'{team_color}_team']
-        won = (game_data['winner'].lower() == team_color)
-
-        all_team_players = team_data['operatives'] + team_data['spymasters']
-
-        # Operatives
-        for player_name in team_data['operatives']:
-            player_id = get_or_create_player(player_name, cursor)
-            cursor.execute('''
-                           INSERT INTO game_participants (game_id, player_id, team, role, won)
-                           VALUES (%s, %s, %s, %s, %s)
-                           ''', (game_id, player_id, team_color.capitalize(), 'Operative', won))
-
-        # Spymasters
-        for player_name in team_data['spymasters']:
-            player_id = get_or_create_player(player_name, cursor)
-            cursor.execute('''
-                           INSERT INTO game_participants (game_id, player_id, team, role, won)
-                           VALUES (%s, %s, %s, %s, %s)
-                           ''', (game_id, player_id, team_color.capitalize(), 'Spymaster', won))
-
-        # Update new team combinations
-        if all_team_players:
-            update_team_combinations(all_team_players, won, cursor)
+    resolve_new_players(cursor, tenant_id, game_data)
+    record_game_event(cursor, tenant_id, game_id, 'edited', version + 1, game_data, old_data)
 
     conn.commit()
+    router.mark_write(tenant_id, cursor)
     conn.close()
+    return version + 1
+
 
+def delete_game(game_id, tenant_id=DEFAULT_TENANT, expected_version=None):
+    """
+    Delete a game and reverse all associated stats
 
-def delete_game(game_id):
-    """Delete a game and reverse all associated stats"""
+    With expected_version, raises GameVersionConflict instead if the game was
+    changed since the client read that version.
+    """
     conn = get_db_connection()
     cursor = conn.cursor()
+    lock_tenant_events(cursor, tenant_id)
 
-    # Get game data to reverse team combination stats
-    cursor.execute('SELECT raw_data FROM games WHERE id = %s', (game_id,))
-    result = cursor.fetchone()
-
-    if not result:
-        conn.close()
-        raise ValueError(f"Game {game_id} not found")
-
-    game_data = json.loads(result[0])
+    # Get game data, the event reverses its stats and removes its participants
+    game_data, version = lock_game(conn, game_id, tenant_id, expected_version)
+    record_game_event(cursor, tenant_id, game_id, 'deleted', version + 1, None, game_data)
 
-    # Reverse team combinations
-    for team_color in ['blue', 'red']:
-        team_data = game_data[f'{team_color}_team']
-        won = (game_data['winner'].lower() == team_color)
-        all_team_players = team_data['operatives'] + team_data['spymasters']
-
-        if all_team_players:
-            combos = get_all_combinations(all_team_players)
-            for combo_str in combos:
-                if won:
-                    cursor.execute('UPDATE team_combinations SET wins = wins - 1 WHERE player_names = %s', (combo_str,))
-                else:
-                    cursor.execute('UPDATE team_combinations SET losses = losses - 1 WHERE player_names = %s', (combo_str,))
-
-    # Delete game participants
-    cursor.execute('DELETE FROM game_participants WHERE game_id = %s', (game_id,))
+    # A retry of the original request may record the game again
+    cursor.execute('DELETE FROM idempotency_keys WHERE game_id = %s', (game_id,))
 
     # Delete the game
     cursor.execute('DELETE FROM games WHERE id = %s', (game_id,))
 
     conn.commit()
+    router.mark_write(tenant_id, cursor)
     conn.close()
 
 
-def get_team_combination_stats(min_games=2):
+def get_team_combination_stats(min_games=2, tenant_id=DEFAULT_TENANT):
     """Get stats for team combinations with at least min_games played"""
-    conn = get_db_connection()
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor()
 
     cursor.execute('''
@@ -424,29 +601,44 @@ def get_team_combination_stats(min_games=2):
                           wins + losses                            as total_games,
                           ROUND(100.0 * wins / (wins + losses), 1) as win_rate
                    FROM team_combinations
-                   WHERE wins + losses >= %s
+                   WHERE tenant_id = %s AND wins + losses >= %s
                    ORDER BY win_rate DESC, total_games DESC LIMIT 20
-                   ''', (min_games,))
+                   ''', (tenant_id, min_games))
 
     results = cursor.fetchall()
     conn.close()
     return results
 
 
-def get_all_games():
-    """Get all games with their details"""
-    conn = get_db_connection()
+def get_all_games(game_ids=None, tenant_id=DEFAULT_TENANT):
+    """Get all games with their details, optionally only the given game IDs"""
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-    cursor.execute('''
-                   SELECT
-                       g.id,
-                       g.date,
-                       g.winner,
-                       g.raw_data
-                   FROM games g
-                   ORDER BY g.date DESC
-                   ''')
+    if game_ids is None:
+        cursor.execute('''
+                       SELECT
+                           g.id,
+                           g.date,
+                           g.winner,
+                           g.raw_data,
+                           g.version
+                       FROM games g
+                       WHERE g.tenant_id = %s
+                       ORDER BY g.date DESC
+                       ''', (tenant_id,))
+    else:
+        cursor.execute('''
+                       SELECT
+                           g.id,
+                           g.date,
+                           g.winner,
+                           g.raw_data,
+                           g.version
+                       FROM games g
+                       WHERE g.tenant_id = %s AND g.id = ANY(%s)
+                       ORDER BY g.date DESC
+                       ''', (tenant_id, list(game_ids)))
 
     games = cursor.fetchall()
     conn.close()
@@ -461,72 +653,427 @@ def get_all_games():
     return result
 
 
-def get_team_combination_stats_with_roles(min_games=2):
-    """Get stats for team combinations with role information"""
-    conn = get_db_connection()
+def get_games_page(limit, after=None, tenant_id=DEFAULT_TENANT, game_ids=None):
+    """
+    Up to limit games, newest first like get_all_games, starting after the
+    (date, id) of the previous page's last game. With game_ids, only those
+    games are paged through. Returns the games and the (date, id) to pass
+    for the next page, or None after the last page.
+    """
+    conn = get_read_connection(tenant_id)
     cursor = conn.cursor(cursor_factory=RealDictCursor)
 
-    # Get all unique winning team configurations from actual games
+    conditions = ['tenant_id = %s']
+    params = [tenant_id]
+    if after is not None:
+        # Spelled out rather than (date, id) < (%s, %s) so the date index bounds the scan
+        after_date, after_id = after
+        conditions.append('date <= %s AND (date < %s OR id < %s)')
+        params += [after_date, after_date, after_id]
+    if game_ids is not None:
+        conditions.append('id = ANY(%s)')
+        params.append(list(game_ids))
+    cursor.execute(f'''
+                   SELECT id, date, winner, raw_data, version
+                   FROM games
+                   WHERE {' AND '.join(conditions)}
+                   ORDER BY date DESC, id DESC LIMIT %s
+                   ''', params + [limit + 1])
+
+    games = cursor.fetchall()
+    conn.close()
+
+    result = []
+    for game in games[:limit]:
+        game_dict = dict(game)
+        game_dict['raw_data'] = json.loads(game_dict['raw_data'])
+        result.append(game_dict)
+
+    next_after = (result[-1]['date'], result[-1]['id']) if len(games) > limit else None
+    return result, next_after
+
+
+def get_game_history(game_id, tenant_id=DEFAULT_TENANT):
+    """Events of a game from the log, oldest first; data is None for a deletion"""
+    conn = get_read_connection(tenant_id)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
     cursor.execute('''
-        WITH team_games AS (
-            SELECT
-                g.id as game_id,
-                g.winner,
-                gp.team,
-                gp.won,
-                ARRAY_AGG(
-                    CASE WHEN gp.role = 'Spymaster' THEN p.name ELSE NULL END
-                    ORDER BY p.name
-                ) FILTER (WHERE gp.role = 'Spymaster') as spymasters,
-                ARRAY_AGG(
-                    CASE WHEN gp.role = 'Operative' THEN p.name ELSE NULL END
-                    ORDER BY p.name
-                ) FILTER (WHERE gp.role = 'Operative') as operatives
-            FROM games g
-            JOIN game_participants gp ON g.id = gp.game_id
-            JOIN players p ON gp.player_id = p.id
-            GROUP BY g.id, g.winner, gp.team, gp.won
-        ),
-        team_combos AS (
-            SELECT
-                COALESCE(ARRAY_TO_STRING(spymasters, ','), '') || '|' ||
-                COALESCE(ARRAY_TO_STRING(operatives, ','), '') as team_key,
-                spymasters,
-                operatives,
-                won,
-                COUNT(*) as game_count
-            FROM team_games
-            WHERE ARRAY_LENGTH(spymasters, 1) > 0 OR ARRAY_LENGTH(operatives, 1) > 0
-            GROUP BY team_key, spymasters, operatives, won
-        )
+                   SELECT id, type, version, created_at, data
+                   FROM game_events
+                   WHERE game_id = %s AND tenant_id = %s
+                   ORDER BY id
+                   ''', (game_id, tenant_id))
+    events = cursor.fetchall()
+    conn.close()
+
+    result = []
+    for event in events:
+        event_dict = dict(event)
+        event_dict['data'] = None if event_dict['data'] is None else json.loads(event_dict['data'])
+        result.append(event_dict)
+    return result
+
+
+def read_game_changes(conn, since, limit, tenant_id):
+    """get_game_changes on the given connection"""
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+    if since:
+        cursor.execute('SELECT 1 FROM game_events WHERE id = %s AND tenant_id = %s', (since, tenant_id))
+        if cursor.fetchone() is None:
+            return None
+
+    cursor.execute('''
+                   SELECT id, game_id
+                   FROM game_events
+                   WHERE tenant_id = %s AND id > %s
+                   ORDER BY id LIMIT %s
+                   ''', (tenant_id, since, limit + 1))
+    events = cursor.fetchall()
+    if not events:
+        return [], [], since, False
+    has_more = len(events) > limit
+    events = events[:limit]
+
+    # Current rows rather than the events' data: a game changed several times
+    # is sent once, and a newer version than the events is sent again later
+    game_ids = sorted({event['game_id'] for event in events})
+    cursor.execute('''
+                   SELECT id, date, winner, raw_data, version
+                   FROM games
+                   WHERE tenant_id = %s AND id = ANY(%s)
+                   ORDER BY id
+                   ''', (tenant_id, game_ids))
+    games = []
+    for game in cursor.fetchall():
+        game_dict = dict(game)
+        game_dict['raw_data'] = json.loads(game_dict['raw_data'])
+        games.append(game_dict)
+    deleted = sorted(set(game_ids) - {game['id'] for game in games})
+    return games, deleted, events[-1]['id'], has_more
+
+
+def get_game_changes(since, limit, tenant_id=DEFAULT_TENANT):
+    """
+    Games created, edited or deleted after event ID since (0 for all of them)
+
+    Returns (games, IDs of deleted games, version, has_more): the games in
+    their current state, oldest ID first, and the event ID to pass as since
+    for the next changes. At most limit events are read; has_more is True
+    when there are more. Events of a tenant commit in ID order (see
+    projections.lock_tenant_events), so no change is skipped. Returns None
+    when since is not an event of the tenant's log, e.g. the log was reset
+    or restored since the client synced, and the client must start over.
+    """
+    conn = get_read_connection(tenant_id)
+    try:
+        changes = read_game_changes(conn, since, limit, tenant_id)
+    finally:
+        conn.close()
+    if changes is None:
+        # A replica may not have the client's last event yet
+        conn = get_db_connection()
+        try:
+            changes = read_game_changes(conn, since, limit, tenant_id)
+        finally:
+            conn.close()
+    return changes
+
+
+# Wins and losses of every distinct (spymasters, operatives) team line-up, best first
+TEAM_ROLE_STATS_QUERY = '''
+    WITH team_games AS (
         SELECT
+            g.id as game_id,
+            g.winner,
+            gp.team,
+            gp.won,
+            ARRAY_AGG(
+                CASE WHEN gp.role = 'Spymaster' THEN p.name ELSE NULL END
+                ORDER BY p.name
+            ) FILTER (WHERE gp.role = 'Spymaster') as spymasters,
+            ARRAY_AGG(
+                CASE WHEN gp.role = 'Operative' THEN p.name ELSE NULL END
+                ORDER BY p.name
+            ) FILTER (WHERE gp.role = 'Operative') as operatives
+        FROM games g
+        JOIN game_participants gp ON g.id = gp.game_id
+        JOIN players p ON gp.player_id = p.id
+        WHERE g.tenant_id = %s
+        GROUP BY g.id, g.winner, gp.team, gp.won
+    ),
+    team_combos AS (
+        SELECT
+            COALESCE(ARRAY_TO_STRING(spymasters, ','), '') || '|' ||
+            COALESCE(ARRAY_TO_STRING(operatives, ','), '') as team_key,
             spymasters,
             operatives,
-            SUM(CASE WHEN won THEN game_count ELSE 0 END) as wins,
-            SUM(CASE WHEN NOT won THEN game_count ELSE 0 END) as losses,
-            SUM(game_count) as total_games,
-            ROUND(100.0 * SUM(CASE WHEN won THEN game_count ELSE 0 END) / SUM(game_count), 1) as win_rate
-        FROM team_combos
-        GROUP BY team_key, spymasters, operatives
-        HAVING SUM(game_count) >= %s
-        ORDER BY win_rate DESC, total_games DESC
-        LIMIT 20
-    ''', (min_games,))
+            won,
+            COUNT(*) as game_count
+        FROM team_games
+        WHERE ARRAY_LENGTH(spymasters, 1) > 0 OR ARRAY_LENGTH(operatives, 1) > 0
+        GROUP BY team_key, spymasters, operatives, won
+    )
+    SELECT
+        spymasters,
+        operatives,
+        SUM(CASE WHEN won THEN game_count ELSE 0 END) as wins,
+        SUM(CASE WHEN NOT won THEN game_count ELSE 0 END) as losses,
+        SUM(game_count) as total_games,
+        ROUND(100.0 * SUM(CASE WHEN won THEN game_count ELSE 0 END) / SUM(game_count), 1) as win_rate
+    FROM team_combos
+    GROUP BY team_key, spymasters, operatives
+    HAVING SUM(game_count) >= %s
+    ORDER BY win_rate DESC, total_games DESC
+'''
+
+# Number of rows the team leaderboards return
+LEADERBOARD_SIZE = 20
+
+
+# Keys of the dicts returned for team combinations with roles
+TEAM_ROLE_FIELDS = ('spymasters', 'operatives', 'wins', 'losses', 'total_games', 'win_rate')
+
+
+def format_team_role_stat(row):
+    return {
+        'spymasters': row['spymasters'] or [],
+        'operatives': row['operatives'] or [],
+        'wins': int(row['wins']),
+        'losses': int(row['losses']),
+        'total_games': int(row['total_games']),
+        'win_rate': float(row['win_rate'])
+    }
+
+
+def sqlite_team_role_stats(conn, tenant_id, min_games):
+    """
+    Rows of TEAM_ROLE_STATS_QUERY on SQLite, which has no arrays
+
+    The participants are read in one pass and grouped into line-ups here,
+    with the same rounding and order as the query.
+    """
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT gp.game_id, gp.team, gp.won, gp.role, p.name
+        FROM games g
+        JOIN game_participants gp ON g.id = gp.game_id
+        JOIN players p ON gp.player_id = p.id
+        WHERE g.tenant_id = %s
+    ''', (tenant_id,))
+
+    team_games = {}
+    for game_id, team, won, role, name in cursor:
+        spymasters, operatives = team_games.setdefault((game_id, team, won), ([], []))
+        (spymasters if role == 'Spymaster' else operatives).append(name)
+
+    line_ups = {}
+    for (_, _, won), (spymasters, operatives) in team_games.items():
+        counts = line_ups.setdefault((tuple(sorted(spymasters)), tuple(sorted(operatives))), [0, 0])
+        counts[0 if won else 1] += 1
+
+    rows = []
+    for (spymasters, operatives), (wins, losses) in line_ups.items():
+        total_games = wins + losses
+        if total_games >= min_games:
+            win_rate = (Decimal(100 * wins) / total_games).quantize(Decimal('0.1'), ROUND_HALF_UP)
+            rows.append({
+                'spymasters': list(spymasters) or None,
+                'operatives': list(operatives) or None,
+                'wins': wins,
+                'losses': losses,
+                'total_games': total_games,
+                'win_rate': float(win_rate)
+            })
+    rows.sort(key=lambda row: (-row['win_rate'], -row['total_games']))
+    return rows
+
+
+def iter_team_role_stats(conn, tenant_id, min_games):
+    """Rows of TEAM_ROLE_STATS_QUERY, streamed from a server-side cursor on Postgres"""
+    if get_backend().name == 'sqlite':
+        yield from sqlite_team_role_stats(conn, tenant_id, min_games)
+        return
+
+    rows = conn.cursor(name='team_role_stats', cursor_factory=RealDictCursor)
+    rows.itersize = 10000
+    rows.execute(TEAM_ROLE_STATS_QUERY, (tenant_id, min_games))
+    yield from rows
+    rows.close()
+
+
+def get_team_combination_stats_with_roles(min_games=2, tenant_id=DEFAULT_TENANT):
+    """Get stats for team combinations with role information, computed from all games"""
+    conn = get_read_connection(tenant_id)
+    if get_backend().name == 'sqlite':
+        results = sqlite_team_role_stats(conn, tenant_id, min_games)[:LEADERBOARD_SIZE]
+    else:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute(TEAM_ROLE_STATS_QUERY + ' LIMIT %s', (tenant_id, min_games, LEADERBOARD_SIZE))
+        results = cursor.fetchall()
+    conn.close()
 
+    return [format_team_role_stat(row) for row in results]
+
+
+def refresh_team_role_snapshot(tenant_id=DEFAULT_TENANT):
+    """
+    Recompute the team_role_snapshots rows of a tenant
+
+    Keeps every line-up that is in the top LEADERBOARD_SIZE for some
+    min_games threshold, so one indexed read answers any threshold. Scanning
+    in leaderboard order, a line-up is in some top list exactly when fewer
+    than LEADERBOARD_SIZE line-ups before it have at least as many games;
+    counting only kept line-ups gives the same answer.
+    """
+    started = datetime.now()
+    conn = get_db_connection()
+    try:
+        kept, kept_totals = [], []  # kept_totals stays sorted
+        for row in iter_team_role_stats(conn, tenant_id, 1):
+            at_least_as_many = len(kept_totals) - bisect.bisect_left(kept_totals, row['total_games'])
+            if at_least_as_many < LEADERBOARD_SIZE:
+                kept.append(row)
+                bisect.insort(kept_totals, row['total_games'])
+
+        # Swap the rows in one transaction, readers keep seeing the old snapshot until commit
+        cursor = conn.cursor()
+        cursor.execute('DELETE FROM team_role_snapshots WHERE tenant_id = %s', (tenant_id,))
+        get_backend().insert_many(cursor, '''
+            INSERT INTO team_role_snapshots (tenant_id, spymasters, operatives, wins, losses, total_games, win_rate)
+            VALUES %s
+        ''', [(tenant_id, row['spymasters'] or [], row['operatives'] or [], row['wins'], row['losses'],
+               row['total_games'], row['win_rate']) for row in kept])
+        cursor.execute('''
+            INSERT INTO snapshot_refreshes (tenant_id, snapshot, computed_at, duration_ms)
+            VALUES (%s, 'team_roles', %s, %s)
+            ON CONFLICT (tenant_id, snapshot)
+            DO UPDATE SET computed_at = EXCLUDED.computed_at, duration_ms = EXCLUDED.duration_ms
+        ''', (tenant_id, started, int((datetime.now() - started).total_seconds() * 1000)))
+        conn.commit()
+    finally:
+        conn.close()
+    return len(kept)
+
+
+def get_team_role_snapshot(min_games=2, tenant_id=DEFAULT_TENANT):
+    """
+    Read team combination stats with roles from the tenant's snapshot
+
+    Returns (stats, computed_at), or (None, None) if the snapshot was never computed.
+    """
+    conn = get_read_connection(tenant_id)
+    cursor = conn.cursor(cursor_factory=RealDictCursor)
+
+    cursor.execute('''
+        SELECT computed_at FROM snapshot_refreshes
+        WHERE tenant_id = %s AND snapshot = 'team_roles'
+    ''', (tenant_id,))
+    refresh = cursor.fetchone()
+    if refresh is None:
+        conn.close()
+        return None, None
+
+    cursor.execute('''
+        SELECT spymasters, operatives, wins, losses, total_games, win_rate
+        FROM team_role_snapshots
+        WHERE tenant_id = %s AND total_games >= %s
+        ORDER BY win_rate DESC, total_games DESC
+        LIMIT %s
+    ''', (tenant_id, min_games, LEADERBOARD_SIZE))
     results = cursor.fetchall()
     conn.close()
 
-    # Convert to list of dicts with formatted data
-    formatted_results = []
-    for row in results:
-        formatted_results.append({
-            'spymasters': row['spymasters'] or [],
-            'operatives': row['operatives'] or [],
-            'wins': row['wins'],
-            'losses': row['losses'],
-            'total_games': row['total_games'],
-            'win_rate': float(row['win_rate'])
-        })
+    return [format_team_role_stat(row) for row in results], refresh['computed_at']
 
-    return formatted_results
 
+def query_games(constraints, winner=None, date_from=None, date_to=None, page=1, page_size=50,
+                tenant_id=DEFAULT_TENANT):
+    """
+    Find games matching all player constraints and return win stats plus a page of game IDs
+
+    Each constraint is a dict with 'player', 'role' ('Any', 'Operative' or 'Spymaster')
+    and optional 'team' ('Blue' or 'Red'). A matching game counts as a win when every
+    constrained player was on the winning team.
+    """
+    conn = get_read_connection(tenant_id)
+    cursor = conn.cursor()
+
+    # Resolve names up front so the per-game checks only touch the participant index
+    names = list({c['player'] for c in constraints})
+    player_ids = {}
+    if names:
+        cursor.execute('SELECT name, id FROM players WHERE tenant_id = %s AND name = ANY(%s)', (tenant_id, names))
+        player_ids = dict(cursor.fetchall())
+
+    empty = {'total_games': 0, 'wins': 0, 'losses': 0, 'win_rate': 0.0, 'game_ids': []}
+    if len(player_ids) < len(names):
+        conn.close()
+        return empty
+
+    where, match_params, win_checks, win_params = ['g.tenant_id = %s'], [tenant_id], [], []
+    for constraint in constraints:
+        check = 'SELECT 1 FROM game_participants gp WHERE gp.game_id = g.id AND gp.player_id = %s'
+        params = [player_ids[constraint['player']]]
+        if constraint.get('role', 'Any') != 'Any':
+            check += ' AND gp.role = %s'
+            params.append(constraint['role'])
+        if constraint.get('team'):
+            check += ' AND gp.team = %s'
+            params.append(constraint['team'])
+
+        where.append(f'EXISTS ({check})')
+        match_params.extend(params)
+        win_checks.append(f'EXISTS ({check} AND gp.won)')
+        win_params.extend(params)
+
+    if winner:
+        where.append('g.winner = %s')
+        match_params.append(winner)
+    if date_from:
+        where.append('g.date >= %s')
+        match_params.append(date_from)
+    if date_to:
+        where.append('g.date <= %s')
+        match_params.append(date_to)
+
+    matched = f'''
+        SELECT g.id, g.date, {' AND '.join(win_checks) or 'FALSE'} AS all_won
+        FROM games g
+        WHERE {' AND '.join(where)}
+    '''
+    params = win_params + match_params
+
+    cursor.execute(f'''
+        WITH matched AS ({matched})
+        SELECT COUNT(*), COUNT(*) FILTER (WHERE all_won) FROM matched
+    ''', params)
+    total, wins = cursor.fetchone()
+
+    cursor.execute(f'''
+        WITH matched AS ({matched})
+        SELECT id FROM matched
+        ORDER BY date DESC, id DESC
+        LIMIT %s OFFSET %s
+    ''', params + [page_size, (page - 1) * page_size])
+    game_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+
+    if total == 0:
+        return empty
+    return {
+        'total_games': total,
+        'wins': wins,
+        'losses': total - wins,
+        'win_rate': round(100.0 * wins / total, 1),
+        'game_ids': game_ids,
+    }
+
+
+def get_tenants():
+    """Get the IDs of all tenants that have recorded games"""
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT tenant_id FROM games')
+    tenants = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    return tenants
@@ -0,0 +1,164 @@
+import itertools
+import os
+import re
+import time
+from contextvars import ContextVar
+from urllib.parse import urlparse
+
+import psycopg2
+
+# Replication lag, or 0 on a primary / a replica that has replayed everything it received
+REPLICA_LAG_QUERY = '''
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() OR pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+'''
+
+# Consistency tokens are WAL positions of the primary, e.g. 0/16B3748
+WRITE_POSITION_QUERY = 'SELECT pg_current_wal_lsn()::text'
+REPLAYED_QUERY = 'SELECT pg_last_wal_replay_lsn() >= %s::pg_lsn'
+TOKEN_PATTERN = re.compile(r'[0-9A-Fa-f]{1,8}/[0-9A-Fa-f]{1,8}')
+
+
+class RequestConsistency:
+    """
+    Position the current request's reads must see, and the one its writes reached
+
+    force_primary sends the request's reads to the primary, for work handed
+    off by a request that is inside its tenant's read-your-writes window.
+    """
+
+    def __init__(self, read_after=None, force_primary=False):
+        self.read_after = read_after
+        self.force_primary = force_primary
+        self.written = None
+
+
+_request = ContextVar('request_consistency', default=None)
+
+
+class DatabaseRouter:
+    """
+    Routes stats reads to read replicas and everything else to the primary.
+
+    Replicas come from DATABASE_REPLICA_URLS (comma separated). Reads for a
+    tenant go to the primary for READ_YOUR_WRITES_SECONDS after that tenant
+    wrote through this process, so a stats refresh right after saving a game
+    sees the game. Across processes, writes report the primary's WAL
+    position as a consistency token; a request that sends it back only reads
+    from a replica that has replayed that far. Replicas that fail to connect
+    or lag more than MAX_REPLICA_LAG_SECONDS are skipped until the next
+    health check.
+    """
+
+    def __init__(self):
+        self._last_write = {}  # tenant_id -> monotonic time of the last write
+        self._health = {}  # replica url -> (healthy, monotonic time checked)
+        self._round_robin = None
+        self._replica_urls = None
+
+    @property
+    def replica_urls(self):
+        # Read lazily so load_dotenv() in main.py has run first
+        if self._replica_urls is None:
+            urls = os.getenv('DATABASE_REPLICA_URLS', '')
+            self._replica_urls = [url.strip() for url in urls.split(',') if url.strip()]
+            self._round_robin = itertools.cycle(self._replica_urls)
+        return self._replica_urls
+
+    def begin_request(self, read_after=None, force_primary=False):
+        """Start tracking consistency for a request that must read at least up to read_after"""
+        consistency = RequestConsistency(read_after, force_primary)
+        _request.set(consistency)
+        return consistency
+
+    def mark_write(self, tenant_id, cursor=None):
+        """Record a committed write; with its cursor, also note the position for the request's token"""
+        self._last_write[tenant_id] = time.monotonic()
+        consistency = _request.get()
+        if cursor is not None and consistency is not None and self.replica_urls:
+            cursor.execute(WRITE_POSITION_QUERY)
+            consistency.written = cursor.fetchone()[0]
+
+    def read_after(self):
+        """Consistency token the current request's reads must have caught up to, if any"""
+        consistency = _request.get()
+        return consistency.read_after if consistency is not None else None
+
+    def caught_up(self, conn):
+        """True if the replica behind conn has replayed the current request's token"""
+        read_after = self.read_after()
+        if read_after is None:
+            return True
+        cursor = conn.cursor()
+        cursor.execute(REPLAYED_QUERY, (read_after,))
+        return bool(cursor.fetchone()[0])
+
+    def mark_unhealthy(self, url):
+        self._health[url] = (False, time.monotonic())
+
+    def wrote_recently(self, tenant_id):
+        """True while the tenant's reads must go to the primary to see its own writes"""
+        window = float(os.getenv('READ_YOUR_WRITES_SECONDS', 5))
+        last_write = self._last_write.get(tenant_id)
+        return last_write is not None and time.monotonic() - last_write < window
+
+    def read_url(self, tenant_id):
+        """The replica to read from, or None to read from the primary"""
+        consistency = _request.get()
+        if not self.replica_urls or self.wrote_recently(tenant_id) or \
+                (consistency is not None and consistency.force_primary):
+            return None
+
+        for _ in range(len(self.replica_urls)):
+            url = next(self._round_robin)
+            if self.is_healthy(url):
+                return url
+        return None
+
+    def is_healthy(self, url):
+        """Cached health of a replica, re-checked every REPLICA_HEALTH_CHECK_SECONDS"""
+        interval = float(os.getenv('REPLICA_HEALTH_CHECK_SECONDS', 10))
+        healthy, checked_at = self._health.get(url, (None, 0))
+        if healthy is not None and time.monotonic() - checked_at < interval:
+            return healthy
+
+        healthy = self.check_replica(url)
+        self._health[url] = (healthy, time.monotonic())
+        return healthy
+
+    def check_replica(self, url):
+        max_lag = float(os.getenv('MAX_REPLICA_LAG_SECONDS', 30))
+        try:
+            conn = psycopg2.connect(url, connect_timeout=2)
+            try:
+                cursor = conn.cursor()
+                cursor.execute(REPLICA_LAG_QUERY)
+                lag = float(cursor.fetchone()[0])
+            finally:
+                conn.close()
+        except Exception as e:
+            print(f"Warning: Replica {describe_url(url)} failed its health check: {e}")
+            return False
+
+        if lag > max_lag:
+            print(f"Warning: Replica {describe_url(url)} is {lag:.1f}s behind, reading from the primary")
+            return False
+        return True
+
+    def status(self):
+        """Health of every replica, without credentials"""
+        return [
+            {'replica': describe_url(url), 'healthy': self.is_healthy(url)}
+            for url in self.replica_urls
+        ]
+
+
+def describe_url(url):
+    """host:port/dbname of a database URL"""
+    parsed = urlparse(url)
+    return f"{parsed.hostname or 'localhost'}:{parsed.port or 5432}{parsed.path}"
+
+
+router = DatabaseRouter()
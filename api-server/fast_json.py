@@ -0,0 +1,102 @@
+from decimal import Decimal
+
+import orjson
+from starlette.responses import Response
+
+
+def _default(value):
+    # ROUND() over NUMERIC comes back from psycopg2 as Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(data):
+    """Serialize to JSON bytes with orjson (datetimes become ISO 8601, Decimals floats)"""
+    return orjson.dumps(data, default=_default)
+
+
+def json_response(content, headers=None):
+    """Response for already serialized JSON, so FastAPI skips response_model validation"""
+    return Response(content=content, media_type="application/json", headers=headers)
+
+
+# Wire formats a list endpoint can be asked for with ?format=
+RESPONSE_FORMATS = ('json', 'columnar')
+
+
+def columnar(fields, columns, length, **extra):
+    """
+    Compact form of a list of records: one array per field instead of one
+    object per record, so key names are sent once
+    """
+    return {'format': 'columnar', 'length': length, **extra, 'columns': dict(zip(fields, columns))}
+
+
+def records_to_columnar(records, fields):
+    """Columnar form of a list of dicts"""
+    return columnar(fields, [[record[field] for record in records] for field in fields], len(records))
+
+
+def games_to_columnar(games):
+    """
+    Columnar form of get_all_games() results
+
+    Player names are replaced by indexes into a shared players list, and
+    raw_data is split into per-team columns. The frontend decoder rebuilds
+    raw_data with the same keys.
+    """
+    players, player_indexes = [], {}
+
+    def indexes(names):
+        result = []
+        for name in names:
+            index = player_indexes.get(name)
+            if index is None:
+                index = player_indexes[name] = len(players)
+                players.append(name)
+            result.append(index)
+        return result
+
+    fields = ('id', 'date', 'winner', 'version', 'won_because_of_assassin')
+    columns = {field: [] for field in fields}
+    for team in ('blue', 'red'):
+        for key in ('spymasters', 'operatives', 'count'):
+            columns[f'{team}_{key}'] = []
+
+    for game in games:
+        raw_data = game['raw_data']
+        columns['id'].append(game['id'])
+        columns['date'].append(game['date'])
+        columns['winner'].append(game['winner'])
+        columns['version'].append(game['version'])
+        columns['won_because_of_assassin'].append(raw_data.get('won_because_of_assassin'))
+        for team in ('blue', 'red'):
+            team_data = raw_data[f'{team}_team']
+            columns[f'{team}_spymasters'].append(indexes(team_data['spymasters']))
+            columns[f'{team}_operatives'].append(indexes(team_data['operatives']))
+            columns[f'{team}_count'].append(team_data.get('count', 0))
+
+    return columnar(columns.keys(), columns.values(), len(games), players=players)
+
+
+class RowEncoder:
+    """
+    Encodes database rows as the JSON list of a response model, without
+    building a model per row.
+
+    The field names are read from the model once; rows must be tuples with
+    the columns in the model's field order. The route keeps response_model
+    so the OpenAPI schema stays the same.
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.fields = tuple(model.model_fields)
+
+    def encode(self, rows, response_format='json'):
+        fields = self.fields
+        if response_format == 'columnar':
+            columns = list(zip(*rows)) if rows else [()] * len(fields)
+            return dumps(columnar(fields, [list(column) for column in columns], len(rows)))
+        return dumps([dict(zip(fields, row)) for row in rows])
@@ -0,0 +1,332 @@
+import bisect
+import itertools
+import json
+import os
+import threading
+from array import array
+from collections import defaultdict
+
+from pyroaring import BitMap
+
+from aliases import alias_version
+from database import get_db_connection, get_read_connection, get_tenants, query_games
+from projections import REPLAY_CHUNK_SIZE, canonical_game, get_aliases, last_event_id
+
+TEAMS = ('Blue', 'Red')
+ROLES = (('Operative', 'operatives'), ('Spymaster', 'spymasters'))
+
+
+def game_keys(game_data):
+    """Yield a (player, role, team) key for every participant of a game"""
+    for team in TEAMS:
+        team_data = game_data[f'{team.lower()}_team']
+        for role, role_key in ROLES:
+            for name in team_data[role_key]:
+                yield name, role, team
+
+
+class GameIndex:
+    """
+    In-memory index of game IDs for ad-hoc participant queries.
+
+    Keeps one compressed (roaring) bitmap of game IDs per (player, role, team),
+    so a conjunctive query is a handful of bitmap unions and intersections.
+    Players are indexed under their canonical names: aliases holds the
+    tenant's aliases the index was built with, alias_version their version,
+    and last_event the last event of the log it includes.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self.aliases = {}
+        self.alias_version = 0
+        self.last_event = 0
+        self._bitmaps = {}  # (player, role, team) -> BitMap of game IDs
+        self._winners = {team: BitMap() for team in TEAMS}
+        self._all = BitMap()
+        # Game IDs sorted by date, for date range predicates
+        self._date_values = array('d')
+        self._date_ids = array('I')
+        # True while IDs ascend with dates, so a date range is an ID range
+        self._ids_follow_dates = True
+
+    def __len__(self):
+        return len(self._all)
+
+    def __contains__(self, game_id):
+        return game_id in self._all
+
+    def load_from_database(self, tenant_id):
+        """Rebuild the index for one tenant from the games' raw data"""
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            # Events committed after this are applied by catch_up, on top of
+            # whatever of them the games below already show
+            self.last_event = last_event_id(cursor, tenant_id)
+            # Read before the aliases, so a change racing the load triggers another rebuild
+            self.alias_version = alias_version(cursor, tenant_id)
+            self.aliases = get_aliases(cursor, tenant_id)
+
+            # Server-side cursor keeps memory flat for large histories
+            games = conn.cursor(name='game_index_games')
+            games.itersize = 50000
+            games.execute('SELECT id, date, raw_data FROM games WHERE tenant_id = %s ORDER BY date, id',
+                          (tenant_id,))
+            self.build_from_raw(games)
+        finally:
+            conn.close()
+
+    def build_from_raw(self, rows):
+        """build() from (game_id, date, raw_data JSON) rows, under the index's aliases"""
+        self.build((game_id, date, canonical_game(json.loads(raw_data), self.aliases))
+                   for game_id, date, raw_data in rows)
+
+    def build(self, games):
+        """
+        Replace the index contents in bulk
+
+        games yields (game_id, date, game data) ordered by date, then ID.
+        """
+        winners = {team: array('I') for team in TEAMS}
+        date_values, date_ids = array('d'), array('I')
+        ids_by_key = defaultdict(lambda: array('I'))
+        for game_id, date, game_data in games:
+            date_values.append(date.timestamp())
+            date_ids.append(game_id)
+            if game_data['winner'] in winners:
+                winners[game_data['winner']].append(game_id)
+            for key in game_keys(game_data):
+                ids_by_key[key].append(game_id)
+
+        self._bitmaps = {key: BitMap(ids) for key, ids in ids_by_key.items()}
+        self._winners = {team: BitMap(ids) for team, ids in winners.items()}
+        self._all = BitMap(date_ids)
+        self._date_values, self._date_ids = date_values, date_ids
+        self._ids_follow_dates = all(a < b for a, b in zip(date_ids, date_ids[1:]))
+        self.ready = True
+
+    def memory_bytes(self):
+        """Approximate memory held by the bitmaps and the date arrays"""
+        bitmaps = list(self._bitmaps.values()) + list(self._winners.values()) + [self._all]
+        return sum(len(bitmap.serialize()) for bitmap in bitmaps) + \
+            self._date_values.itemsize * len(self._date_values) + self._date_ids.itemsize * len(self._date_ids)
+
+    def add_game(self, game_id, game_data, date):
+        """Index a newly saved game"""
+        for key in game_keys(game_data):
+            self._bitmaps.setdefault(key, BitMap()).add(game_id)
+        self._winners[game_data['winner']].add(game_id)
+        self._all.add(game_id)
+
+        timestamp = date.timestamp()
+        position = bisect.bisect_right(self._date_values, timestamp)
+        if position < len(self._date_ids) or (self._date_ids and self._date_ids[-1] > game_id):
+            self._ids_follow_dates = False
+        self._date_values.insert(position, timestamp)
+        self._date_ids.insert(position, game_id)
+
+    def update_game(self, game_id, game_data):
+        """Re-index an edited game, keeping its original date"""
+        self._discard(game_id)
+        for key in game_keys(game_data):
+            self._bitmaps.setdefault(key, BitMap()).add(game_id)
+        self._winners[game_data['winner']].add(game_id)
+
+    def remove_game(self, game_id):
+        """Drop a deleted game from the index"""
+        self._discard(game_id)
+        self._all.discard(game_id)
+        try:
+            position = self._date_ids.index(game_id)
+        except ValueError:
+            return
+        del self._date_values[position]
+        del self._date_ids[position]
+
+    def apply_events(self, events):
+        """Apply (game_id, data, date) events of the log in ID order; data is None for a deletion"""
+        for game_id, game_data, date in events:
+            if game_data is None:
+                self.remove_game(game_id)
+            elif game_id in self._all:
+                self.update_game(game_id, game_data)
+            else:
+                self.add_game(game_id, game_data, date)
+
+    def _discard(self, game_id):
+        for bitmap in self._bitmaps.values():
+            bitmap.discard(game_id)
+        for bitmap in self._winners.values():
+            bitmap.discard(game_id)
+
+    def _constraint_bitmaps(self, constraint):
+        """Return (games matching the constraint, games where the constrained player won)"""
+        roles = [role for role, _ in ROLES] if constraint.get('role', 'Any') == 'Any' else [constraint['role']]
+        teams = [constraint['team']] if constraint.get('team') else TEAMS
+
+        matched, won = BitMap(), BitMap()
+        for team in teams:
+            team_games = BitMap.union(*[self._bitmaps.get((constraint['player'], role, team), BitMap())
+                                        for role in roles])
+            matched |= team_games
+            won |= team_games & self._winners[team]
+        return matched, won
+
+    def _date_range(self, date_from, date_to):
+        low = bisect.bisect_left(self._date_values, date_from.timestamp()) if date_from else 0
+        high = bisect.bisect_right(self._date_values, date_to.timestamp()) if date_to else len(self._date_ids)
+        if low >= high:
+            return BitMap()
+        if self._ids_follow_dates:
+            # Building from a range is far cheaper than from a long list of IDs
+            return BitMap(range(self._date_ids[low], self._date_ids[high - 1] + 1))
+        return BitMap(self._date_ids[low:high])
+
+    def query(self, constraints, winner=None, date_from=None, date_to=None, page=1, page_size=50):
+        """Same contract as database.query_games, answered from the bitmaps"""
+        matched = self._all
+        all_won = None
+        for constraint in constraints:
+            constraint_matched, constraint_won = self._constraint_bitmaps(constraint)
+            matched = matched & constraint_matched
+            all_won = constraint_won if all_won is None else all_won & constraint_won
+
+        if winner:
+            matched = matched & self._winners[winner]
+        if date_from or date_to:
+            matched = matched & self._date_range(date_from, date_to)
+
+        total = len(matched)
+        if total == 0:
+            return {'total_games': 0, 'wins': 0, 'losses': 0, 'win_rate': 0.0, 'game_ids': []}
+        wins = len(matched & all_won) if all_won is not None else 0
+
+        # Newest games first, by date then ID like query_games
+        offset = (page - 1) * page_size
+        if self._ids_follow_dates:
+            stop = max(total - offset, 0)
+            game_ids = list(reversed(matched[max(stop - page_size, 0):stop])) if stop else []
+        else:
+            # Backdated games: walk the date order, which stops early for the first pages
+            newest = (game_id for game_id in reversed(self._date_ids) if game_id in matched)
+            game_ids = list(itertools.islice(newest, offset, offset + page_size))
+
+        return {
+            'total_games': total,
+            'wins': wins,
+            'losses': total - wins,
+            'win_rate': round(100.0 * wins / total, 1),
+            'game_ids': game_ids,
+        }
+
+
+class TenantGameIndexes:
+    """
+    One GameIndex per tenant, so communities never scan each other's games
+
+    An index follows the event log rather than this process' own writes, so
+    it also sees games written by other workers and servers: query() applies
+    the tenant's events since the index's last one, and rebuilds the index in
+    a background thread when the tenant's alias version moved past the one it
+    was built with. Queries keep using the old index until the new one is
+    swapped in. Blocking, so call it from a worker thread.
+    """
+
+    def __init__(self):
+        self.ready = False
+        self._indexes = {}
+        self._tenant_locks = defaultdict(threading.Lock)
+        self._rebuilding = set()
+        self._lock = threading.Lock()  # Guards the dicts above, never held during I/O
+
+    def __len__(self):
+        return sum(len(index) for index in self._indexes.values())
+
+    def load_from_database(self):
+        """
+        Rebuild the indexes of all tenants from the database
+
+        May run in a thread while the API serves requests; changes made
+        meanwhile are applied from the log by the first query of each tenant.
+        """
+        indexes = {}
+        for tenant_id in get_tenants():
+            indexes[tenant_id] = GameIndex()
+            indexes[tenant_id].load_from_database(tenant_id)
+        with self._lock:
+            self._indexes = indexes
+            self.ready = True
+
+    def query(self, tenant_id, constraints, **kwargs):
+        """Same contract as database.query_games, answered from the tenant's index when it has one"""
+        with self._lock:
+            index = self._indexes.get(tenant_id)
+            tenant_lock = self._tenant_locks[tenant_id]
+        if index is None:
+            # A tenant created after the load: SQL answers until its index is built
+            self._rebuild_in_background(tenant_id)
+            return query_games(constraints, tenant_id=tenant_id, **kwargs)
+
+        with tenant_lock:
+            conn = get_read_connection(tenant_id)
+            try:
+                cursor = conn.cursor()
+                cursor.execute('''
+                    SELECT (SELECT MAX(id) FROM game_events WHERE tenant_id = %s),
+                           (SELECT version FROM alias_versions WHERE tenant_id = %s)
+                ''', (tenant_id, tenant_id))
+                event_id, version = cursor.fetchone()
+                # Compared with >, as a lagging replica may be behind the index
+                if (version or 0) > index.alias_version:
+                    self._rebuild_in_background(tenant_id)
+                if (event_id or 0) > index.last_event:
+                    self._catch_up(cursor, tenant_id, index)
+            finally:
+                conn.close()
+            return index.query(constraints, **kwargs)
+
+    def _rebuild_in_background(self, tenant_id):
+        with self._lock:
+            if tenant_id in self._rebuilding:
+                return
+            self._rebuilding.add(tenant_id)
+        threading.Thread(target=self._rebuild, args=(tenant_id,), daemon=True).start()
+
+    def _rebuild(self, tenant_id):
+        """Build a tenant's index from scratch and swap it in; the next query catches it up"""
+        try:
+            index = GameIndex()
+            index.load_from_database(tenant_id)
+            with self._lock:
+                self._indexes[tenant_id] = index
+        except Exception as e:
+            print(f"Warning: Rebuilding the game index of tenant {tenant_id} failed: {e}")
+        finally:
+            with self._lock:
+                self._rebuilding.discard(tenant_id)
+
+    def _catch_up(self, cursor, tenant_id, index):
+        while True:
+            cursor.execute('''
+                SELECT e.id, e.game_id, e.data, g.date, e.created_at
+                FROM game_events e
+                LEFT JOIN games g ON g.id = e.game_id
+                WHERE e.tenant_id = %s AND e.id > %s
+                ORDER BY e.id
+                LIMIT %s
+            ''', (tenant_id, index.last_event, REPLAY_CHUNK_SIZE))
+            rows = cursor.fetchall()
+            if not rows:
+                return
+            # A game deleted by a later event has no row left, its event's time stands in
+            index.apply_events((game_id, None if data is None else canonical_game(json.loads(data), index.aliases),
+                                date or created_at) for _, game_id, data, date, created_at in rows)
+            index.last_event = rows[-1][0]
+
+
+def is_enabled():
+    return os.getenv('GAME_INDEX_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+
+game_index = TenantGameIndexes()
@@ -1,41 +1,125 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response, Depends, Header
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
 from pydantic import BaseModel
 from typing import List, Optional
+from datetime import datetime
+from functools import partial
+import asyncio
 import os
+import time
 from dotenv import load_dotenv
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
 
 from database import (
+    DEFAULT_TENANT,
+    DuplicateGameRequest,
+    GameVersionConflict,
+    IdempotencyKeyConflict,
     init_database,
     get_player_stats,
     get_player_stats_by_role,
     get_total_games,
     get_team_combination_stats,
-    get_team_combination_stats_with_roles,
-    get_all_games,
+    get_team_role_snapshot,
+    get_game_history,
+    get_game_changes,
+    get_games_page,
+    TEAM_ROLE_FIELDS,
     save_game,
     update_game,
     delete_game,
-    get_db_connection
+    query_games,
+    get_db_connection,
+    get_tenants
 )
+from aliases import list_aliases, merge_players, suggest_players, unmerge_player
+from db_router import TOKEN_PATTERN, describe_url, router
+from compression import CompressionMiddleware
+from fast_json import RESPONSE_FORMATS, RowEncoder, dumps, games_to_columnar, json_response, records_to_columnar
+from game_index import game_index, is_enabled as game_index_enabled
+from process_pool import process_pool, PoolSaturated, games_json, team_roles_json
+from rate_limit import RateLimitMiddleware, rate_limiter
+from snapshot_worker import snapshot_worker, is_enabled as snapshots_enabled
 
 load_dotenv()
 
+
+def setup_tracing():
+    """Record spans with the OpenTelemetry SDK, sent to an OTLP collector or printed (TRACE_EXPORTER=otlp|console)"""
+    exporter = os.getenv('TRACE_EXPORTER', '').lower()
+    if not exporter:
+        return
+    if exporter == 'otlp':
+        # Sends to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter()
+    else:
+        span_exporter = ConsoleSpanExporter()
+    provider = TracerProvider(resource=Resource.create({'service.name': os.getenv('OTEL_SERVICE_NAME', 'codenames-api')}))
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+
+
+setup_tracing()
+tracer = trace.get_tracer(__name__)
+
 app = FastAPI(
     title="Codenames Stats API",
     description="API for managing Codenames game statistics",
     version="1.0.0"
 )
 
+# Token buckets per client and concurrency caps for expensive routes; added
+# first so CORS headers are added to its 429/503 responses too
+app.add_middleware(RateLimitMiddleware, limiter=rate_limiter)
+
 # CORS middleware to allow frontend access
 app.add_middleware(
     CORSMiddleware,
-    allow_origins=os.getenv('CORS_ALLOW_ORIGINS').split(","),  # Configure this properly in production
+    allow_origins=os.getenv('CORS_ALLOW_ORIGINS', '*').split(","),  # Configure this properly in production
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Snapshot-Computed-At", "X-Snapshot-Stale", "Idempotent-Replayed", "ETag", "Retry-After",
+                    "X-Next-Cursor", "X-Consistency-Token"],
 )
 
+# Compress responses of at least COMPRESSION_MIN_SIZE bytes for clients that accept br or gzip
+if os.getenv('COMPRESSION_ENABLED', 'true').lower() in ('1', 'true', 'yes'):
+    app.add_middleware(CompressionMiddleware, minimum_size=int(os.getenv('COMPRESSION_MIN_SIZE', 1024)))
+
+
+# Writes return the primary's WAL position in X-Consistency-Token; requests that
+# send it back only read from replicas that have replayed up to it
+@app.middleware("http")
+async def read_your_writes(request: Request, call_next):
+    read_after = request.headers.get('X-Consistency-Token')
+    if read_after is not None and not TOKEN_PATTERN.fullmatch(read_after):
+        return JSONResponse({"detail": "Invalid X-Consistency-Token"}, status_code=400)
+    consistency = router.begin_request(read_after)
+    response = await call_next(request)
+    if consistency.written is not None:
+        response.headers['X-Consistency-Token'] = consistency.written
+    return response
+
+
+# Per-request span, continuing the caller's trace if a traceparent header is sent
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    with tracer.start_as_current_span(
+        f"{request.method} {request.url.path}",
+        context=propagate.extract(request.headers),
+        kind=trace.SpanKind.SERVER,
+        attributes={'http.method': request.method, 'http.target': request.url.path}
+    ) as span:
+        response = await call_next(request)
+        span.set_attribute('http.status_code', response.status_code)
+        return response
+
 
 # Pydantic models for request/response
 class TeamData(BaseModel):
@@ -53,6 +137,7 @@ class GameData(BaseModel):
 class GameResponse(BaseModel):
     game_id: int
     message: str
+    version: Optional[int] = None
 
 
 class PlayerStat(BaseModel):
@@ -88,14 +173,188 @@ class TeamCombinationWithRoles(BaseModel):
     win_rate: float
 
 
+# Column order of the stats queries matches the field order of these models
+player_stat_encoder = RowEncoder(PlayerStat)
+player_role_stat_encoder = RowEncoder(PlayerRoleStat)
+team_combination_encoder = RowEncoder(TeamCombinationStat)
+
+
 class TotalGamesResponse(BaseModel):
     total_games: int
 
 
-# Initialize database on startup
+class GameEvent(BaseModel):
+    id: int
+    type: str
+    version: int
+    created_at: datetime
+    data: Optional[dict] = None
+
+
+class PlayerAlias(BaseModel):
+    alias: str
+    canonical: str
+    automatic: bool
+    created_at: datetime
+
+
+class AliasMerge(BaseModel):
+    alias: str
+    canonical: str
+
+
+class AliasChangeResponse(BaseModel):
+    alias: str
+    canonical: Optional[str] = None
+    games_updated: int
+
+
+class PlayerSuggestion(BaseModel):
+    name: str
+    distance: int
+    similarity: float
+
+
+class QueryConstraint(BaseModel):
+    player: str
+    role: str = "Any"
+    team: Optional[str] = None
+
+
+class GameQuery(BaseModel):
+    constraints: List[QueryConstraint] = []
+    winner: Optional[str] = None
+    date_from: Optional[datetime] = None
+    date_to: Optional[datetime] = None
+    page: int = 1
+    page_size: int = 50
+
+
+class GameQueryResponse(BaseModel):
+    total_games: int
+    wins: int
+    losses: int
+    win_rate: float
+    game_ids: List[int]
+    page: int
+    page_size: int
+    total_pages: int
+
+
+def get_response_format(format: str = "json"):
+    """Wire format of list responses, from ?format=: "json" (default) or "columnar" """
+    if format not in RESPONSE_FORMATS:
+        raise HTTPException(status_code=400, detail=f"format must be one of: {', '.join(RESPONSE_FORMATS)}")
+    return format
+
+
+def get_tenant_id(x_tenant_id: Optional[str] = Header(None)):
+    """Community (e.g. Discord guild) the request is scoped to, from the X-Tenant-ID header"""
+    tenant_id = (x_tenant_id or DEFAULT_TENANT).strip()
+    if not tenant_id or len(tenant_id) > 64:
+        raise HTTPException(status_code=400, detail="X-Tenant-ID must be 1-64 characters")
+    return tenant_id
+
+
+def get_expected_version(if_match: Optional[str] = Header(None)):
+    """Game version a write is conditional on, from an If-Match header holding a game's ETag"""
+    if if_match is None or if_match.strip() == '*':
+        return None
+    etag = if_match.strip()
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    try:
+        return int(etag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail='If-Match must be a game ETag such as "3"')
+
+
+def version_etag(version):
+    """ETag header value for a game version"""
+    return f'"{version}"'
+
+
+def version_conflict(e):
+    """409 for a write whose If-Match no longer matches, with the current version's ETag"""
+    return HTTPException(status_code=409, detail=str(e), headers={'ETag': version_etag(e.current_version)})
+
+
+async def start_process_pool():
+    try:
+        await process_pool.start()
+    except Exception as e:
+        print(f"Warning: Could not start process pool, running stats inline: {e}")
+        process_pool.shutdown()
+
+
+async def load_game_index():
+    if not game_index_enabled():
+        return
+    try:
+        with tracer.start_as_current_span('game_index.load'):
+            await asyncio.to_thread(game_index.load_from_database)
+        print(f"Game index loaded: {len(game_index)} games")
+    except Exception as e:
+        print(f"Warning: Could not build game index, queries will use SQL: {e}")
+
+
+async def check_replicas():
+    # Health checks connect to every replica; do them now rather than on the first reads
+    for url in router.replica_urls:
+        try:
+            await asyncio.to_thread(router.is_healthy, url)
+        except Exception as e:
+            print(f"Warning: Could not check replica {describe_url(url)}, reading from the primary: {e}")
+            router.mark_unhealthy(url)
+
+
+async def warm_up(step):
+    """Run a startup step, then take it off the list readiness waits for, even if it failed"""
+    try:
+        await step()
+    except Exception as e:
+        print(f"Warning: Startup step {step.__name__} failed, continuing without it: {e}")
+    app.state.warming_up.discard(step.__name__)
+    if not app.state.warming_up:
+        app.state.ready_after = time.perf_counter() - app.state.started_at
+        print(f"Ready to serve after {app.state.ready_after:.2f}s")
+        await refresh_snapshots()
+
+
+async def refresh_snapshots():
+    # Started once ready, so it doesn't compete with the warm-up; until it
+    # finishes the snapshots persisted by the previous run are served
+    if not snapshots_enabled():
+        return
+    try:
+        snapshot_worker.schedule_all(await asyncio.to_thread(get_tenants))
+    except Exception as e:
+        print(f"Warning: Could not schedule snapshot refresh: {e}")
+
+
+# Check the schema before accepting traffic, then warm up in the background
 @app.on_event("startup")
 async def startup_event():
-    init_database()
+    app.state.started_at = time.perf_counter()
+    app.state.ready_after = None
+    with tracer.start_as_current_span('startup.init_database'):
+        await asyncio.to_thread(init_database)
+
+    steps = [start_process_pool, load_game_index, check_replicas]
+    app.state.warming_up = {step.__name__ for step in steps}
+    app.state.warm_up_tasks = [asyncio.create_task(warm_up(step)) for step in steps]
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    for task in app.state.warm_up_tasks:
+        task.cancel()
+    process_pool.shutdown()
+
+
+def pool_saturated(e):
+    """503 telling clients to retry shortly when the process pool sheds load"""
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
 
 
 # Health check endpoint
@@ -110,115 +369,326 @@ async def health_check():
     try:
         conn = get_db_connection()
         conn.close()
-        return {"status": "healthy", "database": "connected"}
+        response = {"status": "healthy", "database": "connected"}
+        if router.replica_urls:
+            response["replicas"] = router.status()
+        return response
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database connection failed: {str(e)}")
 
 
+@app.get("/health/live")
+async def liveness_probe():
+    """Liveness probe: the event loop is responding, the database is not checked"""
+    return {"status": "alive"}
+
+
+@app.get("/health/ready")
+async def readiness_probe():
+    """Readiness probe: 503 while warming up after startup or when the database is unreachable"""
+    if app.state.warming_up:
+        raise HTTPException(status_code=503, detail=f"Warming up: {', '.join(sorted(app.state.warming_up))}",
+                            headers={"Retry-After": "1"})
+    try:
+        conn = await asyncio.to_thread(get_db_connection)
+        conn.close()
+    except Exception as e:
+        raise HTTPException(status_code=503, detail=f"Database connection failed: {str(e)}")
+    return {"status": "ready", "startup_seconds": round(app.state.ready_after, 3)}
+
+
+@app.get("/metrics")
+async def metrics():
+    """Process pool load, queue wait times and rate limiting counters"""
+    return {"process_pool": process_pool.metrics(), "rate_limit": rate_limiter.metrics()}
+
+
 # Stats endpoints
 @app.get("/api/stats/players", response_model=List[PlayerStat])
-async def get_players_stats():
-    """Get overall statistics for all players"""
+async def get_players_stats(tenant_id: str = Depends(get_tenant_id),
+                            response_format: str = Depends(get_response_format)):
+    """
+    Get overall statistics for all players
+
+    Query parameters:
+    - format: "json" (default) or "columnar"
+    """
     try:
-        stats = get_player_stats()
-        return [
-            PlayerStat(
-                name=name,
-                total_games=total,
-                wins=wins,
-                losses=losses,
-                win_rate=win_rate
-            )
-            for name, total, wins, losses, win_rate in stats
-        ]
+        stats = get_player_stats(tenant_id)
+        return json_response(player_stat_encoder.encode(stats, response_format))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/stats/players/by-role", response_model=List[PlayerRoleStat])
-async def get_players_stats_by_role():
-    """Get statistics for all players broken down by role (Operative vs Spymaster)"""
+async def get_players_stats_by_role(tenant_id: str = Depends(get_tenant_id),
+                                    response_format: str = Depends(get_response_format)):
+    """
+    Get statistics for all players broken down by role (Operative vs Spymaster)
+
+    Query parameters:
+    - format: "json" (default) or "columnar"
+    """
     try:
-        stats = get_player_stats_by_role()
-        return [
-            PlayerRoleStat(
-                name=name,
-                role=role,
-                total_games=total,
-                wins=wins,
-                win_rate=win_rate
-            )
-            for name, role, total, wins, win_rate in stats
-        ]
+        stats = get_player_stats_by_role(tenant_id)
+        return json_response(player_role_stat_encoder.encode(stats, response_format))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/stats/team-combinations", response_model=List[TeamCombinationStat])
-async def get_team_combinations(min_games: int = 2):
+async def get_team_combinations(min_games: int = 2, tenant_id: str = Depends(get_tenant_id),
+                                response_format: str = Depends(get_response_format)):
     """
     Get statistics for team combinations
 
     Query parameters:
     - min_games: Minimum number of games played together (default: 2)
+    - format: "json" (default) or "columnar"
     """
     try:
-        stats = get_team_combination_stats(min_games)
-        return [
-            TeamCombinationStat(
-                player_names=names,
-                wins=wins,
-                losses=losses,
-                total_games=total,
-                win_rate=win_rate
-            )
-            for names, wins, losses, total, win_rate in stats
-        ]
+        stats = get_team_combination_stats(min_games, tenant_id)
+        return json_response(team_combination_encoder.encode(stats, response_format))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/stats/team-combinations-with-roles", response_model=List[TeamCombinationWithRoles])
-async def get_team_combinations_with_role_info(min_games: int = 2):
+async def get_team_combinations_with_role_info(min_games: int = 2, tenant_id: str = Depends(get_tenant_id),
+                                               response_format: str = Depends(get_response_format)):
     """
     Get statistics for team combinations with role information
 
+    Served from a snapshot refreshed in the background after writes. The
+    X-Snapshot-Computed-At header tells when it was computed, and
+    X-Snapshot-Stale is true while a refresh is pending. Without a snapshot
+    yet, the stats are computed live and no timestamp is sent.
+
     Query parameters:
     - min_games: Minimum number of games played together (default: 2)
+    - format: "json" (default) or "columnar"
     """
     try:
-        stats = get_team_combination_stats_with_roles(min_games)
-        return stats
+        if snapshots_enabled():
+            stats, computed_at = get_team_role_snapshot(min_games, tenant_id)
+            if computed_at is not None:
+                if response_format == 'columnar':
+                    stats = records_to_columnar(stats, TEAM_ROLE_FIELDS)
+                return json_response(dumps(stats), headers={
+                    'X-Snapshot-Computed-At': computed_at.isoformat(),
+                    'X-Snapshot-Stale': str(snapshot_worker.is_pending(tenant_id)).lower(),
+                })
+            snapshot_worker.schedule(tenant_id)
+        stats = await process_pool.run(team_roles_json, min_games, tenant_id, router.wrote_recently(tenant_id),
+                                       response_format, router.read_after())
+        return json_response(stats)
+    except PoolSaturated as e:
+        raise pool_saturated(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.get("/api/stats/total-games", response_model=TotalGamesResponse)
-async def get_total_games_count():
+async def get_total_games_count(tenant_id: str = Depends(get_tenant_id)):
     """Get the total number of games played"""
     try:
-        total = get_total_games()
+        total = get_total_games(tenant_id)
         return TotalGamesResponse(total_games=total)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Largest page of GET /api/games?limit=
+MAX_GAMES_PAGE = 1000
+
+
+def encode_games_cursor(after):
+    date, game_id = after
+    return f"{game_id}:{date.isoformat()}"
+
+
+def decode_games_cursor(cursor):
+    try:
+        game_id, date = cursor.split(":", 1)
+        return datetime.fromisoformat(date), int(game_id)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+
 @app.get("/api/games")
-async def get_games():
-    """Get all games with their details"""
+async def get_games(ids: Optional[str] = None, limit: Optional[int] = None, cursor: Optional[str] = None,
+                    tenant_id: str = Depends(get_tenant_id),
+                    response_format: str = Depends(get_response_format)):
+    """
+    Get all games with their details
+
+    Query parameters:
+    - ids: Optional comma-separated game IDs to fetch instead of the full history
+    - limit: Optional page size (up to 1000); the X-Next-Cursor response header
+      is set when there are more games. Combined with ids, pages through those games
+    - cursor: X-Next-Cursor of the previous page
+    - format: "json" (default) or "columnar", which sends player names once in a shared list
+    """
+    game_ids = None
+    if ids is not None:
+        try:
+            game_ids = [int(game_id) for game_id in ids.split(",") if game_id.strip()]
+        except ValueError:
+            raise HTTPException(status_code=400, detail="ids must be comma-separated integers")
+
+    if limit is not None or cursor is not None:
+        if limit is None or not 1 <= limit <= MAX_GAMES_PAGE:
+            raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_GAMES_PAGE}")
+        after = decode_games_cursor(cursor) if cursor else None
+        try:
+            games, next_after = get_games_page(limit, after, tenant_id, game_ids)
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=str(e))
+        headers = {"X-Next-Cursor": encode_games_cursor(next_after)} if next_after else None
+        return json_response(dumps(games_to_columnar(games) if response_format == "columnar" else games), headers)
+
+    try:
+        games = await process_pool.run(games_json, game_ids, tenant_id, router.wrote_recently(tenant_id),
+                                       response_format, router.read_after())
+        return json_response(games)
+    except HTTPException:
+        raise
+    except PoolSaturated as e:
+        raise pool_saturated(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+# Largest version a client can send, event IDs are BIGSERIAL
+MAX_CHANGES_VERSION = 2 ** 63 - 1
+
+
+@app.get("/api/games/changes")
+async def get_games_changes(since: int, limit: int = MAX_GAMES_PAGE, tenant_id: str = Depends(get_tenant_id),
+                            response_format: str = Depends(get_response_format)):
+    """
+    Get the games created, edited or deleted since a version, for clients
+    that keep a copy of the history
+
+    Response: {version, has_more, games, deleted}. games are in their current
+    state, in the shape of GET /api/games (or its columnar form); deleted
+    lists the IDs of deleted games, including ones created and deleted since
+    the version. Pass version as since for the next call; while has_more is
+    true there are more changes already. Start with since=0, which returns
+    every game. 410 means the version is no longer known, e.g. the server's
+    log was reset: drop the copy and sync again from since=0.
+
+    Query parameters:
+    - since: version of the client's copy (0 for none)
+    - limit: Most changes read per call (up to 1000, default 1000)
+    - format: "json" (default) or "columnar", for games
+    """
+    if not 0 <= since <= MAX_CHANGES_VERSION:
+        raise HTTPException(status_code=400, detail="since must be a version returned by this endpoint, or 0")
+    if not 1 <= limit <= MAX_GAMES_PAGE:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_GAMES_PAGE}")
+    try:
+        changes = get_game_changes(since, limit, tenant_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    if changes is None:
+        raise HTTPException(status_code=410, detail=f"Version {since} is unknown, full resync required")
+
+    games, deleted, version, has_more = changes
+    return json_response(dumps({
+        "version": version,
+        "has_more": has_more,
+        "games": games_to_columnar(games) if response_format == "columnar" else games,
+        "deleted": deleted,
+    }))
+
+
+@app.get("/api/games/{game_id}/history", response_model=List[GameEvent])
+async def get_game_history_events(game_id: int, tenant_id: str = Depends(get_tenant_id)):
+    """
+    Get every change made to a game, oldest first
+
+    Each event is "created", "edited" or "deleted" and has the game's version
+    and data after the change (null for "deleted"). Games recorded before the
+    event log existed start with a "created" event holding their data at that
+    time.
+
+    Path parameters:
+    - game_id: The ID of the game
+    """
+    try:
+        events = get_game_history(game_id, tenant_id)
+        if not events:
+            raise HTTPException(status_code=404, detail=f"Game {game_id} not found")
+        return events
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/query", response_model=GameQueryResponse)
+async def query(game_query: GameQuery, tenant_id: str = Depends(get_tenant_id)):
+    """
+    Find games matching a set of player constraints
+
+    Request body:
+    - constraints: List of {player, role, team}; role is "Any", "Operative" or "Spymaster",
+      team is optional ("Blue" or "Red"). All constraints must match (AND).
+    - winner: Optional winning team ("Blue" or "Red")
+    - date_from / date_to: Optional inclusive date range
+    - page / page_size: Paging of the returned game IDs (newest first)
+
+    A matching game counts as a win when every constrained player was on the winning team.
+    """
+    for constraint in game_query.constraints:
+        if constraint.role not in ["Any", "Operative", "Spymaster"]:
+            raise HTTPException(status_code=400, detail="role must be 'Any', 'Operative' or 'Spymaster'")
+        if constraint.team is not None and constraint.team not in ["Blue", "Red"]:
+            raise HTTPException(status_code=400, detail="team must be 'Blue' or 'Red'")
+    if game_query.winner is not None and game_query.winner not in ["Blue", "Red"]:
+        raise HTTPException(status_code=400, detail="winner must be 'Blue' or 'Red'")
+    if game_query.page < 1 or not 1 <= game_query.page_size <= 500:
+        raise HTTPException(status_code=400, detail="page must be >= 1 and page_size between 1 and 500")
+
     try:
-        games = get_all_games()
-        return games
+        # Answer from the in-memory bitmap index when it is loaded; both block, so off the event loop
+        if game_index.ready:
+            run_query = partial(game_index.query, tenant_id)
+        else:
+            run_query = partial(query_games, tenant_id=tenant_id)
+        result = await asyncio.to_thread(
+            run_query,
+            [constraint.model_dump() for constraint in game_query.constraints],
+            winner=game_query.winner,
+            date_from=game_query.date_from,
+            date_to=game_query.date_to,
+            page=game_query.page,
+            page_size=game_query.page_size
+        )
+        total_pages = -(-result['total_games'] // game_query.page_size)
+        return GameQueryResponse(
+            **result,
+            page=game_query.page,
+            page_size=game_query.page_size,
+            total_pages=total_pages
+        )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 # Game management endpoints
 @app.post("/api/games", response_model=GameResponse)
-async def create_game(game_data: GameData):
+async def create_game(game_data: GameData, response: Response, tenant_id: str = Depends(get_tenant_id),
+                      idempotency_key: Optional[str] = Header(None)):
     """
     Create a new game record
 
+    Send an Idempotency-Key header (e.g. the Discord message and attachment ID)
+    to make retries safe: repeating the request within IDEMPOTENCY_KEY_TTL_HOURS
+    returns the game created the first time, with Idempotent-Replayed: true,
+    instead of recording it again.
+
     Request body should include:
     - blue_team: Team data with operatives, spymasters, and count
     - red_team: Team data with operatives, spymasters, and count
@@ -274,8 +744,25 @@ async def create_game(game_data: GameData):
         if game_data.won_because_of_assassin:
             game_dict["won_because_of_assassin"] = game_data.won_because_of_assassin
 
-        game_id = save_game(game_dict)
-        return GameResponse(game_id=game_id, message=f"Game #{game_id} created successfully")
+        if idempotency_key is not None and not 1 <= len(idempotency_key) <= 255:
+            raise HTTPException(status_code=400, detail="Idempotency-Key must be 1-255 characters")
+
+        try:
+            with tracer.start_as_current_span('db.save_game'):
+                game_id = save_game(game_dict, tenant_id, idempotency_key)
+        except DuplicateGameRequest as e:
+            response.headers['Idempotent-Replayed'] = 'true'
+            if e.version is not None:
+                response.headers['ETag'] = version_etag(e.version)
+            return GameResponse(game_id=e.game_id, message=f"Game #{e.game_id} created successfully",
+                                version=e.version)
+        except IdempotencyKeyConflict as e:
+            raise HTTPException(status_code=422, detail=str(e))
+
+        if snapshots_enabled():
+            snapshot_worker.schedule(tenant_id)
+        response.headers['ETag'] = version_etag(1)
+        return GameResponse(game_id=game_id, message=f"Game #{game_id} created successfully", version=1)
     except HTTPException:
         raise
     except Exception as e:
@@ -283,10 +770,16 @@ async def create_game(game_data: GameData):
 
 
 @app.put("/api/games/{game_id}", response_model=GameResponse)
-async def update_game_data(game_id: int, game_data: GameData):
+async def update_game_data(game_id: int, game_data: GameData, response: Response,
+                           tenant_id: str = Depends(get_tenant_id),
+                           expected_version: Optional[int] = Depends(get_expected_version)):
     """
     Update an existing game record
 
+    Send the game's version as If-Match (e.g. If-Match: "3") to update it only
+    if nobody changed it since; otherwise the request fails with 409 and the
+    current version's ETag. The new version is returned in the ETag header.
+
     Path parameters:
     - game_id: The ID of the game to update
 
@@ -345,31 +838,120 @@ async def update_game_data(game_id: int, game_data: GameData):
         if game_data.won_because_of_assassin:
             game_dict["won_because_of_assassin"] = game_data.won_because_of_assassin
 
-        update_game(game_id, game_dict)
-        return GameResponse(game_id=game_id, message=f"Game #{game_id} updated successfully")
+        try:
+            with tracer.start_as_current_span('db.update_game', attributes={'game.id': game_id}):
+                version = update_game(game_id, game_dict, tenant_id, expected_version)
+        except GameVersionConflict as e:
+            raise version_conflict(e)
+
+        if snapshots_enabled():
+            snapshot_worker.schedule(tenant_id)
+        response.headers['ETag'] = version_etag(version)
+        return GameResponse(game_id=game_id, message=f"Game #{game_id} updated successfully", version=version)
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @app.delete("/api/games/{game_id}", response_model=GameResponse)
-async def delete_game_data(game_id: int):
+async def delete_game_data(game_id: int, tenant_id: str = Depends(get_tenant_id),
+                           expected_version: Optional[int] = Depends(get_expected_version)):
     """
     Delete an existing game record
 
+    With If-Match, the game is only deleted if it is still at that version
+    (409 otherwise).
+
     Path parameters:
     - game_id: The ID of the game to delete
     """
     try:
-        delete_game(game_id)
+        try:
+            with tracer.start_as_current_span('db.delete_game', attributes={'game.id': game_id}):
+                delete_game(game_id, tenant_id, expected_version)
+        except GameVersionConflict as e:
+            raise version_conflict(e)
+
+        if snapshots_enabled():
+            snapshot_worker.schedule(tenant_id)
         return GameResponse(game_id=game_id, message=f"Game #{game_id} deleted successfully")
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=404, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 
+# Player alias endpoints
+def aliases_changed(tenant_id, updated):
+    """Refresh the snapshots after a merge or unmerge; the game index notices the new aliases itself"""
+    if updated and snapshots_enabled():
+        snapshot_worker.schedule(tenant_id)
+
+
+@app.get("/api/players/aliases", response_model=List[PlayerAlias])
+async def get_player_aliases(tenant_id: str = Depends(get_tenant_id)):
+    """List the aliases of the tenant's players, grouped by canonical player"""
+    try:
+        return list_aliases(tenant_id)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.post("/api/players/aliases", response_model=AliasChangeResponse)
+async def merge_player_alias(merge: AliasMerge, tenant_id: str = Depends(get_tenant_id)):
+    """
+    Merge a player name into another player
+
+    The alias's games count for the canonical player from now on, including
+    games recorded before the merge. Aliases of the alias move along. If
+    canonical is itself an alias, its player is used. Two players who played
+    in the same game cannot be merged.
+    """
+    try:
+        canonical, updated = merge_players(tenant_id, merge.alias, merge.canonical)
+        aliases_changed(tenant_id, updated)
+        return AliasChangeResponse(alias=merge.alias, canonical=canonical, games_updated=len(updated))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.delete("/api/players/aliases/{alias}", response_model=AliasChangeResponse)
+async def unmerge_player_alias(alias: str, tenant_id: str = Depends(get_tenant_id)):
+    """Undo a merge: the alias becomes a player of its own again, with the games recorded under it"""
+    try:
+        updated = unmerge_player(tenant_id, alias)
+        aliases_changed(tenant_id, updated)
+        return AliasChangeResponse(alias=alias, games_updated=len(updated))
+    except ValueError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@app.get("/api/players/suggestions", response_model=List[PlayerSuggestion])
+async def get_player_suggestions(name: str, limit: int = 5, max_distance: int = 3,
+                                 tenant_id: str = Depends(get_tenant_id)):
+    """
+    Find players whose names are close to name, e.g. to offer a merge
+
+    Query parameters:
+    - name: Name to look up
+    - limit: Maximum number of players (default: 5)
+    - max_distance: Maximum edits after ignoring case and accents (default: 3)
+    """
+    try:
+        return suggest_players(tenant_id, name, min(limit, 50), max_distance)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 if __name__ == "__main__":
     import uvicorn
     port = int(os.getenv("API_PORT", 8000))
@@ -0,0 +1,154 @@
+import asyncio
+import multiprocessing
+import os
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+from opentelemetry import trace
+
+from database import TEAM_ROLE_FIELDS, get_all_games, get_team_combination_stats_with_roles
+from db_router import router
+from fast_json import dumps, games_to_columnar, records_to_columnar
+
+tracer = trace.get_tracer(__name__)
+
+
+class PoolSaturated(Exception):
+    """Raised when the process pool queue is full and the request should be shed"""
+
+
+# Tasks run in the worker processes. They take plain arguments and return JSON
+# bytes, so neither big result lists nor response models are built on the event loop.
+
+def _begin_request(read_primary, read_after):
+    # Workers have their own router: carry over whether the API process' router
+    # sends this read to the primary, and the request's consistency token. Scoped
+    # to this task, so it neither records a write nor extends the window.
+    router.begin_request(read_after, force_primary=read_primary)
+
+
+def games_json(game_ids, tenant_id, read_primary=False, response_format='json', read_after=None):
+    _begin_request(read_primary, read_after)
+    games = get_all_games(game_ids, tenant_id)
+    return dumps(games_to_columnar(games) if response_format == 'columnar' else games)
+
+
+def team_roles_json(min_games, tenant_id, read_primary=False, response_format='json', read_after=None):
+    _begin_request(read_primary, read_after)
+    stats = get_team_combination_stats_with_roles(min_games, tenant_id)
+    if response_format == 'columnar':
+        stats = records_to_columnar(stats, TEAM_ROLE_FIELDS)
+    return dumps(stats)
+
+
+def _timed_call(fn, submitted_at, args):
+    # Wall clock, since the API and worker processes don't share a monotonic clock origin
+    queue_wait = time.time() - submitted_at
+    return fn(*args), queue_wait
+
+
+def _warm_up():
+    # Imports are done when the worker starts; touch the database so the
+    # first real task doesn't pay for DNS lookups and TLS setup
+    from database import get_db_connection
+    try:
+        get_db_connection().close()
+    except Exception:
+        pass
+    time.sleep(0.1)  # keep this worker busy so the pool starts all the others
+    return os.getpid()
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * fraction), len(ordered) - 1)]
+
+
+class ProcessPool:
+    """
+    Optional process pool for CPU-heavy stats and serialization.
+
+    With EXECUTION_MODE=process, run() executes tasks in
+    PROCESS_POOL_WORKERS processes. At most PROCESS_POOL_MAX_QUEUE tasks
+    wait beyond the ones running; further requests are shed with
+    PoolSaturated. Otherwise run() calls the task inline.
+    """
+
+    def __init__(self):
+        self._pool = None
+        self.workers = 0
+        self.max_queue = 0
+        self._in_flight = 0
+        self._completed = 0
+        self._rejected = 0
+        self._queue_waits = deque(maxlen=1000)  # seconds, most recent tasks
+
+    async def start(self):
+        """Create the pool if configured and start every worker before traffic arrives"""
+        if os.getenv('EXECUTION_MODE', 'inline').lower() != 'process':
+            return
+        self.workers = int(os.getenv('PROCESS_POOL_WORKERS', os.cpu_count() or 1))
+        self.max_queue = int(os.getenv('PROCESS_POOL_MAX_QUEUE', self.workers * 2))
+        # spawn rather than fork, workers must not inherit the server's sockets and threads
+        self._pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context('spawn'))
+
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        with tracer.start_as_current_span('process_pool.warm_up', attributes={'pool.workers': self.workers}):
+            pids = await asyncio.gather(*[loop.run_in_executor(self._pool, _warm_up)
+                                          for _ in range(self.workers)])
+        print(f"Process pool ready: {len(set(pids))} workers in {time.perf_counter() - start:.2f}s")
+
+    def shutdown(self):
+        if self._pool is not None:
+            self._pool.shutdown(cancel_futures=True)
+            self._pool = None
+
+    async def run(self, fn, *args):
+        """Run fn(*args) in the pool, or inline when the pool is not enabled"""
+        if self._pool is None:
+            return fn(*args)
+
+        if self._in_flight >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise PoolSaturated(f"Process pool saturated ({self._in_flight} tasks in flight)")
+
+        self._in_flight += 1
+        submitted_at = time.time()
+        try:
+            with tracer.start_as_current_span('process_pool.run', attributes={'task': fn.__name__}) as span:
+                result, queue_wait = await asyncio.get_running_loop().run_in_executor(
+                    self._pool, _timed_call, fn, submitted_at, args)
+                span.set_attribute('pool.queue_wait_ms', round(queue_wait * 1000, 2))
+        finally:
+            self._in_flight -= 1
+
+        self._completed += 1
+        self._queue_waits.append(queue_wait)
+        return result
+
+    def metrics(self):
+        """Pool size, load and queue wait percentiles over the last 1000 tasks"""
+        metrics = {
+            'mode': 'process' if self._pool is not None else 'inline',
+            'workers': self.workers,
+            'in_flight': self._in_flight,
+            'queue_depth': max(self._in_flight - self.workers, 0),
+            'max_queue_depth': self.max_queue,
+            'completed': self._completed,
+            'rejected': self._rejected,
+        }
+        if self._queue_waits:
+            waits = list(self._queue_waits)
+            metrics['queue_wait_ms'] = {
+                'mean': round(1000 * sum(waits) / len(waits), 2),
+                'p50': round(1000 * percentile(waits, 0.50), 2),
+                'p95': round(1000 * percentile(waits, 0.95), 2),
+                'p99': round(1000 * percentile(waits, 0.99), 2),
+                'max': round(1000 * max(waits), 2),
+            }
+        return metrics
+
+
+process_pool = ProcessPool()
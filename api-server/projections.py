@@ -0,0 +1,472 @@
+"""
+Game event log and the stats tables projected from it
+
+Every write appends an event to game_events: 'created', 'edited' or
+'deleted', with the game's data after (data) and before (previous_data) the
+change. game_participants, team_combinations and player_stats are
+projections of that log: each one turns a batch of events into changes of
+its rows, so the same apply() handles the single event of a live write, in
+the write's transaction, and the thousands of events of a replay.
+
+Projections count players under their canonical names: an alias in
+player_aliases (aliases.py) is replaced by its player before an event is
+applied, while the log and games.raw_data keep the names as recorded.
+
+A projection's checkpoint is the last event of a tenant its rows include.
+A tenant's writes are serialized (lock_tenant_events), so its event IDs
+grow in commit order and every event up to the checkpoint is applied.
+Writes only apply the projections that are caught up with the log;
+replay() catches up the others, e.g. one added by a new schema version, or
+rebuilds a projection from scratch, in bulk.
+
+Usage:
+    python projections.py status
+    python projections.py replay [--tenant TENANT] [--projection NAME] [--rebuild]
+"""
+import argparse
+import json
+import sys
+import time
+from datetime import datetime
+from itertools import combinations
+
+from storage import get_backend
+
+# Events read per round trip during a replay
+REPLAY_CHUNK_SIZE = 5000
+
+# First key of the Postgres advisory locks serializing each tenant's writes,
+# the second is the hash of the tenant ID
+EVENTS_LOCK_CLASS = 1162761299
+
+
+def get_all_combinations(players):
+    """Generate all possible combinations of players (2+)"""
+    # Sort players to ensure consistent ordering
+    players = sorted(players)
+
+    combos = []
+    # Generate combinations of size 2 to len(players)
+    for r in range(2, len(players) + 1):
+        for combo in combinations(players, r):
+            combos.append(','.join(sorted(combo)))
+
+    return combos
+
+
+def game_participants(game_data):
+    """(name, team, role, won) of every player of a game, as stored in game_participants"""
+    for team_color in ['blue', 'red']:
+        team_data = game_data[f'{team_color}_team']
+        won = (game_data['winner'].lower() == team_color)
+        for role, key in (('Operative', 'operatives'), ('Spymaster', 'spymasters')):
+            for player_name in team_data[key]:
+                yield player_name, team_color.capitalize(), role, won
+
+
+def team_combination_changes(game_data, sign=1, changes=None):
+    """
+    Add a game's wins and losses to a {player_names: [wins, losses]} dict of
+    counter changes, or subtract them with sign=-1
+    """
+    if changes is None:
+        changes = {}
+    for team_color in ['blue', 'red']:
+        team_data = game_data[f'{team_color}_team']
+        won = (game_data['winner'].lower() == team_color)
+        for combo_str in get_all_combinations(team_data['operatives'] + team_data['spymasters']):
+            change = changes.setdefault(combo_str, [0, 0])
+            change[0 if won else 1] += sign
+    return changes
+
+
+def player_stat_changes(game_data, sign=1, changes=None):
+    """Like team_combination_changes, keyed by (name, role)"""
+    if changes is None:
+        changes = {}
+    for name, _, role, won in game_participants(game_data):
+        change = changes.setdefault((name, role), [0, 0])
+        change[0 if won else 1] += sign
+    return changes
+
+
+def get_aliases(cursor, tenant_id, names=None):
+    """{alias: canonical name} of the tenant, only for names if given"""
+    if names is None:
+        cursor.execute('SELECT alias, canonical FROM player_aliases WHERE tenant_id = %s', (tenant_id,))
+    elif names:
+        cursor.execute('SELECT alias, canonical FROM player_aliases WHERE tenant_id = %s AND alias = ANY(%s)',
+                       (tenant_id, sorted(names)))
+    else:
+        return {}
+    return dict(cursor.fetchall())
+
+
+def player_names(game_data):
+    return {name for name, _, _, _ in game_participants(game_data)}
+
+
+def canonical_game(game_data, aliases):
+    """game_data with every alias replaced by its player's canonical name"""
+    if game_data is None or not aliases:
+        return game_data
+    result = dict(game_data)
+    for team in ('blue_team', 'red_team'):
+        team_data = result[team] = dict(game_data[team])
+        for key in ('operatives', 'spymasters'):
+            team_data[key] = [aliases.get(name, name) for name in team_data[key]]
+    return result
+
+
+def get_player_ids(cursor, tenant_id, names):
+    """{name: players.id} for names, adding the players that do not exist yet"""
+    names = sorted(set(names))
+    if not names:
+        return {}
+    cursor.execute('SELECT name, id FROM players WHERE tenant_id = %s AND name = ANY(%s)', (tenant_id, names))
+    player_ids = dict(cursor.fetchall())
+    missing = [name for name in names if name not in player_ids]
+    if missing:
+        get_backend().insert_many(cursor, '''
+            INSERT INTO players (tenant_id, name) VALUES %s
+            ON CONFLICT (tenant_id, name) DO NOTHING
+        ''', [(tenant_id, name) for name in missing])
+        cursor.execute('SELECT name, id FROM players WHERE tenant_id = %s AND name = ANY(%s)', (tenant_id, missing))
+        player_ids.update(cursor.fetchall())
+    return player_ids
+
+
+def insert_participants(cursor, tenant_id, games):
+    """Insert the game_participants rows of (game_id, game_data) pairs"""
+    participants = [(game_id,) + participant
+                    for game_id, game_data in games for participant in game_participants(game_data)]
+    player_ids = get_player_ids(cursor, tenant_id, [participant[1] for participant in participants])
+    get_backend().insert_many(cursor, '''
+        INSERT INTO game_participants (tenant_id, game_id, player_id, team, role, won) VALUES %s
+    ''', [(tenant_id, game_id, player_ids[name], team, role, won)
+          for game_id, name, team, role, won in participants])
+
+
+def add_to_counters(cursor, table, key_columns, tenant_id, changes):
+    """
+    Add {key: [wins, losses]} changes to a counter table
+
+    Rows are written in key order, so concurrent writers (e.g. a repair)
+    lock them in the same order. Keys whose changes net out to zero are not
+    touched.
+    """
+    keys = ', '.join(key_columns)
+    get_backend().insert_many(cursor, f'''
+        INSERT INTO {table} (tenant_id, {keys}, wins, losses) VALUES %s
+        ON CONFLICT (tenant_id, {keys}) DO UPDATE
+            SET wins   = {table}.wins + EXCLUDED.wins,
+                losses = {table}.losses + EXCLUDED.losses
+    ''', [(tenant_id,) + (key if isinstance(key, tuple) else (key,)) + (wins, losses)
+          for key, (wins, losses) in sorted(changes.items()) if wins or losses])
+
+
+class Projection:
+    """Rows derived from the event log; subclasses set name and tables and implement apply()"""
+
+    name = None
+    tables = ()
+
+    def reset(self, cursor, tenant_id):
+        """Delete the tenant's rows, before a rebuild"""
+        for table in self.tables:
+            cursor.execute(f'DELETE FROM {table} WHERE tenant_id = %s', (tenant_id,))
+
+    def apply(self, cursor, tenant_id, events):
+        """Update the tenant's rows for a batch of events in ID order"""
+        raise NotImplementedError
+
+
+class ParticipantsProjection(Projection):
+    """game_participants: who played each existing game, in which team and role"""
+
+    name = 'participants'
+    tables = ('game_participants',)
+
+    def apply(self, cursor, tenant_id, events):
+        replaced, latest = set(), {}
+        for event in events:
+            if event['previous'] is not None:
+                replaced.add(event['game_id'])
+            latest[event['game_id']] = event['data']
+        if replaced:
+            cursor.execute('DELETE FROM game_participants WHERE tenant_id = %s AND game_id = ANY(%s)',
+                           (tenant_id, sorted(replaced)))
+
+        latest = {game_id: data for game_id, data in latest.items() if data is not None}
+        if latest:
+            # A replay reaches games that later events delete, their rows are gone
+            cursor.execute('SELECT id FROM games WHERE tenant_id = %s AND id = ANY(%s)', (tenant_id, list(latest)))
+            existing = {row[0] for row in cursor.fetchall()}
+            insert_participants(cursor, tenant_id, [(game_id, data) for game_id, data in latest.items()
+                                                    if game_id in existing])
+
+
+class CounterProjection(Projection):
+    """Wins and losses per key, summed over the current data of every game"""
+
+    key_columns = ()
+
+    def changes(self, game_data, sign, changes):
+        raise NotImplementedError
+
+    def apply(self, cursor, tenant_id, events):
+        changes = {}
+        for event in events:
+            if event['previous'] is not None:
+                self.changes(event['previous'], -1, changes)
+            if event['data'] is not None:
+                self.changes(event['data'], 1, changes)
+        add_to_counters(cursor, self.tables[0], self.key_columns, tenant_id, changes)
+
+
+class TeamCombinationsProjection(CounterProjection):
+    """team_combinations: every group of 2+ players who were on a team together"""
+
+    name = 'team_combinations'
+    tables = ('team_combinations',)
+    key_columns = ('player_names',)
+
+    def changes(self, game_data, sign, changes):
+        team_combination_changes(game_data, sign, changes)
+
+
+class PlayerStatsProjection(CounterProjection):
+    """player_stats: wins and losses of each player in each role"""
+
+    name = 'player_stats'
+    tables = ('player_stats',)
+    key_columns = ('name', 'role')
+
+    def changes(self, game_data, sign, changes):
+        player_stat_changes(game_data, sign, changes)
+
+
+# Applied in this order; participants first, as it adds the players
+PROJECTIONS = [ParticipantsProjection(), TeamCombinationsProjection(), PlayerStatsProjection()]
+
+
+def lock_tenant_events(cursor, tenant_id):
+    """
+    Hold off the tenant's other writes until this transaction ends, so its
+    events commit in ID order; take it before touching any table
+    """
+    if get_backend().name == 'postgres':
+        cursor.execute('SELECT pg_advisory_xact_lock(%s, hashtext(%s))', (EVENTS_LOCK_CLASS, tenant_id))
+    else:
+        # SQLite has a single writer anyway, take its lock up front
+        cursor.connection.begin_write()
+
+
+def last_event_id(cursor, tenant_id):
+    cursor.execute('SELECT MAX(id) FROM game_events WHERE tenant_id = %s', (tenant_id,))
+    return cursor.fetchone()[0] or 0
+
+
+def get_checkpoints(cursor, tenant_id):
+    """{projection name: last event applied}; projections without one have applied none"""
+    cursor.execute('SELECT projection, event_id FROM projection_checkpoints WHERE tenant_id = %s', (tenant_id,))
+    return dict(cursor.fetchall())
+
+
+def set_checkpoints(cursor, tenant_id, projections, event_id):
+    get_backend().insert_many(cursor, '''
+        INSERT INTO projection_checkpoints (tenant_id, projection, event_id) VALUES %s
+        ON CONFLICT (tenant_id, projection) DO UPDATE SET event_id = EXCLUDED.event_id
+    ''', [(tenant_id, projection.name, event_id) for projection in projections])
+
+
+def record_game_event(cursor, tenant_id, game_id, event_type, version, data, previous=None):
+    """
+    Append an event to the log and apply it to the projections that are
+    caught up; the caller holds lock_tenant_events and commits. Returns the
+    event's ID.
+    """
+    last_event = last_event_id(cursor, tenant_id)
+    checkpoints = get_checkpoints(cursor, tenant_id)
+    live = [projection for projection in PROJECTIONS if checkpoints.get(projection.name, 0) == last_event]
+    names = player_names(data) if data is not None else set()
+    if previous is not None:
+        names |= player_names(previous)
+    aliases = get_aliases(cursor, tenant_id, names)
+
+    cursor.execute('''
+        INSERT INTO game_events (tenant_id, game_id, type, version, data, previous_data, created_at)
+        VALUES (%s, %s, %s, %s, %s, %s, %s) RETURNING id
+    ''', (tenant_id, game_id, event_type, version, None if data is None else json.dumps(data),
+          None if previous is None else json.dumps(previous), datetime.now()))
+    event = {'id': cursor.fetchone()[0], 'game_id': game_id, 'data': canonical_game(data, aliases),
+             'previous': canonical_game(previous, aliases)}
+
+    for projection in live:
+        projection.apply(cursor, tenant_id, [event])
+    set_checkpoints(cursor, tenant_id, live, event['id'])
+    return event['id']
+
+
+def read_events(conn, tenant_id, after, aliases):
+    """
+    Batches of up to REPLAY_CHUNK_SIZE of the tenant's events after event ID
+    after, in ID order, with aliases replaced
+    """
+    cursor = conn.cursor()
+    while True:
+        cursor.execute('''
+            SELECT id, game_id, data, previous_data FROM game_events
+            WHERE tenant_id = %s AND id > %s
+            ORDER BY id
+            LIMIT %s
+        ''', (tenant_id, after, REPLAY_CHUNK_SIZE))
+        rows = cursor.fetchall()
+        if not rows:
+            return
+        yield [{'id': event_id, 'game_id': game_id,
+                'data': None if data is None else canonical_game(json.loads(data), aliases),
+                'previous': None if previous is None else canonical_game(json.loads(previous), aliases)}
+               for event_id, game_id, data, previous in rows]
+        after = rows[-1][0]
+
+
+def catch_up(conn, tenant_id, projections=None, rebuild=False):
+    """
+    Apply the events after each projection's checkpoint (all of them with
+    rebuild, after deleting the projection's rows) in bulk, without
+    committing. Projections at the same checkpoint share one pass over the
+    log. Every event is applied with today's aliases, which gives the same
+    rows as applying each one with the aliases of its time and correcting
+    them at every merge. Returns {projection name: events applied}.
+    """
+    projections = PROJECTIONS if projections is None else projections
+    cursor = conn.cursor()
+    if rebuild:
+        for projection in projections:
+            projection.reset(cursor, tenant_id)
+        checkpoints = {}
+    else:
+        checkpoints = get_checkpoints(cursor, tenant_id)
+    last_event = last_event_id(cursor, tenant_id)
+
+    behind = {}
+    for projection in projections:
+        checkpoint = checkpoints.get(projection.name, 0)
+        if checkpoint < last_event:
+            behind.setdefault(checkpoint, []).append(projection)
+
+    applied = {projection.name: 0 for projection in projections}
+    aliases = get_aliases(cursor, tenant_id) if behind else {}
+    for checkpoint, group in sorted(behind.items()):
+        for events in read_events(conn, tenant_id, checkpoint, aliases):
+            for projection in group:
+                projection.apply(cursor, tenant_id, events)
+                applied[projection.name] += len(events)
+    set_checkpoints(cursor, tenant_id, projections, last_event)
+    return applied
+
+
+def get_event_tenants(conn):
+    cursor = conn.cursor()
+    cursor.execute('SELECT DISTINCT tenant_id FROM game_events ORDER BY tenant_id')
+    return [row[0] for row in cursor.fetchall()]
+
+
+def replay(tenant_id, projections=None, rebuild=False):
+    """
+    catch_up() one tenant in its own transaction; the tenant's writes wait
+    for it, other tenants are not affected
+    """
+    conn = get_backend().connect()
+    try:
+        lock_tenant_events(conn.cursor(), tenant_id)
+        applied = catch_up(conn, tenant_id, projections, rebuild)
+        conn.commit()
+    finally:
+        conn.close()
+    return applied
+
+
+def start_game_log(conn):
+    """
+    Start the log of a database that has none: every existing game gets a
+    'created' event with its current data. participants and
+    team_combinations were kept up to date by the writes before the log, so
+    they start at the tenant's last event; newer projections are replayed.
+    Part of the schema migration, which commits.
+    """
+    cursor = conn.cursor()
+    cursor.execute('SELECT 1 FROM game_events LIMIT 1')
+    if cursor.fetchone() is None:
+        cursor.execute('''
+            INSERT INTO game_events (tenant_id, game_id, type, version, data, created_at)
+            SELECT tenant_id, id, 'created', version, raw_data, date FROM games ORDER BY id
+        ''')
+        for projection in ('participants', 'team_combinations'):
+            cursor.execute('''
+                INSERT INTO projection_checkpoints (tenant_id, projection, event_id)
+                SELECT tenant_id, %s, MAX(id) FROM game_events GROUP BY tenant_id
+            ''', (projection,))
+    for tenant_id in get_event_tenants(conn):
+        catch_up(conn, tenant_id)
+
+
+def status():
+    """{tenant: {'last_event': ID, projection name: checkpoint}} for every tenant with events"""
+    conn = get_backend().connect()
+    try:
+        cursor = conn.cursor()
+        report = {}
+        for tenant_id in get_event_tenants(conn):
+            checkpoints = get_checkpoints(cursor, tenant_id)
+            report[tenant_id] = {'last_event': last_event_id(cursor, tenant_id)}
+            report[tenant_id].update((projection.name, checkpoints.get(projection.name, 0))
+                                     for projection in PROJECTIONS)
+    finally:
+        conn.close()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Inspect or replay the projections of the game event log')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('status', help="Each tenant's last event and projection checkpoints")
+    replay_parser = subparsers.add_parser('replay', help='Bring projections up to the last event')
+    replay_parser.add_argument('--tenant', help='Only this tenant')
+    replay_parser.add_argument('--projection', action='append', choices=[p.name for p in PROJECTIONS],
+                               help='Only this projection (repeatable)')
+    replay_parser.add_argument('--rebuild', action='store_true',
+                               help='Delete the projections and replay the whole log')
+    args = parser.parse_args()
+
+    from dotenv import load_dotenv
+    load_dotenv()
+    from database import init_database
+    init_database()
+
+    if args.command == 'status':
+        print(json.dumps(status(), indent=2))
+        return
+
+    projections = [p for p in PROJECTIONS if args.projection is None or p.name in args.projection]
+    conn = get_backend().connect()
+    try:
+        tenants = [args.tenant] if args.tenant else get_event_tenants(conn)
+    finally:
+        conn.close()
+
+    report = {}
+    for tenant_id in tenants:
+        start = time.perf_counter()
+        applied = replay(tenant_id, projections, args.rebuild)
+        elapsed = time.perf_counter() - start
+        events = max(applied.values(), default=0)
+        print(f"{tenant_id}: {events} events in {elapsed:.1f}s "
+              f"({events / elapsed if elapsed else 0:.0f} events/s)", file=sys.stderr)
+        report[tenant_id] = {'applied': applied, 'seconds': round(elapsed, 3)}
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+"""
+Per-client rate limiting and admission control for the /api routes
+
+Every request takes tokens from the token bucket of its client and tenant;
+expensive routes cost more (ROUTE_COSTS). A client without enough tokens
+gets 429 with Retry-After. Routes in a concurrency group also need one of the
+group's slots while they run. When all slots are busy a request waits up to
+RATE_LIMIT_QUEUE_TIMEOUT_SECONDS for one, then it is shed with 503 and
+Retry-After. A looping bot therefore runs out of tokens, and a burst of
+exports cannot take every database connection away from the dashboard.
+"""
+import asyncio
+import math
+import os
+import re
+import time
+from collections import OrderedDict
+
+import orjson
+from starlette.datastructures import Headers
+
+# (method, path, query parameter that must be present, tokens, concurrency group).
+# The first matching rule applies; other /api routes cost DEFAULT_COST.
+ROUTE_COSTS = [
+    ('GET', re.compile(r'/api/games'), 'ids', 1, None),
+    ('GET', re.compile(r'/api/games'), 'limit', 1, None),  # one page
+    ('GET', re.compile(r'/api/games'), None, 20, 'heavy'),  # full history
+    ('POST', re.compile(r'/api/games'), None, 5, 'writes'),  # up to hundreds of combination upserts
+    ('PUT', re.compile(r'/api/games/\d+'), None, 5, 'writes'),
+    ('DELETE', re.compile(r'/api/games/\d+'), None, 5, 'writes'),
+    ('POST', re.compile(r'/api/players/aliases'), None, 5, 'writes'),  # re-counts every game of both players
+    ('DELETE', re.compile(r'/api/players/aliases/.+'), None, 5, 'writes'),
+    ('GET', re.compile(r'/api/stats/team-combinations-with-roles'), None, 2, None),
+    ('POST', re.compile(r'/api/query'), None, 2, None),
+]
+DEFAULT_COST = 1
+
+
+def route_cost(method, path, query_string):
+    """(tokens, concurrency group or None) for a request"""
+    params = None
+    for rule_method, pattern, required_param, tokens, group in ROUTE_COSTS:
+        if method != rule_method or not pattern.fullmatch(path):
+            continue
+        if required_param is not None:
+            if params is None:
+                params = {pair.partition(b'=')[0] for pair in query_string.split(b'&')}
+            if required_param.encode() not in params:
+                continue
+        return tokens, group
+    return DEFAULT_COST, None
+
+
+class InMemoryBucketStore:
+    """
+    Token buckets in this process' memory
+
+    Each server process limits on its own, so with several workers a client
+    gets the rate once per worker. A shared store (e.g. Redis) only needs the
+    same take() coroutine. The least recently used buckets beyond
+    max_buckets are dropped, which at worst refills them early.
+    """
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self._buckets = OrderedDict()  # key -> (tokens, monotonic time of last update)
+
+    async def take(self, key, cost, rate, burst):
+        """Take cost tokens from key's bucket; return 0, or the seconds until enough tokens are back"""
+        cost = min(cost, burst)
+        now = time.monotonic()
+        tokens, updated_at = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + (now - updated_at) * rate)
+        wait = 0.0
+        if tokens >= cost:
+            tokens -= cost
+        else:
+            wait = (cost - tokens) / rate
+        self._buckets[key] = (tokens, now)
+        while len(self._buckets) > self.max_buckets:
+            self._buckets.popitem(last=False)
+        return wait
+
+
+class ConcurrencyLimit:
+    """At most limit requests of a group at once, and at most max_queue waiting for a slot"""
+
+    def __init__(self, limit, max_queue, timeout):
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.in_flight = 0
+        self.waiting = 0
+        self.shed = 0
+        self._semaphore = asyncio.Semaphore(limit)
+
+    async def acquire(self):
+        """Take a slot; return False if none came free in time"""
+        if self._semaphore.locked() and self.waiting >= self.max_queue:
+            self.shed += 1
+            return False
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), self.timeout)
+        except asyncio.TimeoutError:
+            self.shed += 1
+            return False
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        return True
+
+    def release(self):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+
+class RateLimiter:
+    """Bucket parameters, concurrency groups and counters, read from the environment on first use"""
+
+    def __init__(self, store=None):
+        self.store = store or InMemoryBucketStore()
+        self._groups = None
+        self.limited = 0
+
+    # Read lazily so load_dotenv() in main.py has run first
+    @property
+    def enabled(self):
+        return os.getenv('RATE_LIMIT_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+    @property
+    def rate(self):
+        return float(os.getenv('RATE_LIMIT_RATE', 10))
+
+    @property
+    def burst(self):
+        return float(os.getenv('RATE_LIMIT_BURST', 60))
+
+    @property
+    def groups(self):
+        if self._groups is None:
+            timeout = float(os.getenv('RATE_LIMIT_QUEUE_TIMEOUT_SECONDS', 2))
+            max_queue = int(os.getenv('RATE_LIMIT_MAX_QUEUE', 16))
+            self._groups = {
+                'heavy': ConcurrencyLimit(int(os.getenv('RATE_LIMIT_HEAVY_CONCURRENCY', 2)), max_queue, timeout),
+                'writes': ConcurrencyLimit(int(os.getenv('RATE_LIMIT_WRITE_CONCURRENCY', 8)), max_queue, timeout),
+            }
+        return self._groups
+
+    def client_key(self, scope, headers):
+        """Client address, or the first address of RATE_LIMIT_CLIENT_HEADER behind a proxy, plus the tenant"""
+        client_header = os.getenv('RATE_LIMIT_CLIENT_HEADER')
+        client = headers.get(client_header, '').split(',')[0].strip() if client_header else ''
+        if not client:
+            client = scope['client'][0] if scope.get('client') else 'unknown'
+        return f"{client}|{headers.get('x-tenant-id', '')}"
+
+    def metrics(self):
+        return {
+            'enabled': self.enabled,
+            'rate_limited': self.limited,
+            'groups': {
+                name: {'limit': group.limit, 'in_flight': group.in_flight, 'waiting': group.waiting,
+                       'shed': group.shed}
+                for name, group in self.groups.items()
+            },
+        }
+
+
+async def send_error(send, status, detail, retry_after):
+    body = orjson.dumps({'detail': detail})
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode()),
+                    (b'retry-after', str(retry_after).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+
+class RateLimitMiddleware:
+    """Applies a RateLimiter to the /api routes; health checks, metrics and docs are never limited"""
+
+    def __init__(self, app, limiter):
+        self.app = app
+        self.limiter = limiter
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or not scope['path'].startswith('/api/') or not self.limiter.enabled:
+            await self.app(scope, receive, send)
+            return
+
+        limiter = self.limiter
+        tokens, group_name = route_cost(scope['method'], scope['path'], scope.get('query_string', b''))
+        wait = await limiter.store.take(limiter.client_key(scope, Headers(scope=scope)), tokens,
+                                        limiter.rate, limiter.burst)
+        if wait:
+            limiter.limited += 1
+            await send_error(send, 429, 'Rate limit exceeded, slow down', math.ceil(wait))
+            return
+
+        if group_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        group = limiter.groups[group_name]
+        if not await group.acquire():
+            await send_error(send, 503, 'Server busy, try again shortly', 1)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            group.release()
+
+
+rate_limiter = RateLimiter()
@@ -0,0 +1,92 @@
+import asyncio
+import os
+import time
+
+from opentelemetry import trace
+
+from database import refresh_team_role_snapshot
+
+tracer = trace.get_tracer(__name__)
+
+
+class SnapshotWorker:
+    """
+    Recomputes leaderboard snapshots in the background after writes.
+
+    Writes mark their tenant dirty; the refresh runs once no write has
+    arrived for SNAPSHOT_DEBOUNCE_SECONDS, or at the latest
+    SNAPSHOT_MAX_DELAY_SECONDS after the first pending write, so a burst of
+    games costs one recomputation.
+    """
+
+    def __init__(self, debounce=None, max_delay=None):
+        self._debounce = debounce
+        self._max_delay = max_delay
+        self._dirty = set()
+        self._first_dirty_at = None
+        self._timer = None
+        self._running = None
+
+    # Read lazily so load_dotenv() in main.py has run first
+    @property
+    def debounce(self):
+        return self._debounce if self._debounce is not None else float(os.getenv('SNAPSHOT_DEBOUNCE_SECONDS', 5))
+
+    @property
+    def max_delay(self):
+        return self._max_delay if self._max_delay is not None else float(os.getenv('SNAPSHOT_MAX_DELAY_SECONDS', 60))
+
+    def is_pending(self, tenant_id):
+        """True while a refresh of the tenant's snapshots is waiting or running"""
+        return tenant_id in self._dirty or (self._running is not None and tenant_id in self._running)
+
+    def schedule(self, tenant_id):
+        """Mark a tenant's snapshots stale; call from the event loop after a write"""
+        now = time.monotonic()
+        if not self._dirty:
+            self._first_dirty_at = now
+        self._dirty.add(tenant_id)
+
+        if self._timer:
+            self._timer.cancel()
+        delay = min(self.debounce, max(self._first_dirty_at + self.max_delay - now, 0))
+        self._timer = asyncio.get_running_loop().call_later(delay, self._flush)
+
+    def schedule_all(self, tenants):
+        """Refresh the given tenants without waiting for the debounce, e.g. all tenants at startup"""
+        for tenant_id in tenants:
+            self.schedule(tenant_id)
+        if self._timer:
+            self._timer.cancel()
+            self._flush()
+
+    def _flush(self):
+        self._timer = None
+        if self._running is not None:
+            # Retry once the refresh in progress finishes
+            self._timer = asyncio.get_running_loop().call_later(self.debounce, self._flush)
+            return
+        tenants, self._dirty = self._dirty, set()
+        self._running = tenants
+        asyncio.get_running_loop().create_task(self._refresh(tenants))
+
+    async def _refresh(self, tenants):
+        try:
+            for tenant_id in tenants:
+                try:
+                    with tracer.start_as_current_span('snapshots.refresh', attributes={'tenant.id': tenant_id}):
+                        start = time.perf_counter()
+                        rows = await asyncio.to_thread(refresh_team_role_snapshot, tenant_id)
+                    print(f"Refreshed team snapshots for tenant {tenant_id}: {rows} rows "
+                          f"in {time.perf_counter() - start:.2f}s")
+                except Exception as e:
+                    print(f"Warning: Could not refresh snapshots for tenant {tenant_id}: {e}")
+        finally:
+            self._running = None
+
+
+def is_enabled():
+    return os.getenv('SNAPSHOTS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+
+
+snapshot_worker = SnapshotWorker()
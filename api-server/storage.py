@@ -0,0 +1,373 @@
+"""
+Storage backends for database.py
+
+DATABASE_URL picks the backend: a postgresql:// URL uses Postgres through
+psycopg2, a sqlite:/// URL an embedded SQLite file (sqlite:///stats.db is
+relative to the working directory, sqlite:////var/lib/stats.db absolute).
+The SQLite backend hands out connections that behave like psycopg2's for the
+subset of SQL database.py uses, so the same queries run on both.
+"""
+import json
+import os
+import re
+import sqlite3
+import threading
+from datetime import datetime
+from functools import lru_cache
+
+import psycopg2
+from psycopg2.extras import execute_values
+
+
+class PostgresBackend:
+    """Postgres through psycopg2, one connection per call"""
+
+    name = 'postgres'
+
+    def __init__(self, url):
+        self.url = url
+
+    def connect(self):
+        return psycopg2.connect(self.url)
+
+    def insert_many(self, cursor, query, rows):
+        """Run an INSERT ... VALUES %s for all rows in a few statements"""
+        execute_values(cursor, query, rows)
+
+
+# Applied to every new SQLite connection. WAL lets readers run alongside the
+# single writer; synchronous=NORMAL only fsyncs at checkpoints, which keeps
+# the database consistent across crashes but may lose the last commits on
+# power loss.
+SQLITE_PRAGMAS = (
+    'PRAGMA journal_mode = WAL',
+    'PRAGMA synchronous = NORMAL',
+    'PRAGMA foreign_keys = ON',
+    'PRAGMA temp_store = MEMORY',
+    'PRAGMA cache_size = -65536',  # 64 MB
+    'PRAGMA mmap_size = 268435456',  # 256 MB
+)
+
+# How long a writer waits for the write lock before failing with "database is locked"
+SQLITE_BUSY_TIMEOUT_SECONDS = 30
+
+# Prepared statements kept per connection
+SQLITE_STATEMENT_CACHE = 512
+
+# Idle connections kept for reuse
+SQLITE_POOL_SIZE = 16
+
+# Same tables and indexes as migrate_postgres_schema in database.py. Arrays are
+# stored as JSON text, booleans as 0/1 and timestamps as ISO text.
+SQLITE_SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS games (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tenant_id TEXT NOT NULL DEFAULT 'default',
+        date TIMESTAMP NOT NULL,
+        winner TEXT NOT NULL,
+        raw_data TEXT NOT NULL,
+        version INTEGER NOT NULL DEFAULT 1
+    );
+    CREATE TABLE IF NOT EXISTS players (
+        id INTEGER PRIMARY KEY,
+        tenant_id TEXT NOT NULL DEFAULT 'default',
+        name TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS game_participants (
+        id INTEGER PRIMARY KEY,
+        tenant_id TEXT NOT NULL DEFAULT 'default',
+        game_id INTEGER NOT NULL REFERENCES games (id),
+        player_id INTEGER NOT NULL REFERENCES players (id),
+        team TEXT NOT NULL,
+        role TEXT NOT NULL,
+        won BOOLEAN NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS team_combinations (
+        id INTEGER PRIMARY KEY,
+        tenant_id TEXT NOT NULL DEFAULT 'default',
+        player_names TEXT NOT NULL,
+        wins INTEGER DEFAULT 0,
+        losses INTEGER DEFAULT 0
+    );
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_players_tenant_name ON players (tenant_id, name);
+    CREATE UNIQUE INDEX IF NOT EXISTS idx_team_combinations_tenant_names
+        ON team_combinations (tenant_id, player_names);
+    CREATE INDEX IF NOT EXISTS idx_games_tenant_date ON games (tenant_id, date DESC);
+    CREATE INDEX IF NOT EXISTS idx_game_participants_tenant_player ON game_participants (tenant_id, player_id);
+    CREATE INDEX IF NOT EXISTS idx_game_participants_player ON game_participants (player_id, role, team, game_id);
+    CREATE INDEX IF NOT EXISTS idx_game_participants_game ON game_participants (game_id);
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        tenant_id TEXT NOT NULL,
+        key TEXT NOT NULL,
+        request_hash TEXT NOT NULL,
+        game_id INTEGER,
+        created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (tenant_id, key)
+    );
+    CREATE INDEX IF NOT EXISTS idx_idempotency_keys_created ON idempotency_keys (created_at);
+    CREATE INDEX IF NOT EXISTS idx_idempotency_keys_game ON idempotency_keys (game_id);
+    CREATE TABLE IF NOT EXISTS team_role_snapshots (
+        id INTEGER PRIMARY KEY,
+        tenant_id TEXT NOT NULL,
+        spymasters TEXT_ARRAY NOT NULL,
+        operatives TEXT_ARRAY NOT NULL,
+        wins INTEGER NOT NULL,
+        losses INTEGER NOT NULL,
+        total_games INTEGER NOT NULL,
+        win_rate NUMERIC NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_team_role_snapshots_rank
+        ON team_role_snapshots (tenant_id, win_rate DESC, total_games DESC);
+    CREATE TABLE IF NOT EXISTS snapshot_refreshes (
+        tenant_id TEXT NOT NULL,
+        snapshot TEXT NOT NULL,
+        computed_at TIMESTAMP NOT NULL,
+        duration_ms INTEGER NOT NULL,
+        PRIMARY KEY (tenant_id, snapshot)
+    );
+    CREATE TABLE IF NOT EXISTS game_events (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        tenant_id TEXT NOT NULL,
+        game_id INTEGER NOT NULL,
+        type TEXT NOT NULL,
+        version INTEGER NOT NULL,
+        data TEXT,
+        previous_data TEXT,
+        created_at TIMESTAMP NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS idx_game_events_tenant ON game_events (tenant_id, id);
+    CREATE INDEX IF NOT EXISTS idx_game_events_game ON game_events (game_id, id);
+    CREATE TABLE IF NOT EXISTS projection_checkpoints (
+        tenant_id TEXT NOT NULL,
+        projection TEXT NOT NULL,
+        event_id INTEGER NOT NULL,
+        PRIMARY KEY (tenant_id, projection)
+    );
+    CREATE TABLE IF NOT EXISTS player_stats (
+        tenant_id TEXT NOT NULL,
+        name TEXT NOT NULL,
+        role TEXT NOT NULL,
+        wins INTEGER NOT NULL DEFAULT 0,
+        losses INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (tenant_id, name, role)
+    );
+    CREATE TABLE IF NOT EXISTS player_aliases (
+        tenant_id TEXT NOT NULL,
+        alias TEXT NOT NULL,
+        canonical TEXT NOT NULL,
+        automatic BOOLEAN NOT NULL,
+        created_at TIMESTAMP NOT NULL,
+        PRIMARY KEY (tenant_id, alias)
+    );
+    CREATE INDEX IF NOT EXISTS idx_player_aliases_canonical ON player_aliases (tenant_id, canonical);
+    CREATE TABLE IF NOT EXISTS alias_versions (
+        tenant_id TEXT PRIMARY KEY,
+        version INTEGER NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL);
+'''
+
+sqlite3.register_adapter(datetime, lambda value: value.isoformat(' '))
+sqlite3.register_adapter(list, json.dumps)
+sqlite3.register_converter('TIMESTAMP', lambda value: datetime.fromisoformat(value.decode()))
+sqlite3.register_converter('BOOLEAN', lambda value: value != b'0')
+sqlite3.register_converter('TEXT_ARRAY', json.loads)
+
+WRITE_STATEMENT = re.compile(r'^\s*(INSERT|UPDATE|DELETE|REPLACE)\b', re.IGNORECASE)
+ANY_PARAMETER = re.compile(r'=\s*ANY\(\?\)', re.IGNORECASE)
+
+
+@lru_cache(maxsize=1024)
+def translate(query):
+    """
+    Rewrite a psycopg2 query for SQLite; return (query, whether it writes)
+
+    %s placeholders become ?, "= ANY(%s)" with a list parameter becomes an
+    IN over the list's JSON, and FOR UPDATE is dropped: the statement
+    takes the database's write lock instead.
+    """
+    for_update = ' FOR UPDATE' in query
+    query = re.sub(r'%([s%])', lambda match: '?' if match.group(1) == 's' else '%', query)
+    query = ANY_PARAMETER.sub('IN (SELECT value FROM json_each(?))', query)
+    query = query.replace(' FOR UPDATE', '')
+    return query, for_update or bool(WRITE_STATEMENT.match(query))
+
+
+def _dict_row(cursor, row):
+    return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class SQLiteCursor:
+    """psycopg2-style cursor over a sqlite3 cursor"""
+
+    def __init__(self, connection, dict_rows):
+        self.connection = connection
+        self._cursor = connection.raw.cursor()
+        if dict_rows:
+            self._cursor.row_factory = _dict_row
+        # Accepted for server-side cursor compatibility, SQLite always steps through results
+        self.itersize = None
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def execute(self, query, params=()):
+        query, writes = translate(query)
+        if writes:
+            self.connection.begin_write()
+        self._cursor.execute(query, params)
+
+    def executemany(self, query, params_seq):
+        query, writes = translate(query)
+        if writes:
+            self.connection.begin_write()
+        self._cursor.executemany(query, params_seq)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self._cursor.fetchmany(size or self._cursor.arraysize)
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnection:
+    """
+    psycopg2-style connection over a pooled sqlite3 connection
+
+    Statements run in autocommit mode until the first write (or SELECT ...
+    FOR UPDATE), which starts a BEGIN IMMEDIATE transaction holding the
+    database's single write lock until commit or rollback. That gives the
+    same guarantees as the row locks database.py takes on Postgres.
+    close() rolls back anything uncommitted and returns the connection to
+    the pool; a connection dropped without close() rolls back when it is
+    garbage collected, as with psycopg2.
+    """
+
+    def __init__(self, backend, raw):
+        self._backend = backend
+        self.raw = raw
+
+    def cursor(self, name=None, cursor_factory=None):
+        return SQLiteCursor(self, dict_rows=cursor_factory is not None)
+
+    def begin_write(self):
+        if not self.raw.in_transaction:
+            self.raw.execute('BEGIN IMMEDIATE')
+
+    def commit(self):
+        self.raw.commit()
+
+    def rollback(self):
+        self.raw.rollback()
+
+    def close(self):
+        if self.raw is not None:
+            self._backend.release(self.raw)
+            self.raw = None
+
+
+class SQLiteBackend:
+    """
+    Embedded SQLite database file, for small deployments and tests
+
+    There are no replicas and a single writer at a time. Connections are
+    pooled across threads and keep up to SQLITE_STATEMENT_CACHE prepared
+    statements each, so repeated queries skip parsing and planning.
+    """
+
+    name = 'sqlite'
+
+    def __init__(self, path):
+        self.path = path
+        self._idle = []
+        self._lock = threading.Lock()
+        self._optimized = False
+
+    def _open(self):
+        raw = sqlite3.connect(self.path, timeout=SQLITE_BUSY_TIMEOUT_SECONDS, isolation_level=None,
+                              detect_types=sqlite3.PARSE_DECLTYPES, check_same_thread=False,
+                              cached_statements=SQLITE_STATEMENT_CACHE)
+        for pragma in SQLITE_PRAGMAS:
+            raw.execute(pragma)
+        return raw
+
+    def optimize(self):
+        """
+        Keep the planner's statistics current; init_database calls this once per process
+
+        Without statistics the planner walks a tenant's whole date index for
+        "id IN (...)" lookups instead of fetching the rows by ID. A file whose
+        games were never analyzed gets a full ANALYZE, as sampling
+        underestimates tenant sizes enough to pick the same plan. After that,
+        PRAGMA optimize only re-analyzes tables that changed a lot.
+        """
+        with self._lock:
+            if self._optimized:
+                return
+            self._optimized = True
+        conn = self.connect()
+        try:
+            has_stats = conn.raw.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+            if has_stats and conn.raw.execute("SELECT 1 FROM sqlite_stat1 WHERE tbl = 'games'").fetchone():
+                conn.raw.execute('PRAGMA optimize=0x10002')
+            else:
+                conn.raw.execute('ANALYZE')
+        finally:
+            conn.close()
+
+    def connect(self):
+        with self._lock:
+            raw = self._idle.pop() if self._idle else None
+        return SQLiteConnection(self, raw or self._open())
+
+    def release(self, raw):
+        if raw.in_transaction:
+            raw.rollback()
+        with self._lock:
+            if len(self._idle) < SQLITE_POOL_SIZE:
+                self._idle.append(raw)
+                return
+        raw.close()
+
+    def create_schema(self):
+        conn = self.connect()
+        try:
+            conn.raw.executescript(SQLITE_SCHEMA)
+        finally:
+            conn.close()
+
+    def insert_many(self, cursor, query, rows):
+        """Run an INSERT ... VALUES %s for all rows as one prepared statement"""
+        if rows:
+            placeholders = '(' + ', '.join(['%s'] * len(rows[0])) + ')'
+            cursor.executemany(query.replace('VALUES %s', f'VALUES {placeholders}'), rows)
+
+
+_backends = {}
+
+
+def get_backend():
+    """The backend for DATABASE_URL, created on first use"""
+    database_url = os.getenv('DATABASE_URL')
+    if not database_url:
+        raise ValueError("DATABASE_URL not set in environment")
+    if database_url not in _backends:
+        if database_url.startswith('sqlite:///'):
+            _backends[database_url] = SQLiteBackend(database_url[len('sqlite:///'):])
+        else:
+            _backends[database_url] = PostgresBackend(database_url)
+    return _backends[database_url]
@@ -0,0 +1,52 @@
+"""
+Read-your-writes routing. Run with: python -m pytest tests
+"""
+import contextvars
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from db_router import DatabaseRouter, router
+from process_pool import _begin_request
+
+REPLICA = 'postgresql://replica.invalid/codenames'
+
+
+def replica_router(monkeypatch):
+    monkeypatch.setenv('DATABASE_REPLICA_URLS', REPLICA)
+    replicas = DatabaseRouter()
+    replicas._health[REPLICA] = (True, time.monotonic())
+    return replicas
+
+
+def test_reads_within_the_window_do_not_extend_it(monkeypatch):
+    monkeypatch.setenv('READ_YOUR_WRITES_SECONDS', '0.3')
+    router.mark_write('window-test')
+    deadline = time.monotonic() + 0.6
+    while time.monotonic() < deadline:
+        # What every stats read handed to the pool does, inline mode included
+        contextvars.copy_context().run(_begin_request, router.wrote_recently('window-test'), None)
+        time.sleep(0.05)
+    assert not router.wrote_recently('window-test')
+
+
+def test_force_primary_is_scoped_to_the_request(monkeypatch):
+    replicas = replica_router(monkeypatch)
+
+    def read_url(force_primary):
+        replicas.begin_request(force_primary=force_primary)
+        return replicas.read_url('scope-test')
+
+    assert contextvars.copy_context().run(read_url, True) is None
+    assert contextvars.copy_context().run(read_url, False) == REPLICA
+    assert not replicas.wrote_recently('scope-test')
+
+
+def test_writes_send_the_tenant_to_the_primary(monkeypatch):
+    replicas = replica_router(monkeypatch)
+    assert replicas.read_url('write-test') == REPLICA
+    replicas.mark_write('write-test')
+    assert replicas.read_url('write-test') is None
+    assert replicas.read_url('other-tenant') == REPLICA
@@ -1,34 +1,81 @@
+import asyncio
 import base64
+import email.utils
 import json
+import math
 import os
+import tempfile
+from datetime import datetime, timezone
 
 import anthropic
 import discord
 import httpx
 from dotenv import load_dotenv
-
-from prompts import CODENAMES_EXTRACTION_PROMPT
+from opentelemetry import propagate, trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import BatchSpanProcessor, ConsoleSpanExporter
+
+from image_cache import ExtractionCache
+from player_index import TenantPlayerNameIndexes
+from extraction_batcher import ExtractionBatcher
+from prompts import BATCH_EXTRACTION_INSTRUCTIONS, CODENAMES_EXTRACTION_PROMPT
 from stats_formatter import format_stats_embed
-from views import EditGameButton
+from tenants import check_legacy_tenant, remember_write, tenant_headers, tenant_id_for
+from views import EditGameButton, game_version
 
 load_dotenv()
 
+
+def setup_tracing():
+    """Record spans with the OpenTelemetry SDK, sent to an OTLP collector or printed (TRACE_EXPORTER=otlp|console)"""
+    exporter = os.getenv('TRACE_EXPORTER', '').lower()
+    if not exporter:
+        return
+    if exporter == 'otlp':
+        # Sends to OTEL_EXPORTER_OTLP_ENDPOINT (default http://localhost:4318)
+        from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        span_exporter = OTLPSpanExporter()
+    else:
+        span_exporter = ConsoleSpanExporter()
+    provider = TracerProvider(resource=Resource.create({'service.name': os.getenv('OTEL_SERVICE_NAME', 'codenames-bot')}))
+    provider.add_span_processor(BatchSpanProcessor(span_exporter))
+    trace.set_tracer_provider(provider)
+
+
+setup_tracing()
+tracer = trace.get_tracer(__name__)
+
 intents = discord.Intents.default()
 intents.message_content = True
 
 client = discord.Client(intents=intents)
 
-TARGET_CHANNEL_ID = int(os.getenv('CHANNEL_ID'))
+# One or more channels (comma separated); each Discord server is its own tenant
+TARGET_CHANNEL_IDS = {int(channel_id) for channel_id in os.getenv('CHANNEL_ID').split(',')}
 DISCORD_KEY = os.getenv('DISCORD_KEY')
 CLAUDE_KEY = os.getenv('CLAUDE_KEY')
 API_SERVER_URL = os.getenv('API_SERVER_URL', 'http://localhost:8000')
+# Saving is idempotent, so a slow or failed POST can be retried safely
+API_TIMEOUT_SECONDS = float(os.getenv('API_TIMEOUT_SECONDS', 10))
+API_POST_RETRIES = int(os.getenv('API_POST_RETRIES', 3))
+# Longest wait before a retry, whatever Retry-After asks for
+MAX_RETRY_DELAY_SECONDS = 30
 
 anthropic_client = anthropic.Anthropic(api_key=CLAUDE_KEY)
 
 stats_message_id = None
 
+# Screenshots already recorded per tenant, so reposts are not extracted or saved twice
+extraction_caches = {}
+
+# Known player names per tenant, used to correct extraction errors locally
+player_indexes = TenantPlayerNameIndexes()
+player_index_task = None
+
 @client.event
 async def on_ready():
+    global player_index_task
     # Check API server health
     async with httpx.AsyncClient() as http_client:
         try:
@@ -40,49 +87,136 @@ async def on_ready():
         except Exception as e:
             print(f'Warning: Could not connect to API server: {e}')
 
+    try:
+        await check_legacy_tenant([guild.id for guild in client.guilds])
+    except Exception as e:
+        print(f'Warning: Could not check for games recorded before tenants: {e}')
+
+    # on_ready fires again after reconnects; only start the refresh loop once
+    if player_index_task is None:
+        player_index_task = asyncio.create_task(player_indexes.refresh_periodically())
+
     print(f'We have logged in as {client.user}')
 
+def encode_image(image_path):
+    """Read a screenshot and build the Claude image content block"""
+    with tracer.start_as_current_span('encode_image') as span:
+        with open(image_path, 'rb') as f:
+            raw_bytes = f.read()
+        span.set_attribute('image.bytes', len(raw_bytes))
+        return {
+            "type": "image",
+            "source": {
+                "type": "base64",
+                "media_type": "image/png",
+                "data": base64.b64encode(raw_bytes).decode('utf-8')
+            }
+        }
+
+
+def call_claude(content, max_tokens=1024):
+    """Send one user message to Claude and return the response text"""
+    # The instructions (~520 tokens) are below the model's 1024-token minimum for
+    # prompt caching, so the cache marker only takes effect if they grow past it;
+    # the logged cache token counts show whether it does
+    with tracer.start_as_current_span('claude_call') as span:
+        message = anthropic_client.messages.create(
+            model="claude-sonnet-4-20250514",
+            max_tokens=max_tokens,
+            system=[{
+                "type": "text",
+                "text": CODENAMES_EXTRACTION_PROMPT,
+                "cache_control": {"type": "ephemeral"}
+            }],
+            messages=[{
+                "role": "user",
+                "content": content
+            }]
+        )
+        usage = message.usage
+        cache_read = usage.cache_read_input_tokens or 0
+        cache_creation = usage.cache_creation_input_tokens or 0
+        span.set_attribute('llm.input_tokens', usage.input_tokens)
+        span.set_attribute('llm.output_tokens', usage.output_tokens)
+        span.set_attribute('llm.cache_read_input_tokens', cache_read)
+        span.set_attribute('llm.cache_creation_input_tokens', cache_creation)
+    print(f"Claude usage: {usage.input_tokens} input tokens ({cache_read} read from cache, "
+          f"{cache_creation} written to cache), {usage.output_tokens} output tokens")
+
+    response_text = message.content[0].text.strip()
+    print(f"Claude response: {response_text}")
+    return response_text
+
+
+def parse_json_response(response_text):
+    """Parse JSON from a Claude response, ignoring markdown code fences"""
+    with tracer.start_as_current_span('parse_json'):
+        if "```json" in response_text:
+            response_text = response_text.split("```json")[1].split("```")[0].strip()
+        elif "```" in response_text:
+            response_text = response_text.split("```")[1].split("```")[0].strip()
+
+        return json.loads(response_text)
+
+
+def is_game_data(data):
+    """Check that an extracted object has the expected game structure"""
+    return isinstance(data, dict) and all(
+        isinstance(data.get(team_key), dict)
+        and isinstance(data[team_key].get('operatives'), list)
+        and isinstance(data[team_key].get('spymasters'), list)
+        for team_key in ('blue_team', 'red_team')
+    )
+
+
 def extract_game_data_with_claude(image_path):
     """Use Claude Vision to extract game data from screenshot"""
+    response_text = call_claude([
+        encode_image(image_path),
+        {
+            "type": "text",
+            "text": "Extract the game data from this screenshot."
+        }
+    ])
+    return parse_json_response(response_text)
+
+
+def extract_games_with_claude(image_paths):
+    """
+    Extract several screenshots with a single Claude call.
+
+    Returns one result per image, in order: the game data, or the exception
+    raised while extracting that image. Images missing or malformed in the
+    batched answer are retried individually.
+    """
+    results = [None] * len(image_paths)
+
+    if len(image_paths) > 1:
+        content = []
+        for i, image_path in enumerate(image_paths, 1):
+            content.append({"type": "text", "text": f"Image {i}:"})
+            content.append(encode_image(image_path))
+        content.append({"type": "text", "text": BATCH_EXTRACTION_INSTRUCTIONS % len(image_paths)})
 
-    # Read and encode image
-    with open(image_path, 'rb') as f:
-        image_data = base64.b64encode(f.read()).decode('utf-8')
-
-    # Call Claude
-    message = anthropic_client.messages.create(
-        model="claude-sonnet-4-20250514",
-        max_tokens=1024,
-        messages=[{
-            "role": "user",
-            "content": [
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64",
-                        "media_type": "image/png",
-                        "data": image_data
-                    }
-                },
-                {
-                    "type": "text",
-                    "text": CODENAMES_EXTRACTION_PROMPT
-                }
-            ]
-        }]
-    )
+        try:
+            batch = parse_json_response(call_claude(content, max_tokens=1024 * len(image_paths)))
+            if isinstance(batch, list):
+                for i, game_data in enumerate(batch[:len(image_paths)]):
+                    if is_game_data(game_data):
+                        results[i] = game_data
+        except Exception as e:
+            print(f"Batched extraction failed, retrying images individually: {e}")
 
-    # Parse response
-    response_text = message.content[0].text.strip()
-    print(f"Claude response: {response_text}")
+    for i, image_path in enumerate(image_paths):
+        if results[i] is None:
+            try:
+                results[i] = extract_game_data_with_claude(image_path)
+            except Exception as e:
+                results[i] = e
+
+    return results
 
-    # Extract JSON (in case Claude adds markdown formatting)
-    if "```json" in response_text:
-        response_text = response_text.split("```json")[1].split("```")[0].strip()
-    elif "```" in response_text:
-        response_text = response_text.split("```")[1].split("```")[0].strip()
 
-    return json.loads(response_text)
 #     return {
 #   "blue_team": {
 #     "operatives": [
@@ -98,6 +232,10 @@ def extract_game_data_with_claude(image_path):
 # }
 
 
+# Screenshots arriving close together are extracted with one Claude call
+extraction_batcher = ExtractionBatcher(extract_games_with_claude)
+
+
 def determine_winner(game_data):
     """Determine the winner from game data structure"""
     if 'won_because_of_assassin' in game_data and game_data['won_because_of_assassin']:
@@ -155,6 +293,191 @@ def parse_embed_to_game_data(embed):
 
     return game_data
 
+def build_result_embed(game_id, game_data, winner):
+    """Build the embed that confirms a recorded game"""
+    result_embed = discord.Embed(
+        title=f"🎮 Game #{game_id} Recorded",
+        color=discord.Color.blue() if winner == 'Blue' else discord.Color.red()
+    )
+
+    result_embed.add_field(
+        name="🏆 Winner",
+        value=f"**{winner} Team**",
+        inline=False
+    )
+
+    blue_ops = ", ".join(game_data['blue_team']['operatives']) or "None"
+    blue_spy = ", ".join(game_data['blue_team']['spymasters']) or "None"
+    result_embed.add_field(
+        name="🔵 Blue Team",
+        value=f"Operatives: {blue_ops}\nSpymasters: {blue_spy}",
+        inline=True
+    )
+
+    red_ops = ", ".join(game_data['red_team']['operatives']) or "None"
+    red_spy = ", ".join(game_data['red_team']['spymasters']) or "None"
+    result_embed.add_field(
+        name="🔴 Red Team",
+        value=f"Operatives: {red_ops}\nSpymasters: {red_spy}",
+        inline=True
+    )
+
+    return result_embed
+
+
+def retry_delay(response, attempt):
+    """
+    Seconds to wait before retrying a 429 or 5xx: the Retry-After header,
+    in seconds or as an HTTP date, else exponential backoff
+    """
+    backoff = 0.5 * 2 ** attempt
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return backoff
+    try:
+        delay = float(retry_after)
+    except ValueError:
+        try:
+            retry_at = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return backoff
+        if retry_at.tzinfo is None:
+            retry_at = retry_at.replace(tzinfo=timezone.utc)
+        delay = (retry_at - datetime.now(timezone.utc)).total_seconds()
+    if not math.isfinite(delay):
+        return backoff
+    return min(max(delay, 0), MAX_RETRY_DELAY_SECONDS)
+
+
+async def post_game(game_data, tenant_id, idempotency_key):
+    """
+    POST a game to the API, retrying timeouts, connection errors, 429 and 5xx
+
+    Every attempt sends the same Idempotency-Key, so a retry of a request
+    that did reach the server returns the game saved the first time.
+    """
+    headers = tenant_headers(tenant_id, {'Idempotency-Key': idempotency_key})
+    propagate.inject(headers)  # traceparent, so the API's spans join this trace
+    async with httpx.AsyncClient() as http_client:
+        for attempt in range(API_POST_RETRIES + 1):
+            try:
+                response = await http_client.post(
+                    f"{API_SERVER_URL}/api/games",
+                    json=game_data,
+                    headers=headers,
+                    timeout=API_TIMEOUT_SECONDS
+                )
+                retryable = response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt == API_POST_RETRIES:
+                    response.raise_for_status()
+                    remember_write(tenant_id, response)
+                    return response
+                delay = retry_delay(response, attempt)
+                print(f"API returned {response.status_code}, retrying in {delay:.1f}s")
+            except httpx.TransportError as e:
+                if attempt == API_POST_RETRIES:
+                    raise
+                delay = 0.5 * 2 ** attempt
+                print(f"API request failed ({e!r}), retrying in {delay}s")
+            await asyncio.sleep(delay)
+
+
+async def update_stats_message(channel):
+    """Refresh the stats message, if one was posted, after a game was edited"""
+    if stats_message_id is None:
+        return
+    tenant_id = tenant_id_for(channel.guild.id if channel.guild else None, channel.id)
+    stats_message = await channel.fetch_message(stats_message_id)
+    await stats_message.edit(embed=await asyncio.to_thread(format_stats_embed, tenant_id))
+
+
+async def process_attachment(message, attachment):
+    """Extract, record and confirm the game shown in one screenshot"""
+    # React to show we're processing
+    await message.add_reaction('⏳')
+
+    tenant_id = tenant_id_for(message.guild.id if message.guild else None, message.channel.id)
+    extraction_cache = extraction_caches.setdefault(tenant_id, ExtractionCache())
+
+    with tracer.start_as_current_span('ingest_game', attributes={'discord.message_id': message.id,
+                                                                'discord.attachment': attachment.filename,
+                                                                'tenant.id': tenant_id}):
+        # A file of our own, so concurrent uploads of "image.png" don't overwrite each other
+        with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(attachment.filename)[1]) as f:
+            image_path = f.name
+        try:
+            with tracer.start_as_current_span('download_attachment'):
+                await attachment.save(image_path)
+
+            with tracer.start_as_current_span('cache_lookup') as span:
+                with open(image_path, 'rb') as f:
+                    image_bytes = f.read()
+                cached, match_type = extraction_cache.lookup(image_bytes)
+                span.set_attribute('cache.hit', cached is not None)
+
+            if cached:
+                # Likely a repost: show the earlier result instead of recording it again
+                print(f"Duplicate ({match_type} match) of game #{cached['game_id']}")
+                winner = determine_winner(cached['game_data'])
+                duplicate_embed = build_result_embed(cached['game_id'], cached['game_data'], winner)
+                duplicate_embed.title = f"🔁 Likely duplicate of Game #{cached['game_id']}"
+                duplicate_embed.description = "This screenshot was already recorded, so it was not saved again."
+                await message.reply(embed=duplicate_embed)
+                await message.remove_reaction('⏳', client.user)
+                await message.add_reaction('🔁')
+                return
+
+            with tracer.start_as_current_span('extraction'):
+                game_data = await extraction_batcher.extract(image_path)
+
+            # Map OCR variants onto the tenant's known players
+            player_index = await player_indexes.get(tenant_id)
+            with tracer.start_as_current_span('name_correction'):
+                game_data = player_index.correct_game_data(game_data)
+            print("Extracted game data:", json.dumps(game_data, indent=2))
+
+            # Save to database via API
+            with tracer.start_as_current_span('api_post') as span:
+                response = await post_game(game_data, tenant_id, f"{message.id}-{attachment.id}")
+                result = response.json()
+                game_id = result['game_id']
+                version = game_version(response)
+                span.set_attribute('game.id', game_id)
+                if response.headers.get('Idempotent-Replayed') == 'true':
+                    print(f"Game #{game_id} was already saved by an earlier attempt")
+                else:
+                    print(f"Saved game #{game_id}")
+
+            extraction_cache.store(image_bytes, game_data, game_id)
+            player_index.add(name for team_key in ('blue_team', 'red_team')
+                             for role_key in ('operatives', 'spymasters')
+                             for name in game_data[team_key][role_key])
+
+            # Determine winner
+            winner = determine_winner(game_data)
+
+            # Send the result to the user
+            with tracer.start_as_current_span('reply_embed'):
+                print(f"Sending reply with embed for game #{game_id}")
+                # Edits send the version shown here as If-Match, so they don't overwrite newer changes
+                view = EditGameButton(game_id, game_data, update_stats_message, version) if version else None
+                reply_msg = await message.reply(embed=build_result_embed(game_id, game_data, winner), view=view)
+                print(f"Reply sent successfully: {reply_msg.id}")
+
+            await message.remove_reaction('⏳', client.user)
+            await message.add_reaction('✅')
+
+        except Exception as e:
+            print(f"Error: {e}")
+            import traceback
+            traceback.print_exc()
+            await message.remove_reaction('⏳', client.user)
+            await message.add_reaction('❌')
+            await message.reply(f"❌ Error processing game: {str(e)}")
+        finally:
+            os.remove(image_path)
+
+
 @client.event
 async def on_message(message):
     # Ignore bot's own messages
@@ -162,86 +485,19 @@ async def on_message(message):
         return
 
     # Only listen to specific channel
-    if message.channel.id != TARGET_CHANNEL_ID:
+    if message.channel.id not in TARGET_CHANNEL_IDS:
         return
 
     # Check if message has attachments (images)
     if message.attachments:
+        images = []
         for attachment in message.attachments:
             # Check if it's an image
             if attachment.content_type and attachment.content_type.startswith('image/'):
                 print(f'Image detected: {attachment.filename}')
+                images.append(attachment)
 
-                # React to show we're processing
-                await message.add_reaction('⏳')
-
-                try:
-                    image_path = f'temp_{attachment.filename}'
-                    await attachment.save(image_path)
-
-                    game_data = extract_game_data_with_claude(image_path)
-                    print("Extracted game data:", json.dumps(game_data, indent=2))
-
-                    # Save to database via API
-                    async with httpx.AsyncClient() as http_client:
-                        response = await http_client.post(
-                            f"{API_SERVER_URL}/api/games",
-                            json=game_data,
-                            timeout=10.0
-                        )
-                        response.raise_for_status()
-                        result = response.json()
-                        game_id = result['game_id']
-                        print(f"Saved game #{game_id}")
-
-                    # Determine winner
-                    winner = determine_winner(game_data)
-
-                    # Send immediate response with game result
-                    result_embed = discord.Embed(
-                        title=f"🎮 Game #{game_id} Recorded",
-                        color=discord.Color.blue() if winner == 'Blue' else discord.Color.red()
-                    )
-
-                    result_embed.add_field(
-                        name="🏆 Winner",
-                        value=f"**{winner} Team**",
-                        inline=False
-                    )
-
-                    blue_ops = ", ".join(game_data['blue_team']['operatives']) or "None"
-                    blue_spy = ", ".join(game_data['blue_team']['spymasters']) or "None"
-                    result_embed.add_field(
-                        name="🔵 Blue Team",
-                        value=f"Operatives: {blue_ops}\nSpymasters: {blue_spy}",
-                        inline=True
-                    )
-
-                    red_ops = ", ".join(game_data['red_team']['operatives']) or "None"
-                    red_spy = ", ".join(game_data['red_team']['spymasters']) or "None"
-                    result_embed.add_field(
-                        name="🔴 Red Team",
-                        value=f"Operatives: {red_ops}\nSpymasters: {red_spy}",
-                        inline=True
-                    )
-
-                    # Send the result to the user
-                    print(f"Sending reply with embed for game #{game_id}")
-                    reply_msg = await message.reply(embed=result_embed)
-                    print(f"Reply sent successfully: {reply_msg.id}")
-
-                    # Clean up
-                    os.remove(image_path)
-
-                    await message.remove_reaction('⏳', client.user)
-                    await message.add_reaction('✅')
-
-                except Exception as e:
-                    print(f"Error: {e}")
-                    import traceback
-                    traceback.print_exc()
-                    await message.remove_reaction('⏳', client.user)
-                    await message.add_reaction('❌')
-                    await message.reply(f"❌ Error processing game: {str(e)}")
+        # Process concurrently so the screenshots share extraction batches
+        await asyncio.gather(*(process_attachment(message, attachment) for attachment in images))
 
 client.run(DISCORD_KEY)
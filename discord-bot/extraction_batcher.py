@@ -0,0 +1,59 @@
+import asyncio
+import os
+
+
+class ExtractionBatcher:
+    """
+    Collects screenshots that arrive within a short window and extracts them together.
+
+    extract_batch is a blocking function taking a list of image paths and
+    returning one result per path (game data, or an exception for that image).
+    It runs in a worker thread so the event loop keeps accepting screenshots.
+
+    A screenshot that does not fill a batch waits up to window seconds for
+    others, which adds that much to its reply; a full batch goes at once.
+    """
+
+    def __init__(self, extract_batch, batch_size=None, window=None):
+        self.extract_batch = extract_batch
+        self.batch_size = batch_size or int(os.getenv('EXTRACTION_BATCH_SIZE', 4))
+        self.window = window if window is not None else float(os.getenv('EXTRACTION_BATCH_WINDOW', 0.25))
+        self._pending = []
+        self._timer = None
+
+    async def extract(self, image_path):
+        """Queue an image for the next batch and wait for its game data"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image_path, future))
+
+        if len(self._pending) >= self.batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        print(f"Extracting batch of {len(batch)} screenshot(s)")
+        try:
+            results = await asyncio.to_thread(self.extract_batch, [path for path, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
@@ -0,0 +1,88 @@
+import hashlib
+import io
+import os
+import time
+from collections import OrderedDict
+
+from PIL import Image
+
+# Screenshots share the same game UI, so the perceptual hash needs enough
+# resolution to tell two different boards apart.
+HASH_SIZE = 16
+
+
+def exact_hash(image_bytes):
+    """SHA-256 of the raw image bytes"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+def perceptual_hash(image_bytes, hash_size=HASH_SIZE):
+    """Difference hash (dHash) of the image as an int of hash_size * hash_size bits"""
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        pixels = list(image.convert('L').resize((hash_size + 1, hash_size), Image.LANCZOS).getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+class ExtractionCache:
+    """LRU cache of extracted game data keyed by exact and perceptual image hashes"""
+
+    def __init__(self, max_size=None, max_distance=None):
+        self.max_size = max_size or int(os.getenv('EXTRACTION_CACHE_SIZE', 256))
+        self.max_distance = max_distance if max_distance is not None else \
+            int(os.getenv('EXTRACTION_CACHE_MAX_DISTANCE', 10))
+        self._entries = OrderedDict()  # exact hash -> entry
+
+    def __len__(self):
+        return len(self._entries)
+
+    def lookup(self, image_bytes):
+        """Return (entry, match_type) for a cached image, or (None, None) on a miss"""
+        digest = exact_hash(image_bytes)
+        entry = self._entries.get(digest)
+        if entry:
+            self._entries.move_to_end(digest)
+            return entry, 'exact'
+
+        try:
+            phash = perceptual_hash(image_bytes)
+        except Exception as e:
+            print(f"Could not compute perceptual hash: {e}")
+            return None, None
+
+        best_key, best_distance = None, self.max_distance + 1
+        for key, candidate in self._entries.items():
+            if candidate['phash'] is None:
+                continue
+            distance = (candidate['phash'] ^ phash).bit_count()
+            if distance < best_distance:
+                best_key, best_distance = key, distance
+
+        if best_key is None:
+            return None, None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key], 'perceptual'
+
+    def store(self, image_bytes, game_data, game_id):
+        """Remember the extraction and recorded game ID for an image"""
+        digest = exact_hash(image_bytes)
+        try:
+            phash = perceptual_hash(image_bytes)
+        except Exception:
+            # Only exact matches are possible for images Pillow cannot decode
+            phash = None
+
+        self._entries[digest] = {
+            'game_data': game_data,
+            'game_id': game_id,
+            'phash': phash,
+            'recorded_at': time.time(),
+        }
+        self._entries.move_to_end(digest)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
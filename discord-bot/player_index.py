@@ -0,0 +1,124 @@
+import asyncio
+import difflib
+import os
+import unicodedata
+
+import httpx
+
+from tenants import tenant_headers
+
+API_SERVER_URL = os.getenv('API_SERVER_URL', 'http://localhost:8000')
+
+
+def normalize_name(name):
+    """Case- and accent-insensitive form of a player name"""
+    decomposed = unicodedata.normalize('NFKD', name.strip())
+    return ''.join(c for c in decomposed if not unicodedata.combining(c)).casefold()
+
+
+class PlayerNameIndex:
+    """In-memory index of known player names for correcting extraction errors"""
+
+    def __init__(self, tenant_id, cutoff=None):
+        self.tenant_id = tenant_id
+        self.cutoff = cutoff if cutoff is not None else float(os.getenv('PLAYER_MATCH_CUTOFF', 0.8))
+        self.loaded = False
+        self._by_normalized = {}  # normalized name -> canonical name
+
+    def __len__(self):
+        return len(self._by_normalized)
+
+    def add(self, names):
+        for name in names:
+            self._by_normalized.setdefault(normalize_name(name), name)
+
+    def replace(self, names):
+        self._by_normalized = {}
+        self.add(names)
+
+    def closest(self, name):
+        """(known player name closest to name, similarity from 0 to 1), or (None, 0.0) if none is close"""
+        normalized = normalize_name(name)
+        if normalized in self._by_normalized:
+            return self._by_normalized[normalized], 1.0
+
+        close = difflib.get_close_matches(normalized, self._by_normalized.keys(), n=1, cutoff=self.cutoff)
+        if not close:
+            return None, 0.0
+        return self._by_normalized[close[0]], difflib.SequenceMatcher(None, normalized, close[0]).ratio()
+
+    def correct_game_data(self, game_data):
+        """
+        Replace extracted names in game_data with matching known player names
+
+        Two players of the same game are two people, however alike their names:
+        each known name is claimed at most once per game, by the closest
+        extracted name, and the others keep their name as extracted.
+        """
+        slots = [(team_key, role_key, position, name)
+                 for team_key in ('blue_team', 'red_team')
+                 for role_key in ('operatives', 'spymasters')
+                 for position, name in enumerate(game_data.get(team_key, {}).get(role_key, []))]
+        matches = []
+        for slot, (_, _, _, name) in enumerate(slots):
+            known, score = self.closest(name)
+            if known is not None:
+                matches.append((-score, known != name, slot, known))
+
+        # Closest first, and a name extracted exactly as known before its variants
+        claimed, corrected = set(), {}
+        for _, _, slot, known in sorted(matches):
+            name = slots[slot][3]
+            if known in claimed:
+                print(f"Not correcting player name '{name}' -> '{known}', another player of the game has it")
+                continue
+            claimed.add(known)
+            if known != name:
+                corrected[slot] = known
+                print(f"Corrected player name '{name}' -> '{known}'")
+
+        for slot, known in corrected.items():
+            team_key, role_key, position, _ = slots[slot]
+            game_data[team_key][role_key][position] = known
+        return game_data
+
+    async def refresh(self):
+        """Reload the tenant's known player names from the API server"""
+        async with httpx.AsyncClient() as http_client:
+            response = await http_client.get(
+                f"{API_SERVER_URL}/api/stats/players",
+                headers=tenant_headers(self.tenant_id),
+                timeout=10.0
+            )
+            response.raise_for_status()
+            self.replace(stat['name'] for stat in response.json())
+            self.loaded = True
+
+
+class TenantPlayerNameIndexes:
+    """One PlayerNameIndex per tenant, refreshed together in the background"""
+
+    def __init__(self):
+        self._indexes = {}
+
+    async def get(self, tenant_id):
+        """The tenant's index, loaded from the API on first use"""
+        index = self._indexes.setdefault(tenant_id, PlayerNameIndex(tenant_id))
+        if not index.loaded:
+            try:
+                await index.refresh()
+            except Exception as e:
+                print(f"Warning: Could not load player names for tenant {tenant_id}: {e}")
+        return index
+
+    async def refresh_periodically(self, interval=None):
+        """Keep all indexes up to date; run as a background task"""
+        interval = interval or int(os.getenv('PLAYER_INDEX_REFRESH_SECONDS', 300))
+        while True:
+            for index in list(self._indexes.values()):
+                try:
+                    await index.refresh()
+                    print(f"Player name index refreshed for tenant {index.tenant_id}: {len(index)} players")
+                except Exception as e:
+                    print(f"Warning: Could not refresh player name index for tenant {index.tenant_id}: {e}")
+            await asyncio.sleep(interval)
@@ -1,7 +1,6 @@
 CODENAMES_EXTRACTION_PROMPT = """IMPORTANT - Extracting stats from screenshot:
 - Look at the team panels on the left (Blue) and right (Red) sides to get the names of all participating players. Ignore potential spectators that are listed in the top middle.
-- Here is a list of known player names: %PLAYERS%
-- If an extracted name is very similar to an existing player name, assume that you made an extraction error and use the existing player name instead. 
+- Copy each player name exactly as displayed, including accents and capitalization.
 - Ignore the text at the top that states who won. It displays either "YOUR TEAM WINS" or "OTHER TEAM WINS" (potentially in a different language). It may also be missing if the image cropped it out.
 - Check if the black assassin word was selected (look for cards on the board):
   * ASSASSIN NOT SELECTED: If you can still see the text/word on the assassin card clearly visible, it has NOT been picked. This is a normal game end.
@@ -31,4 +30,8 @@ Return ONLY a JSON object with this structure:
   },
   "won_because_of_assassin": "blue" or "red" or omit this field entirely
 }
-Return ONLY the JSON, no other text."""
\ No newline at end of file
+Return ONLY the JSON, no other text."""
+
+BATCH_EXTRACTION_INSTRUCTIONS = """The %d screenshots above are separate games, labeled Image 1, Image 2, and so on.
+Extract each of them following the instructions, and return ONLY a JSON array with one object per image, in image order.
+Each object must have the structure described above. Return ONLY the JSON array, no other text."""
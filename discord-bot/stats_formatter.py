@@ -2,11 +2,13 @@ import os
 import discord
 import httpx
 
+from tenants import tenant_headers
+
 API_SERVER_URL = os.getenv('API_SERVER_URL', 'http://localhost:8000')
 
 
-def format_stats_embed():
-    """Create a Discord embed with formatted stats"""
+def format_stats_embed(tenant_id):
+    """Create a Discord embed with formatted stats for one tenant"""
     embed = discord.Embed(
         title="📊 Codenames Statistics",
         color=discord.Color.blue()
@@ -14,7 +16,7 @@ def format_stats_embed():
 
     try:
         # Use synchronous httpx client
-        with httpx.Client(timeout=10.0) as client:
+        with httpx.Client(timeout=10.0, headers=tenant_headers(tenant_id)) as client:
             # Get total games
             response = client.get(f"{API_SERVER_URL}/api/stats/total-games")
             response.raise_for_status()
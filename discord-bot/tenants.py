@@ -0,0 +1,77 @@
+import os
+
+import httpx
+
+API_SERVER_URL = os.getenv('API_SERVER_URL', 'http://localhost:8000')
+
+# Tenant of the games recorded before tenants existed (the schema v3 migration put them there)
+LEGACY_TENANT = 'default'
+
+# tenant_id -> X-Consistency-Token of the tenant's last write, so later reads see it
+consistency_tokens = {}
+
+# Guild that keeps recording into LEGACY_TENANT, see check_legacy_tenant
+legacy_guild_id = None
+
+
+def tenant_id_for(guild_id, channel_id=None):
+    """Tenant the API scopes stats to: TENANT_ID if set, otherwise the Discord guild (or channel)"""
+    if os.getenv('TENANT_ID'):
+        return os.getenv('TENANT_ID')
+    if guild_id is not None and guild_id == legacy_guild_id:
+        return LEGACY_TENANT
+    return str(guild_id or channel_id)
+
+
+async def has_games(http_client, tenant_id):
+    response = await http_client.get(f"{API_SERVER_URL}/api/stats/players",
+                                     headers=tenant_headers(tenant_id), timeout=10.0)
+    response.raise_for_status()
+    return len(response.json()) > 0
+
+
+async def check_legacy_tenant(guild_ids):
+    """
+    Keep the stats of a deployment from before tenants in use
+
+    Its games are in LEGACY_TENANT, while each guild records into a tenant of
+    its own. With TENANT_ID unset and a single guild whose own tenant is still
+    empty, that guild keeps recording into LEGACY_TENANT. Otherwise, if
+    LEGACY_TENANT has games the bot will not record into, say so loudly.
+    """
+    global legacy_guild_id
+    if os.getenv('TENANT_ID') == LEGACY_TENANT:
+        return
+    async with httpx.AsyncClient() as http_client:
+        if not await has_games(http_client, LEGACY_TENANT):
+            return
+        if not os.getenv('TENANT_ID') and len(guild_ids) == 1 and \
+                not await has_games(http_client, str(guild_ids[0])):
+            legacy_guild_id = guild_ids[0]
+            print(f"Recording games of guild {legacy_guild_id} into tenant '{LEGACY_TENANT}', which holds "
+                  f"the games from before tenants. Set TENANT_ID={LEGACY_TENANT} to keep this if the bot "
+                  f"joins more servers.")
+            return
+
+    writes_to = os.getenv('TENANT_ID') or 'one tenant per guild'
+    print("=" * 80)
+    print(f"WARNING: tenant '{LEGACY_TENANT}' holds games recorded before tenants existed, but the bot records "
+          f"into {writes_to}, so new games will not count towards those stats. Set TENANT_ID={LEGACY_TENANT} "
+          f"to keep recording there.")
+    print("=" * 80)
+
+
+def tenant_headers(tenant_id, headers=None):
+    """Add the X-Tenant-ID header used by the API server, and the tenant's consistency token"""
+    headers = dict(headers or {})
+    headers['X-Tenant-ID'] = tenant_id
+    if tenant_id in consistency_tokens:
+        headers['X-Consistency-Token'] = consistency_tokens[tenant_id]
+    return headers
+
+
+def remember_write(tenant_id, response):
+    """Keep the consistency token of a write, so reads through replicas include it"""
+    token = response.headers.get('X-Consistency-Token')
+    if token:
+        consistency_tokens[tenant_id] = token
@@ -0,0 +1,41 @@
+"""
+Correction of extracted player names. Run with: python -m pytest tests
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from player_index import PlayerNameIndex
+
+
+def game(blue_operatives, blue_spymasters, red_operatives, red_spymasters):
+    return {
+        'blue_team': {'operatives': list(blue_operatives), 'spymasters': list(blue_spymasters), 'count': 0},
+        'red_team': {'operatives': list(red_operatives), 'spymasters': list(red_spymasters), 'count': 2},
+    }
+
+
+def index(*names):
+    player_index = PlayerNameIndex('test', cutoff=0.8)
+    player_index.replace(names)
+    return player_index
+
+
+def test_corrects_case_accents_and_typos():
+    corrected = index('Nabi', 'Alexander').correct_game_data(game(['nabí'], ['Alexandre'], ['Zoe'], ['Kim']))
+    assert corrected['blue_team'] == {'operatives': ['Nabi'], 'spymasters': ['Alexander'], 'count': 0}
+    assert corrected['red_team']['operatives'] == ['Zoe']
+
+
+def test_known_name_is_claimed_once_per_game():
+    # Both are close to Alexander; only the closer one becomes Alexander
+    corrected = index('Alexander').correct_game_data(game(['Alexandre'], ['Alexandr'], [], []))
+    assert corrected['blue_team']['spymasters'] == ['Alexander']
+    assert corrected['blue_team']['operatives'] == ['Alexandre']
+
+
+def test_exact_name_keeps_its_player():
+    corrected = index('Alexander').correct_game_data(game(['Alexandr'], [], [], ['Alexander']))
+    assert corrected['red_team']['spymasters'] == ['Alexander']
+    assert corrected['blue_team']['operatives'] == ['Alexandr']
@@ -2,27 +2,40 @@ import os
 import discord
 import httpx
 
+from tenants import remember_write, tenant_headers, tenant_id_for
+
 API_SERVER_URL = os.getenv('API_SERVER_URL', 'http://localhost:8000')
 
 
+def game_version(response):
+    """Version of the game in a POST or PUT response, from its body or ETag; None if it has none"""
+    version = response.json().get('version')
+    if version is None and response.headers.get('ETag'):
+        version = int(response.headers['ETag'].strip('"'))
+    return version
+
+
 class EditGameButton(discord.ui.View):
-    def __init__(self, game_id, game_data, update_stats_callback):
+    def __init__(self, game_id, game_data, update_stats_callback, version):
         super().__init__(timeout=None)
         self.game_id = game_id
         self.game_data = game_data
         self.update_stats_callback = update_stats_callback
+        # Version of the game shown in the embed; edits made elsewhere since then are not overwritten
+        self.version = version
 
     @discord.ui.button(label="✏️ Edit Game", style=discord.ButtonStyle.secondary)
     async def edit_button(self, interaction: discord.Interaction, button: discord.ui.Button):
-        modal = EditGameModal(self.game_id, self.game_data, self.update_stats_callback)
+        modal = EditGameModal(self.game_id, self.game_data, self.update_stats_callback, self.version)
         await interaction.response.send_modal(modal)
 
 
 class EditGameModal(discord.ui.Modal, title="Edit Game Data"):
-    def __init__(self, game_id, game_data, update_stats_callback):
+    def __init__(self, game_id, game_data, update_stats_callback, version):
         super().__init__()
         self.game_id = game_id
         self.update_stats_callback = update_stats_callback
+        self.version = version
 
         # Winner
         self.winner_input = discord.ui.TextInput(
@@ -99,13 +112,23 @@ class EditGameModal(discord.ui.Modal, title="Edit Game Data"):
             }
 
             # Update database via API
+            tenant_id = tenant_id_for(interaction.guild_id, interaction.channel_id)
+            headers = tenant_headers(tenant_id, {'If-Match': f'"{self.version}"'})
             async with httpx.AsyncClient() as http_client:
                 response = await http_client.put(
                     f"{API_SERVER_URL}/api/games/{self.game_id}",
                     json=game_data,
+                    headers=headers,
                     timeout=10.0
                 )
+                if response.status_code == 409:
+                    await interaction.followup.send(
+                        "❌ This game was edited by someone else in the meantime. Check the current data and try again.",
+                        ephemeral=True
+                    )
+                    return
                 response.raise_for_status()
+                remember_write(tenant_id, response)
 
             # Update the embed
             new_embed = discord.Embed(
@@ -138,7 +161,7 @@ class EditGameModal(discord.ui.Modal, title="Edit Game Data"):
             # Edit original message with updated button
             await interaction.message.edit(
                 embed=new_embed,
-                view=EditGameButton(self.game_id, game_data, self.update_stats_callback)
+                view=EditGameButton(self.game_id, game_data, self.update_stats_callback, game_version(response))
             )
 
             # Update stats message
@@ -0,0 +1,119 @@
+// Frame times of the custom query page while a filter change renders its results.
+// The API is stubbed with instant responses, so only work in the browser is measured;
+// api-server/benchmarks/query_benchmark.py measures the server side.
+
+// One frame at 60 fps
+const FRAME_MS = 1000 / 60
+// Frames longer than this are long tasks: the page visibly stalls
+const LONG_FRAME_MS = 50
+// Games per page, as in CustomQuery.vue
+const PAGE_SIZE = 25
+
+const PLAYERS = Array.from({ length: 40 }, (_, i) => `Player ${i + 1}`)
+
+function pick(seed: number, count: number): number[] {
+  return Array.from({ length: count }, (_, i) => (seed * 7 + i * 13) % PLAYERS.length)
+}
+
+function stubQueryApi() {
+  const playerStats = {
+    format: 'columnar',
+    length: PLAYERS.length,
+    columns: {
+      name: PLAYERS,
+      total_games: PLAYERS.map(() => 500),
+      wins: PLAYERS.map(() => 250),
+      losses: PLAYERS.map(() => 250),
+      win_rate: PLAYERS.map(() => 50),
+    },
+  }
+  cy.intercept({ method: 'GET', pathname: '/api/stats/players' }, { body: playerStats })
+  cy.intercept({ method: 'POST', pathname: '/api/query' }, (req) => {
+    const ids = Array.from({ length: PAGE_SIZE }, (_, i) => 5_000 - i)
+    req.reply({
+      body: {
+        total_games: 5_000,
+        wins: 2_500,
+        losses: 2_500,
+        win_rate: 50,
+        game_ids: ids,
+        page: req.body.page,
+        page_size: PAGE_SIZE,
+        total_pages: 200,
+      },
+    })
+  }).as('query')
+  cy.intercept({ method: 'GET', pathname: '/api/games' }, (req) => {
+    const ids = String(req.query.ids).split(',').map(Number)
+    req.reply({
+      body: {
+        format: 'columnar',
+        length: ids.length,
+        players: PLAYERS,
+        columns: {
+          id: ids,
+          date: ids.map((id) => new Date(Date.UTC(2024, 0, 1) + id * 60_000).toISOString()),
+          winner: ids.map((id) => (id % 2 ? 'Blue' : 'Red')),
+          version: ids.map(() => 1),
+          won_because_of_assassin: ids.map(() => null),
+          blue_spymasters: ids.map((id) => pick(id, 1)),
+          blue_operatives: ids.map((id) => pick(id + 1, 3)),
+          blue_count: ids.map((id) => (id % 2 ? 0 : 2)),
+          red_spymasters: ids.map((id) => pick(id + 2, 1)),
+          red_operatives: ids.map((id) => pick(id + 3, 3)),
+          red_count: ids.map((id) => (id % 2 ? 3 : 0)),
+        },
+      },
+    })
+  }).as('games')
+}
+
+// Record the interval between animation frames until the returned function is called
+function recordFrames(win: Window) {
+  const frames: number[] = []
+  let last = win.performance.now()
+  let running = true
+  const tick = (now: number) => {
+    frames.push(now - last)
+    last = now
+    if (running) win.requestAnimationFrame(tick)
+  }
+  win.requestAnimationFrame(tick)
+  return () => {
+    running = false
+    return frames
+  }
+}
+
+function percentile(values: number[], fraction: number) {
+  const sorted = [...values].sort((a, b) => a - b)
+  return sorted[Math.min(Math.floor(sorted.length * fraction), sorted.length - 1)]!
+}
+
+describe('Custom query performance', () => {
+  it('renders a filter change without long frames', () => {
+    stubQueryApi()
+    cy.visit('/query')
+    cy.get('[role=combobox]').first().click()
+
+    let stop: () => number[]
+    cy.window().then((win) => {
+      stop = recordFrames(win)
+    })
+    cy.contains('[role=option]', 'Player 7').click()
+    cy.wait(['@query', '@games'])
+    cy.contains('Game #4976').should('be.visible')
+    // Let the frame that paints the results finish
+    cy.window().then((win) => new Cypress.Promise((resolve) => win.requestAnimationFrame(resolve)))
+
+    cy.then(() => {
+      const frames = stop()
+      const longest = Math.max(...frames)
+      cy.log(
+        `${frames.length} frames: p95 ${percentile(frames, 0.95).toFixed(1)} ms, ` +
+          `longest ${longest.toFixed(1)} ms (one frame is ${FRAME_MS.toFixed(1)} ms)`,
+      )
+      expect(longest, 'longest frame (ms)').to.be.lessThan(LONG_FRAME_MS)
+    })
+  })
+})
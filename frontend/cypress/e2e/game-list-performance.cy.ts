@@ -0,0 +1,144 @@
+// Render time of the virtualized game lists must not grow with the history.
+// GET /api/games is stubbed with a synthetic history served a page at a time
+// over the same cursor and limit the API uses, so no server is needed.
+
+const SMALL_HISTORY = 1_000
+const LARGE_HISTORY = 50_000
+
+// Time from navigation until the first rows are on screen
+const RENDER_BUDGET_MS = 2_000
+// How much slower the large history may render than the small one
+const GROWTH_BUDGET_MS = 500
+// Visible rows plus overscan; far below a page of games
+const MAX_ROWS_IN_DOM = 60
+// Games per page, as requested by useGamePages
+const PAGE_SIZE = 200
+// Pages scrolled through in the large history, i.e. 5,000 games in the list
+const PAGES_SCROLLED = 25
+
+const PLAYERS = Array.from({ length: 40 }, (_, i) => `Player ${i + 1}`)
+
+function pick(seed: number, count: number): number[] {
+  return Array.from({ length: count }, (_, i) => (seed * 7 + i * 13) % PLAYERS.length)
+}
+
+// A page in the ?format=columnar shape, for games with IDs from newest down to newest - length + 1
+function columnarPage(newest: number, length: number) {
+  const ids = Array.from({ length }, (_, i) => newest - i)
+  return {
+    format: 'columnar',
+    length,
+    players: PLAYERS,
+    columns: {
+      id: ids,
+      date: ids.map((id) => new Date(Date.UTC(2024, 0, 1) + id * 60_000).toISOString()),
+      winner: ids.map((id) => (id % 2 ? 'Blue' : 'Red')),
+      version: ids.map(() => 1),
+      won_because_of_assassin: ids.map(() => null),
+      blue_spymasters: ids.map((id) => pick(id, 1)),
+      blue_operatives: ids.map((id) => pick(id + 1, 3)),
+      blue_count: ids.map((id) => (id % 2 ? 0 : 2)),
+      red_spymasters: ids.map((id) => pick(id + 2, 1)),
+      red_operatives: ids.map((id) => pick(id + 3, 3)),
+      red_count: ids.map((id) => (id % 2 ? 3 : 0)),
+    },
+  }
+}
+
+function stubHistory(total: number) {
+  cy.intercept({ method: 'GET', pathname: '/api/games' }, (req) => {
+    const limit = Number(req.query.limit)
+    expect(limit, 'limit').to.be.within(1, 1000)
+    // The cursor is "<id>:<date>" of the last game of the previous page
+    const newest = req.query.cursor ? Number(String(req.query.cursor).split(':')[0]) - 1 : total
+    const length = Math.min(limit, newest)
+    const last = newest - length + 1
+    const headers: Record<string, string> = { 'Access-Control-Expose-Headers': 'X-Next-Cursor' }
+    if (last > 1) {
+      const date = new Date(Date.UTC(2024, 0, 1) + last * 60_000).toISOString()
+      headers['X-Next-Cursor'] = `${last}:${date}`
+    }
+    req.reply({ body: columnarPage(newest, length), headers })
+  }).as('gamesPage')
+}
+
+function measureFirstRender(path: string, scroller: string) {
+  cy.visit(path)
+  cy.get(`[data-testid=${scroller}] tbody tr`).should('be.visible')
+  return cy.window().then((win) => win.performance.now())
+}
+
+// Scroll to the end of the list, waiting for the page that loads each time
+function scrollPages(scroller: string, pages: number) {
+  for (let page = 0; page < pages; page++) {
+    cy.get(`[data-testid=${scroller}]`).scrollTo('bottom')
+    cy.wait('@gamesPage')
+  }
+}
+
+// ID shown in a row, the first cell of the game tables
+function rowId(row: JQuery<HTMLElement>) {
+  return Number(row.find('td').first().text())
+}
+
+describe('Game list performance', () => {
+  it('renders a large history about as fast as a small one', () => {
+    const renderTimes: Record<number, number> = {}
+    for (const total of [SMALL_HISTORY, LARGE_HISTORY]) {
+      stubHistory(total)
+      measureFirstRender('/games', 'game-log-scroller').then((elapsed) => {
+        renderTimes[total] = elapsed
+        cy.log(`${total} games: first rows after ${Math.round(elapsed)} ms`)
+        expect(elapsed).to.be.lessThan(RENDER_BUDGET_MS)
+      })
+      cy.get('[data-testid=game-log-scroller] tbody tr')
+        .its('length')
+        .should('be.lte', MAX_ROWS_IN_DOM)
+    }
+    cy.then(() => {
+      expect(renderTimes[LARGE_HISTORY]).to.be.lessThan(
+        renderTimes[SMALL_HISTORY]! + GROWTH_BUDGET_MS,
+      )
+    })
+  })
+
+  it('loads a small history page by page to its oldest game', () => {
+    const pages = SMALL_HISTORY / PAGE_SIZE
+    stubHistory(SMALL_HISTORY)
+    cy.visit('/games')
+    cy.wait('@gamesPage')
+    scrollPages('game-log-scroller', pages - 1)
+    cy.get('[data-testid=game-log-scroller]').scrollTo('bottom')
+    cy.get('[data-testid=game-log-scroller] tbody tr')
+      .last()
+      .should(($row) => expect(rowId($row)).to.equal(1))
+    // The last page had no cursor, so nothing more is requested
+    cy.get('@gamesPage.all').should('have.length', pages)
+  })
+
+  it('keeps the DOM bounded while scrolling thousands of games', () => {
+    stubHistory(LARGE_HISTORY)
+    cy.visit('/games')
+    cy.wait('@gamesPage')
+    scrollPages('game-log-scroller', PAGES_SCROLLED - 1)
+    cy.get('@gamesPage.all').should('have.length', PAGES_SCROLLED)
+    // Only rows near the end of the loaded games are rendered, not the thousands above
+    cy.get('[data-testid=game-log-scroller] tbody tr')
+      .should('have.length.lte', MAX_ROWS_IN_DOM)
+      .first()
+      .should(($row) =>
+        expect(rowId($row)).to.be.lessThan(LARGE_HISTORY - (PAGES_SCROLLED - 2) * PAGE_SIZE),
+      )
+  })
+
+  it('virtualizes the admin game list too', () => {
+    stubHistory(LARGE_HISTORY)
+    measureFirstRender('/admin', 'admin-games-scroller').then((elapsed) => {
+      expect(elapsed).to.be.lessThan(RENDER_BUDGET_MS)
+    })
+    scrollPages('admin-games-scroller', 4)
+    cy.get('[data-testid=admin-games-scroller] tbody tr')
+      .its('length')
+      .should('be.lte', MAX_ROWS_IN_DOM)
+  })
+})
@@ -0,0 +1,57 @@
+import { describe, it, expect, vi, beforeEach, afterEach } from 'vitest'
+
+import { cachedQuery, invalidateQueries } from '../services/queryCache'
+
+describe('cachedQuery', () => {
+  beforeEach(() => {
+    vi.useFakeTimers()
+    invalidateQueries()
+  })
+
+  afterEach(() => {
+    vi.useRealTimers()
+  })
+
+  it('shares one request between identical reads in flight', async () => {
+    const fetcher = vi.fn(async () => [1, 2, 3])
+    const [a, b] = await Promise.all([
+      cachedQuery('games', 1000, fetcher),
+      cachedQuery('games', 1000, fetcher),
+    ])
+    expect(fetcher).toHaveBeenCalledTimes(1)
+    expect(a).toBe(b)
+  })
+
+  it('serves stale data while refetching it in the background', async () => {
+    const fetcher = vi.fn().mockResolvedValueOnce('old').mockResolvedValueOnce('new')
+    await cachedQuery('stats', 1000, fetcher)
+    vi.advanceTimersByTime(1500)
+
+    expect(await cachedQuery('stats', 1000, fetcher)).toBe('old')
+    expect(fetcher).toHaveBeenCalledTimes(2)
+    await vi.runAllTimersAsync()
+    expect(await cachedQuery('stats', 1000, fetcher)).toBe('new')
+    expect(fetcher).toHaveBeenCalledTimes(2)
+  })
+
+  it('refetches after invalidation and ignores results of earlier requests', async () => {
+    let resolveFirst: (value: string) => void = () => {}
+    const fetcher = vi
+      .fn()
+      .mockReturnValueOnce(new Promise<string>((resolve) => (resolveFirst = resolve)))
+      .mockResolvedValueOnce('after write')
+    const first = cachedQuery('games', 1000, fetcher)
+    invalidateQueries()
+    resolveFirst('before write')
+    expect(await first).toBe('before write')
+
+    expect(await cachedQuery('games', 1000, fetcher)).toBe('after write')
+    expect(fetcher).toHaveBeenCalledTimes(2)
+  })
+
+  it('does not cache failures', async () => {
+    const fetcher = vi.fn().mockRejectedValueOnce(new Error('down')).mockResolvedValueOnce('up')
+    await expect(cachedQuery('total', 1000, fetcher)).rejects.toThrow('down')
+    expect(await cachedQuery('total', 1000, fetcher)).toBe('up')
+  })
+})
@@ -0,0 +1,60 @@
+import { ref, shallowRef } from 'vue'
+import { api } from '@/services/api'
+import type { Game } from '@/types/api'
+
+// Games loaded a page at a time, newest first, following the API's cursor.
+// The list is a shallowRef: games are replaced, never edited in place, and
+// thousands of them don't need deep reactivity.
+export function useGamePages(pageSize: number = 200) {
+  const games = shallowRef<Game[]>([])
+  const loading = ref(true)
+  const loadingMore = ref(false)
+  const error = ref<string | null>(null)
+
+  let cursor: string | null = null
+  let finished = false
+  // Bumped by reset(), so a page requested before it is dropped
+  let generation = 0
+
+  const hasMore = () => !finished && error.value === null
+
+  const loadMore = async () => {
+    if (!hasMore() || loadingMore.value) {
+      return
+    }
+    const startedIn = generation
+    loadingMore.value = true
+    try {
+      const page = await api.getGamesPage(cursor, pageSize)
+      if (startedIn !== generation) {
+        return
+      }
+      games.value = games.value.concat(page.games)
+      cursor = page.nextCursor
+      finished = cursor === null
+    } catch (e) {
+      if (startedIn === generation) {
+        error.value = e instanceof Error ? e.message : 'Failed to load games'
+      }
+    } finally {
+      if (startedIn === generation) {
+        loadingMore.value = false
+        loading.value = false
+      }
+    }
+  }
+
+  // Start over from the newest game, e.g. after a game was saved or deleted
+  const reset = async () => {
+    generation++
+    games.value = []
+    cursor = null
+    finished = false
+    error.value = null
+    loading.value = true
+    loadingMore.value = false
+    await loadMore()
+  }
+
+  return { games, loading, loadingMore, error, hasMore, loadMore, reset }
+}
@@ -1,62 +1,207 @@
 import type {
+  ColumnarGameColumns,
+  ColumnarResponse,
   Game,
+  GamesPage,
+  GameQuery,
+  GameQueryResponse,
   PlayerStat,
   PlayerRoleStat,
   TeamCombinationStat,
   TeamCombinationWithRoles,
   TotalGamesResponse,
 } from '@/types/api'
+import { cachedQuery, invalidateQueries } from '@/services/queryCache'
 
 const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000'
+// Community whose stats this dashboard shows; the API uses its default tenant if unset
+const TENANT_ID = import.meta.env.VITE_TENANT_ID
 
-console.log('API_BASE_URL', API_BASE_URL)
+// How long each kind of read is served from the cache before it is refetched
+const TTL_MS = {
+  games: 30_000,
+  gamesByIds: 5 * 60_000, // a game only changes through the writes below, which invalidate
+  query: 30_000,
+  stats: 60_000,
+}
+
+// X-Consistency-Token of our last write, sent with later requests so reads from
+// replicas include it
+let consistencyToken: string | null = null
 
-async function fetchAPI<T>(
-  endpoint: string,
-  options?: RequestInit,
-): Promise<T> {
-  console.log('API_BASE_URL', API_BASE_URL)
-  const response = await fetch(`${API_BASE_URL}${endpoint}`, options)
-  console.log(response)
+// If-Match header for a write conditional on the game version the user saw
+function ifMatch(version?: number): Record<string, string> {
+  return version === undefined ? {} : { 'If-Match': `"${version}"` }
+}
+
+async function request(endpoint: string, options?: RequestInit): Promise<Response> {
+  const headers = new Headers(options?.headers)
+  if (TENANT_ID) {
+    headers.set('X-Tenant-ID', TENANT_ID)
+  }
+  if (consistencyToken) {
+    headers.set('X-Consistency-Token', consistencyToken)
+  }
+  const response = await fetch(`${API_BASE_URL}${endpoint}`, { ...options, headers })
+  consistencyToken = response.headers.get('X-Consistency-Token') || consistencyToken
+  if (response.status === 409) {
+    throw new Error('This game was changed by someone else. Reload and try again.')
+  }
+  if (response.status === 429 || response.status === 503) {
+    const retryAfter = response.headers.get('Retry-After') || '1'
+    throw new Error(`The server is busy. Try again in ${retryAfter} s.`)
+  }
   if (!response.ok) {
     throw new Error(`API request failed: ${response.statusText}`)
   }
-  return response.json()
+  return response
+}
+
+async function fetchAPI<T>(endpoint: string, options?: RequestInit): Promise<T> {
+  return (await request(endpoint, options)).json()
+}
+
+// Rebuild the list of records from a ?format=columnar response
+export function decodeColumnar<T>(payload: ColumnarResponse): T[] {
+  const fields = Object.keys(payload.columns)
+  const records: T[] = new Array(payload.length)
+  for (let i = 0; i < payload.length; i++) {
+    const record: Record<string, unknown> = {}
+    for (const field of fields) {
+      record[field] = payload.columns[field]![i]
+    }
+    records[i] = record as T
+  }
+  return records
+}
+
+// Rebuild games, including raw_data, from a /api/games?format=columnar response
+export function decodeColumnarGames(payload: ColumnarResponse): Game[] {
+  const players = payload.players ?? []
+  const columns = payload.columns as unknown as ColumnarGameColumns
+  const names = (indexes: number[]) => indexes.map((index) => players[index]!)
+
+  const games: Game[] = new Array(payload.length)
+  for (let i = 0; i < payload.length; i++) {
+    const winner = columns.winner[i]!
+    const wonBecauseOfAssassin = columns.won_because_of_assassin[i]
+    games[i] = {
+      id: columns.id[i]!,
+      date: columns.date[i]!,
+      winner,
+      version: columns.version[i]!,
+      raw_data: {
+        blue_team: {
+          spymasters: names(columns.blue_spymasters[i]!),
+          operatives: names(columns.blue_operatives[i]!),
+          count: columns.blue_count[i]!,
+        },
+        red_team: {
+          spymasters: names(columns.red_spymasters[i]!),
+          operatives: names(columns.red_operatives[i]!),
+          count: columns.red_count[i]!,
+        },
+        winner,
+        ...(wonBecauseOfAssassin ? { won_because_of_assassin: wonBecauseOfAssassin } : {}),
+      },
+    }
+  }
+  return games
 }
 
 export const api = {
   // Get all games
   async getAllGames(): Promise<Game[]> {
-    return fetchAPI<Game[]>('/api/games')
+    return cachedQuery('games', TTL_MS.games, async () =>
+      decodeColumnarGames(await fetchAPI<ColumnarResponse>('/api/games?format=columnar')),
+    )
+  },
+
+  // Get a page of games, newest first, continuing from the cursor of the previous page
+  async getGamesPage(cursor: string | null = null, limit: number = 200): Promise<GamesPage> {
+    const params = new URLSearchParams({ limit: String(limit), format: 'columnar' })
+    if (cursor) {
+      params.set('cursor', cursor)
+    }
+    return cachedQuery(`games:page:${params}`, TTL_MS.games, async () => {
+      const response = await request(`/api/games?${params}`)
+      return {
+        games: decodeColumnarGames(await response.json()),
+        nextCursor: response.headers.get('X-Next-Cursor'),
+      }
+    })
+  },
+
+  // Get specific games by ID
+  async getGamesByIds(ids: number[]): Promise<Game[]> {
+    return cachedQuery(`games:${ids.join(',')}`, TTL_MS.gamesByIds, async () =>
+      decodeColumnarGames(
+        await fetchAPI<ColumnarResponse>(`/api/games?ids=${ids.join(',')}&format=columnar`),
+      ),
+    )
+  },
+
+  // Query games by player/role constraints (evaluated on the server)
+  async queryGames(query: GameQuery): Promise<GameQueryResponse> {
+    const body = JSON.stringify(query)
+    return cachedQuery(`query:${body}`, TTL_MS.query, () =>
+      fetchAPI<GameQueryResponse>('/api/query', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body,
+      }),
+    )
   },
 
   // Get player statistics
   async getPlayerStats(): Promise<PlayerStat[]> {
-    return fetchAPI<PlayerStat[]>('/api/stats/players')
+    return cachedQuery('stats:players', TTL_MS.stats, async () =>
+      decodeColumnar<PlayerStat>(
+        await fetchAPI<ColumnarResponse>('/api/stats/players?format=columnar'),
+      ),
+    )
   },
 
   // Get player statistics by role
   async getPlayerStatsByRole(): Promise<PlayerRoleStat[]> {
-    return fetchAPI<PlayerRoleStat[]>('/api/stats/players/by-role')
+    return cachedQuery('stats:players-by-role', TTL_MS.stats, async () =>
+      decodeColumnar<PlayerRoleStat>(
+        await fetchAPI<ColumnarResponse>('/api/stats/players/by-role?format=columnar'),
+      ),
+    )
   },
 
   // Get team combination statistics
   async getTeamCombinations(minGames: number = 2): Promise<TeamCombinationStat[]> {
-    return fetchAPI<TeamCombinationStat[]>(`/api/stats/team-combinations?min_games=${minGames}`)
+    return cachedQuery(`stats:team-combinations:${minGames}`, TTL_MS.stats, async () =>
+      decodeColumnar<TeamCombinationStat>(
+        await fetchAPI<ColumnarResponse>(
+          `/api/stats/team-combinations?min_games=${minGames}&format=columnar`,
+        ),
+      ),
+    )
   },
 
   // Get team combination statistics with role information
   async getTeamCombinationsWithRoles(
     minGames: number = 2,
   ): Promise<TeamCombinationWithRoles[]> {
-    return fetchAPI<TeamCombinationWithRoles[]>(
-      `/api/stats/team-combinations-with-roles?min_games=${minGames}`,
+    return cachedQuery(`stats:team-combinations-with-roles:${minGames}`, TTL_MS.stats, async () =>
+      decodeColumnar<TeamCombinationWithRoles>(
+        await fetchAPI<ColumnarResponse>(
+          `/api/stats/team-combinations-with-roles?min_games=${minGames}&format=columnar`,
+        ),
+      ),
     )
   },
 
   // Get total games count
   async getTotalGames(): Promise<TotalGamesResponse> {
-    return fetchAPI<TotalGamesResponse>('/api/stats/total-games')
+    return cachedQuery('stats:total-games', TTL_MS.stats, () =>
+      fetchAPI<TotalGamesResponse>('/api/stats/total-games'),
+    )
   },
 
   // Create a new game
@@ -64,17 +209,22 @@ export const api = {
     blue_team: { operatives: string[]; spymasters: string[] }
     red_team: { operatives: string[]; spymasters: string[] }
     winner: string
-  }): Promise<{ game_id: number; message: string }> {
-    return fetchAPI('/api/games', {
-      method: 'POST',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(gameData),
-    })
+  }): Promise<{ game_id: number; message: string; version?: number }> {
+    try {
+      return await fetchAPI('/api/games', {
+        method: 'POST',
+        headers: {
+          'Content-Type': 'application/json',
+        },
+        body: JSON.stringify(gameData),
+      })
+    } finally {
+      // Also on failure: a timed-out write may still have gone through
+      invalidateQueries()
+    }
   },
 
-  // Update an existing game
+  // Update an existing game, only if it is still at version when one is given
   async updateGame(
     gameId: number,
     gameData: {
@@ -82,20 +232,31 @@ export const api = {
       red_team: { operatives: string[]; spymasters: string[] }
       winner: string
     },
-  ): Promise<{ game_id: number; message: string }> {
-    return fetchAPI(`/api/games/${gameId}`, {
-      method: 'PUT',
-      headers: {
-        'Content-Type': 'application/json',
-      },
-      body: JSON.stringify(gameData),
-    })
+    version?: number,
+  ): Promise<{ game_id: number; message: string; version?: number }> {
+    try {
+      return await fetchAPI(`/api/games/${gameId}`, {
+        method: 'PUT',
+        headers: {
+          'Content-Type': 'application/json',
+          ...ifMatch(version),
+        },
+        body: JSON.stringify(gameData),
+      })
+    } finally {
+      invalidateQueries()
+    }
   },
 
-  // Delete a game
-  async deleteGame(gameId: number): Promise<{ game_id: number; message: string }> {
-    return fetchAPI(`/api/games/${gameId}`, {
-      method: 'DELETE',
-    })
+  // Delete a game, only if it is still at version when one is given
+  async deleteGame(gameId: number, version?: number): Promise<{ game_id: number; message: string }> {
+    try {
+      return await fetchAPI(`/api/games/${gameId}`, {
+        method: 'DELETE',
+        headers: ifMatch(version),
+      })
+    } finally {
+      invalidateQueries()
+    }
   },
 }
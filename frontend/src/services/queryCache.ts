@@ -0,0 +1,65 @@
+// Shared cache of API reads for the whole app. Identical reads in flight share
+// one request; a result younger than its TTL is served from memory; an older
+// one is still served at once (stale-while-revalidate) while a background
+// request refreshes it, until it is older than STALE_LIMIT_MS. Writes call
+// invalidateQueries() so nothing read before them is served afterwards.
+
+interface Entry {
+  data?: unknown
+  fetchedAt: number
+  // Request in flight for this key, shared by every caller
+  pending?: Promise<unknown>
+}
+
+// Beyond this age a cached result is not worth showing, even briefly
+const STALE_LIMIT_MS = 10 * 60 * 1000
+
+const entries = new Map<string, Entry>()
+
+// Bumped by invalidateQueries(); requests started before that don't fill the cache
+let generation = 0
+
+function load<T>(key: string, entry: Entry, fetcher: () => Promise<T>): Promise<T> {
+  const startedIn = generation
+  const pending = fetcher()
+    .then((data) => {
+      if (startedIn === generation) {
+        entries.set(key, { data, fetchedAt: Date.now() })
+      }
+      return data
+    })
+    .finally(() => {
+      if (entry.pending === pending) {
+        entry.pending = undefined
+      }
+    })
+  entry.pending = pending
+  return pending
+}
+
+export function cachedQuery<T>(key: string, ttlMs: number, fetcher: () => Promise<T>): Promise<T> {
+  let entry = entries.get(key)
+  if (!entry) {
+    entry = { fetchedAt: 0 }
+    entries.set(key, entry)
+  }
+  const age = Date.now() - entry.fetchedAt
+
+  if ('data' in entry && age < ttlMs) {
+    return Promise.resolve(entry.data as T)
+  }
+  if ('data' in entry && age < STALE_LIMIT_MS) {
+    if (!entry.pending) {
+      // The caller already has data; a failed refresh is retried on the next read
+      load(key, entry, fetcher).catch(() => {})
+    }
+    return Promise.resolve(entry.data as T)
+  }
+  return (entry.pending as Promise<T> | undefined) ?? load(key, entry, fetcher)
+}
+
+// Forget every cached result, e.g. after a game was created, edited or deleted
+export function invalidateQueries() {
+  generation++
+  entries.clear()
+}
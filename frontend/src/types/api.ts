@@ -1,18 +1,22 @@
 export interface TeamData {
   operatives: string[]
   spymasters: string[]
+  count?: number
 }
 
 export interface GameData {
   blue_team: TeamData
   red_team: TeamData
   winner: string
+  won_because_of_assassin?: string
 }
 
 export interface Game {
   id: number
   date: string
   winner: string
+  // Bumped on every edit; sent back as If-Match so concurrent edits don't overwrite each other
+  version: number
   raw_data: GameData
 }
 
@@ -52,3 +56,58 @@ export interface TeamCombinationWithRoles {
 export interface TotalGamesResponse {
   total_games: number
 }
+
+// One page of GET /api/games?limit=; pass nextCursor back for the following page
+export interface GamesPage {
+  games: Game[]
+  nextCursor: string | null
+}
+
+export interface QueryConstraint {
+  player: string
+  role: 'Any' | 'Operative' | 'Spymaster'
+  team?: 'Blue' | 'Red'
+}
+
+export interface GameQuery {
+  constraints: QueryConstraint[]
+  winner?: 'Blue' | 'Red'
+  date_from?: string
+  date_to?: string
+  page?: number
+  page_size?: number
+}
+
+export interface GameQueryResponse {
+  total_games: number
+  wins: number
+  losses: number
+  win_rate: number
+  game_ids: number[]
+  page: number
+  page_size: number
+  total_pages: number
+}
+
+// Compact list format returned for ?format=columnar: one array per field.
+// /api/games also sends player names once in `players` and refers to them by index.
+export interface ColumnarResponse {
+  format: 'columnar'
+  length: number
+  players?: string[]
+  columns: Record<string, unknown[]>
+}
+
+export interface ColumnarGameColumns {
+  id: number[]
+  date: string[]
+  winner: string[]
+  version: number[]
+  won_because_of_assassin: (string | null)[]
+  blue_spymasters: number[][]
+  blue_operatives: number[][]
+  blue_count: number[]
+  red_spymasters: number[][]
+  red_operatives: number[][]
+  red_count: number[]
+}